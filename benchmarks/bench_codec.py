@@ -0,0 +1,406 @@
+'''
+Microbenchmarks of the code run for every message sent or received.
+
+Each benchmark times a single operation (e.g. serializing one message) and
+reports operations per second along with the bytes it allocates, measured
+with tracemalloc as the peak memory the operation holds on top of what was
+allocated before it started.
+
+Results are compared to the baseline saved next to this script and the run
+fails if a benchmark got slower or allocates more than the baseline's
+thresholds allow. Timings depend on the machine, save a baseline on the
+machine used for comparing.
+
+Usage:
+    python benchmarks/bench_codec.py             Compare with the baseline
+    python benchmarks/bench_codec.py --save      Save results as the baseline
+    python benchmarks/bench_codec.py -k netid    Only run matching benchmarks
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+# Make the application's modules importable like the entry point does
+_g_ROOT_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__),
+                                             os.pardir, 'src'))
+
+for package in ('', 'connection', 'discovery', 'message', 'network',
+                'shared', 'ui'):
+    sys.path.insert(0, os.path.join(_g_ROOT_PATH, package))
+
+import config as c  # noqa: E402
+import framebuffer  # noqa: E402
+import msg  # noqa: E402
+import msgprotocol  # noqa: E402
+import netid  # noqa: E402
+import netpacket  # noqa: E402
+import netprotocol  # noqa: E402
+import wirecodec  # noqa: E402
+
+_g_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+
+# Thresholds used when the baseline does not give any. Slowdowns and extra
+# allocations are relative to the baseline.
+_g_DEFAULT_THRESHOLDS = {'ops_per_sec': 0.25, 'alloc_bytes_per_op': 0.10}
+# Allocation growth never counted as a regression, in bytes
+_g_ALLOC_SLACK_BYTES = 64
+
+_g_REPEATS = 5  # Timing runs per benchmark, the fastest is kept
+# Times a benchmark which looks slower is timed again before it counts as a
+# regression, a busy machine easily slows down a single measurement
+_g_RETRIES = 2
+_g_ALLOC_OPS = 50  # Operations measured for allocations per benchmark
+
+_g_ENCODING = 'utf-8'
+_g_SRC_GUID = 0x0123456789abcdef0123456789abcdef
+_g_DST_GUID = 0xfedcba9876543210fedcba9876543210
+
+# Text payloads by size
+_g_PAYLOADS = {'small': 'x' * 16,
+               'medium': 'x' * 1024,
+               'large': 'x' * (256 * 1024)}
+
+_g_FRAMES_PER_BUFFER = 64  # Frames buffered for the decode many scenario
+
+
+class Benchmark(object):
+    '''Structure representing a single benchmarked operation'''
+    def __init__(self, name, op):
+        '''
+        :param name: Unique name of the benchmark
+        :param op: Callable taking no arguments performing the operation
+        '''
+        self.name = name
+        self.op = op
+
+
+def __load_config():
+    '''
+    Loads an empty configuration holding only what the codec needs, the
+    user's configuration is left untouched
+    '''
+    with tempfile.TemporaryDirectory() as config_dir:
+        c.Config.load(os.path.join(config_dir, 'config.json'))
+
+    c.Config.set(c.ConfigEnum.BYTE_ENCODING, _g_ENCODING)
+
+
+def __mixed_msgs():
+    '''
+    :returns: List of messages of the types exchanged over a connection
+    '''
+    peer_id = netid.NetID(_g_SRC_GUID, 'benchmark')
+
+    return [msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_START, peer_id),
+            msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, 'hello there'),
+            msg.Msg(msg.MsgType.ENDPOINT_COMMUNICATION_ACK, 'ok'),
+            msg.Msg(msg.MsgType.ENDPOINT_PING, b''),
+            msg.Msg(msg.MsgType.ENDPOINT_FILE_OFFER, bytes(64)),
+            msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, 'x' * 1024),
+            msg.Msg(msg.MsgType.ENDPOINT_PONG, b''),
+            msg.Msg(msg.MsgType.ENDPOINT_DISCONNECTION, peer_id)]
+
+
+def __build_benchmarks():
+    '''
+    :returns: List of every Benchmark
+    '''
+    benchmarks = []
+    codec = wirecodec.WireCodec(_g_ENCODING)
+    binary_codec = wirecodec.WireCodec(_g_ENCODING, binary_timestamps=True)
+
+    for size, text in _g_PAYLOADS.items():
+        message = msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, text)
+        serialized_msg = msgprotocol.serialize(message)
+        packet = netpacket.NetPacket(_g_SRC_GUID, _g_DST_GUID, serialized_msg)
+        serialized_pkt = netprotocol.serialize(packet)
+        binary_pkt = binary_codec.encode_packet(_g_SRC_GUID, _g_DST_GUID,
+                                                message)
+
+        benchmarks += [
+            Benchmark(f'msg.encode_payload[{size}]',
+                      lambda m=message: msg.encode_payload(m.msg_type,
+                                                           m.payload)),
+            Benchmark(f'msgprotocol.serialize[{size}]',
+                      lambda m=message: msgprotocol.serialize(m)),
+            Benchmark(f'msgprotocol.deserialize[{size}]',
+                      lambda d=serialized_msg: msgprotocol.deserialize(d)),
+            Benchmark(f'netprotocol.serialize[{size}]',
+                      lambda p=packet: netprotocol.serialize(p)),
+            Benchmark(f'netprotocol.deserialize[{size}]',
+                      lambda d=serialized_pkt: netprotocol.deserialize(d)),
+            Benchmark(f'wirecodec.encode_packet[{size}]',
+                      lambda m=message: codec.encode_packet(_g_SRC_GUID,
+                                                            _g_DST_GUID, m)),
+            Benchmark(f'wirecodec.encode_packet.binary_ts[{size}]',
+                      lambda m=message: binary_codec.encode_packet(
+                          _g_SRC_GUID, _g_DST_GUID, m)),
+            Benchmark(f'wirecodec.view_packet.payload[{size}]',
+                      lambda d=binary_pkt: codec.view_packet(d).msg.payload)]
+
+    # Identification sent with every connection and disconnection
+    nid = netid.NetID(_g_SRC_GUID, 'benchmark endpoint')
+    serialized_nid = netid.tobytes(nid)
+
+    benchmarks += [
+        Benchmark('netid.tobytes', lambda: netid.tobytes(nid)),
+        Benchmark('netid.frombytes', lambda: netid.frombytes(serialized_nid)),
+        Benchmark('msg.encode_payload[netid]',
+                  lambda: msg.encode_payload(
+                      msg.MsgType.ENDPOINT_CONNECTION_START, nid))]
+
+    # Conversation of mixed message types, one operation covers every one
+    mixed_msgs = __mixed_msgs()
+    mixed_pkts = [codec.encode_packet(_g_SRC_GUID, _g_DST_GUID, message)
+                  for message in mixed_msgs]
+
+    def protocol_round_trip():
+        for message in mixed_msgs:
+            serialized_msg = msgprotocol.serialize(message)
+            serialized_pkt = netprotocol.serialize(
+                netpacket.NetPacket(_g_SRC_GUID, _g_DST_GUID, serialized_msg))
+            msgprotocol.deserialize(
+                netprotocol.deserialize(serialized_pkt).msg_payload)
+
+    def codec_round_trip():
+        for message in mixed_msgs:
+            codec.view_packet(codec.encode_packet(
+                _g_SRC_GUID, _g_DST_GUID, message)).msg.payload
+
+    benchmarks += [
+        Benchmark('mixed.protocol_round_trip', protocol_round_trip),
+        Benchmark('mixed.codec_round_trip', codec_round_trip)]
+
+    # Burst of frames waiting in a receive buffer
+    burst = b''.join(mixed_pkts[i % len(mixed_pkts)]
+                     for i in range(_g_FRAMES_PER_BUFFER))
+
+    def decode_many():
+        rx_buffer = __filled_frame_buffer(burst)
+
+        for record in rx_buffer.decode_many(codec):
+            codec.view_frame(record).msg.msg_type
+
+    def receive():
+        # Every message decoded, as when each is passed on to the UI
+        rx_buffer = __filled_frame_buffer(burst)
+
+        for record in rx_buffer.decode_many(codec):
+            codec.view_frame(record).msg.payload
+
+    benchmarks += [
+        Benchmark('burst.decode_many', decode_many),
+        Benchmark('burst.receive', receive),
+        Benchmark('burst.scan_headers',
+                  lambda: codec.decode_many(burst))]
+
+    return benchmarks
+
+
+def __filled_frame_buffer(data):
+    '''
+    :param data: Bytes received
+    :returns: FrameBuffer holding the data as if it was just received
+    '''
+    class _Socket(object):
+        def recv_into(self, view):
+            view[:len(data)] = data
+            return len(data)
+
+    rx_buffer = framebuffer.FrameBuffer(len(data)
+                                        + framebuffer.FrameBuffer
+                                        .MIN_READ_SZ_BYTES)
+    rx_buffer.recv_into(_Socket())
+
+    return rx_buffer
+
+
+def __time_ops(op):
+    '''
+    :param op: Callable to time
+    :returns: Operations per second of the fastest run
+    '''
+    timer = timeit.Timer(op)
+    num_ops, _ = timer.autorange()
+    best_sec = min(timer.repeat(repeat=_g_REPEATS, number=num_ops))
+
+    return num_ops / best_sec
+
+
+def __measure_alloc(op):
+    '''
+    :param op: Callable to measure
+    :returns: Mean of the peak bytes allocated by each operation
+    '''
+    op()  # Let caches fill before measuring
+
+    tracemalloc.start()
+
+    try:
+        total_bytes = 0
+
+        for _ in range(_g_ALLOC_OPS):
+            tracemalloc.reset_peak()
+            start_bytes, _ = tracemalloc.get_traced_memory()
+            op()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            total_bytes += peak_bytes - start_bytes
+    finally:
+        tracemalloc.stop()
+
+    return total_bytes / _g_ALLOC_OPS
+
+
+def __load_baseline(path):
+    '''
+    :param path: Path of the baseline file
+    :returns: Baseline dict, None if there is no baseline
+    '''
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+
+
+def __save_baseline(path, results, thresholds):
+    '''
+    :param path: Path of the baseline file
+    :param results: Results by benchmark name
+    :param thresholds: Regression thresholds to store with the results
+    '''
+    baseline = {'python': sys.version.split()[0],
+                'thresholds': thresholds,
+                'results': results}
+
+    with open(path, 'w') as json_file:
+        json.dump(baseline, json_file, indent=2, sort_keys=True)
+        json_file.write('\n')
+
+
+def __compare(result, base, thresholds):
+    '''
+    :param result: Result of this run
+    :param base: Baseline result of the same benchmark
+    :param thresholds: Regression thresholds
+    :returns: Tuple of (change in ops/s as a fraction, list of regressions)
+    '''
+    speed_change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+    regressions = []
+
+    if speed_change < -thresholds['ops_per_sec']:
+        regressions.append(f'{-speed_change:.0%} slower')
+
+    alloc_limit = base['alloc_bytes_per_op'] \
+        * (1 + thresholds['alloc_bytes_per_op']) + _g_ALLOC_SLACK_BYTES
+
+    if result['alloc_bytes_per_op'] > alloc_limit:
+        regressions.append('allocates %d B more'
+                           % (result['alloc_bytes_per_op']
+                              - base['alloc_bytes_per_op']))
+
+    return speed_change, regressions
+
+
+def main():
+    '''
+    Runs the benchmarks
+
+    :returns: Exit status, 1 if a benchmark regressed
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of message and packet serialization')
+    parser.add_argument('-k', dest='pattern', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=_g_BASELINE_PATH,
+                        help='path of the baseline file')
+    parser.add_argument('--tolerance', type=float,
+                        help='slowdown accepted as a fraction of the '
+                             'baseline, overrides the baseline\'s threshold')
+    args = parser.parse_args()
+
+    __load_config()
+
+    baseline = __load_baseline(args.baseline)
+    thresholds = dict(_g_DEFAULT_THRESHOLDS)
+
+    if baseline is not None:
+        thresholds.update(baseline.get('thresholds', {}))
+
+    if args.tolerance is not None:
+        thresholds['ops_per_sec'] = args.tolerance
+
+    results = {}
+    failures = []
+
+    print('%-44s %14s %12s %9s' % ('benchmark', 'ops/s', 'alloc B/op',
+                                   'vs base'))
+
+    for benchmark in __build_benchmarks():
+        if args.pattern not in benchmark.name:
+            continue
+
+        result = {'ops_per_sec': __time_ops(benchmark.op),
+                  'alloc_bytes_per_op': __measure_alloc(benchmark.op)}
+        results[benchmark.name] = result
+
+        change = ''
+        base = None if baseline is None \
+            else baseline['results'].get(benchmark.name)
+
+        if base is not None and not args.save:
+            speed_change, regressions = __compare(result, base, thresholds)
+
+            for _ in range(_g_RETRIES):
+                if speed_change >= -thresholds['ops_per_sec']:
+                    break
+
+                result['ops_per_sec'] = max(result['ops_per_sec'],
+                                            __time_ops(benchmark.op))
+                speed_change, regressions = __compare(result, base,
+                                                      thresholds)
+
+            change = f'{speed_change:+.0%}'
+
+            if regressions:
+                failures.append((benchmark.name, regressions))
+
+        print('%-44s %14.0f %12.0f %9s' % (benchmark.name,
+                                           result['ops_per_sec'],
+                                           result['alloc_bytes_per_op'],
+                                           change))
+
+    if args.save:
+        if args.pattern and baseline is not None:
+            # Keep baseline results of the benchmarks not run
+            results = dict(baseline['results'], **results)
+
+        __save_baseline(args.baseline, results, thresholds)
+        print(f'\nSaved baseline to {args.baseline}')
+        return 0
+
+    if baseline is None:
+        print('\nNo baseline to compare with, save one with --save')
+        return 0
+
+    if failures:
+        print('\nRegressions:')
+
+        for name, regressions in failures:
+            print(f'  {name}: {", ".join(regressions)}')
+
+        return 1
+
+    print('\nNo regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
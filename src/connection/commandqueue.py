@@ -0,0 +1,168 @@
+'''
+Module providing a thread-safe queue for passing commands into a
+selector-driven mainloop running on another thread.
+'''
+import collections
+import socket
+import threading
+
+
+class CommandQueue(object):
+    '''
+    Multi-producer, single-consumer queue of commands. Producers on any
+    thread queue commands; the consumer drains them in batches from its
+    mainloop.
+
+    The consumer's selector watches 'wakeup_socket' and calls
+    'clear_wakeup' when it is readable. A wakeup is only signalled when the
+    consumer is blocked in its selector and has not already been
+    signalled, so a burst of commands costs a single wakeup.
+    '''
+    WAKEUP_RECV_SZ = 1024  # Max size of wakeup data cleared at once
+
+    def __init__(self):
+        '''CommandQueue initialization'''
+        opt_val = 1  # For setting socket options
+
+        self._commands = collections.deque()  # Queued (func, args) pairs
+        self._lock = threading.Lock()  # Guards the flags below
+        self._sleeping = False  # Consumer is blocked in its selector
+        self._signalled = False  # Wakeup sent but not yet cleared
+
+        # Create/Configure TCP socket pair for waking the consumer
+        self._wakeup_send, self.wakeup_socket \
+            = socket.socketpair(family=socket.AF_INET)
+
+        self._wakeup_send.setsockopt(socket.SOL_SOCKET,
+                                     socket.SO_REUSEADDR,
+                                     opt_val)
+        self.wakeup_socket.setsockopt(socket.SOL_SOCKET,
+                                      socket.SO_REUSEADDR,
+                                      opt_val)
+        self.wakeup_socket.setblocking(False)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def put(self, func, *args):
+        '''
+        Queues a command to be run on the consumer's thread
+
+        :param func: Function to call
+        :param args: Arguments to call the function with
+        '''
+        self._commands.append((func, args))
+
+        with self._lock:
+            if not self._sleeping or self._signalled:
+                # Consumer will see the command without being woken
+                return
+
+            self._signalled = True
+
+        self._wakeup_send.send(b'1')
+
+    def wakeup(self):
+        '''Unconditionally wakes the consumer'''
+        with self._lock:
+            self._signalled = True
+
+        self._wakeup_send.send(b'1')
+
+    def prepare_sleep(self, timeout=None):
+        '''
+        Called by the consumer right before blocking in its selector
+
+        :param timeout: Timeout the consumer intends to block for
+        :returns: Timeout to actually block for, 0 if commands are queued
+        '''
+        with self._lock:
+            if self._commands:
+                return 0
+
+            self._sleeping = True
+
+        return timeout
+
+    def clear_wakeup(self):
+        '''Called by the consumer when 'wakeup_socket' is readable'''
+        try:
+            self.wakeup_socket.recv(CommandQueue.WAKEUP_RECV_SZ)
+        except BlockingIOError:
+            pass  # Wakeup data already cleared
+
+    def drain(self):
+        '''
+        Called by the consumer after its selector returns. Takes every
+        queued command.
+
+        :returns: List of (func, args) pairs in the order they were queued
+        '''
+        with self._lock:
+            self._sleeping = False
+            self._signalled = False
+
+        commands = []
+
+        while self._commands:
+            commands.append(self._commands.popleft())
+
+        return commands
+
+    def close(self):
+        '''Releases socket resources'''
+        self._wakeup_send.close()
+        self.wakeup_socket.close()
+
+
+# Unit Testing
+def test():
+    import selectors
+
+    command_queue = CommandQueue()
+    selector = selectors.DefaultSelector()
+    selector.register(command_queue.wakeup_socket, selectors.EVENT_READ)
+    results = []
+
+    try:
+        # Commands queued while the consumer is awake never wake it
+        command_queue.put(results.append, 1)
+
+        if command_queue.prepare_sleep(5.0) != 0 \
+                or selector.select(timeout=0):
+            raise ValueError('Awake consumer woken during testing')
+
+        # Burst of commands from another thread costs a single wakeup
+        command_queue.drain()
+
+        if command_queue.prepare_sleep(5.0) != 5.0:
+            raise ValueError('Consumer not let sleep during testing')
+
+        producer = threading.Thread(
+            target=lambda: [command_queue.put(results.append, num)
+                            for num in range(2, 100)])
+        producer.start()
+        producer.join()
+
+        if len(selector.select(timeout=5.0)) != 1:
+            raise ValueError('Sleeping consumer not woken during testing')
+
+        command_queue.clear_wakeup()
+
+        for func, args in command_queue.drain():
+            func(*args)
+
+        if results != list(range(2, 100)) or len(command_queue):
+            raise ValueError('Commands lost during testing')
+
+        # Only a single wakeup was sent, it has been cleared
+        try:
+            command_queue.wakeup_socket.recv(1)
+        except BlockingIOError:
+            return
+
+        raise ValueError('Consumer woken twice during testing')
+
+    finally:
+        selector.close()
+        command_queue.close()
@@ -0,0 +1,140 @@
+'''
+Module providing streaming compression of the messages sent over a
+connection.
+
+Each direction of a connection shares one zlib stream, so phrases repeated
+across messages compress to back-references to earlier messages. Every
+compressed message is flushed to a byte boundary so the receiver can act on
+it as soon as it arrives.
+'''
+import zlib
+
+
+class MessageCompressor(object):
+    '''
+    Compresses messages sent over a connection. Short messages are left as
+    they are. Since every message passed through the stream has to reach
+    the receiver, data which stops compressing makes the compressor back
+    off, leaving a growing number of messages uncompressed before trying
+    again.
+    '''
+    MAX_BACKOFF_MSGS = 64  # Most messages left uncompressed in a row
+
+    def __init__(self, min_sz, zdict=None):
+        '''
+        :param min_sz: Shortest message compressed in bytes
+        :param zdict: Preset dictionary the receiver also uses, if any
+        '''
+        self.min_sz = min_sz
+
+        if zdict:
+            self._zobj = zlib.compressobj(zdict=zdict)
+        else:
+            self._zobj = zlib.compressobj()
+
+        self._backoff = 0  # Messages to skip after the next miss
+        self._skip = 0  # Messages still to skip before trying again
+
+    def compress(self, data):
+        '''
+        :param data: Serialized message
+        :returns: Compressed message, None if the message should be sent
+                  uncompressed
+        '''
+        if len(data) < self.min_sz:
+            return None
+
+        if self._skip:
+            self._skip -= 1
+            return None
+
+        compressed = self._zobj.compress(data) \
+            + self._zobj.flush(zlib.Z_SYNC_FLUSH)
+
+        if len(compressed) < len(data):
+            self._backoff = 0
+        else:
+            # Data is not compressing, stop trying for a while
+            self._backoff = min(2 * self._backoff or 1,
+                                MessageCompressor.MAX_BACKOFF_MSGS)
+            self._skip = self._backoff
+
+        return compressed
+
+
+class MessageDecompressor(object):
+    '''Decompresses messages received over a connection'''
+    def __init__(self, max_sz, zdict=None):
+        '''
+        :param max_sz: Longest decompressed message accepted in bytes
+        :param zdict: Preset dictionary the sender also uses, if any
+        '''
+        self.max_sz = max_sz
+
+        if zdict:
+            self._zobj = zlib.decompressobj(zdict=zdict)
+        else:
+            self._zobj = zlib.decompressobj()
+
+    def decompress(self, data):
+        '''
+        :param data: Compressed message
+        :returns: Serialized message
+        :raises ValueError: If the data is corrupt or decompresses too long,
+                            the stream cannot be used afterwards
+        '''
+        try:
+            message = self._zobj.decompress(data, self.max_sz)
+        except zlib.error as e:
+            raise ValueError(f'Compressed message is corrupt: {e}')
+
+        if self._zobj.unconsumed_tail:
+            raise ValueError('Compressed message is too long')
+
+        return message
+
+
+# Unit Testing
+def test():
+    import os
+
+    zdict = b'hello there, how are you doing today?'
+
+    for dictionary in (None, zdict):
+        compressor = MessageCompressor(min_sz=32, zdict=dictionary)
+        decompressor = MessageDecompressor(max_sz=4096, zdict=dictionary)
+
+        # Messages round trip, repeats shrink to references to earlier ones
+        sizes = []
+
+        for _ in range(3):
+            message = b'hello there, how are you doing today? ' * 4
+            compressed = compressor.compress(message)
+            sizes.append(len(compressed))
+
+            if decompressor.decompress(compressed) != message:
+                raise ValueError('Message changed in round trip during '
+                                 'testing')
+
+        if sizes[-1] >= sizes[0] or compressor.compress(b'short'):
+            raise ValueError('Messages compressed wrongly during testing')
+
+    # Incompressible data makes the compressor back off
+    compressor = MessageCompressor(min_sz=32)
+    results = [compressor.compress(os.urandom(256)) for _ in range(4)]
+
+    if results[0] is None or results[1] is not None \
+            or results[2] is None or results[3] is not None:
+        raise ValueError('Compressor did not back off during testing')
+
+    # Corrupt data, messages longer than allowed and messages needing a
+    # dictionary the receiver lacks are rejected
+    for data in (b'not compressed',
+                 MessageCompressor(min_sz=0).compress(bytes(8192)),
+                 MessageCompressor(min_sz=0, zdict=zdict).compress(zdict)):
+        try:
+            MessageDecompressor(max_sz=4096).decompress(data)
+        except ValueError:
+            continue
+
+        raise ValueError('Invalid message accepted during testing')
@@ -2,119 +2,1692 @@
 Module providing server for managing Endpoint connections.
 Server runs on a separate thread from caller.
 """
+import batchprotocol
+import chunkprotocol
+import collections
+import commandqueue
+import compression
+import connectscheduler
 import datapassing
 import datapassing_protocol as dproto
+import errno
+import fileprotocol
+import filetransfer
+import framebuffer
+import handshakeprotocol
+import itertools
 import logging
 import msg
-import msgprotocol
 import netid
-import netpacket
 import netprotocol
+import os
+import outboundqueue
 import queue
-import select
+import selectors
+import sendbuffer
 import config as c
 import socket
 import threading
+import time
+import timerwheel
+import timeutils
+import wirecodec
+import wireencoder
+import writescheduler
+import zlib
 
 _g_logger = logging.getLogger(__name__)
 
+# Defaults for configuration used by the connection manager
+CONFIG_DEFAULTS = {
+    c.ConfigEnum.MAX_PENDING_CONNECTIONS: 16,
+    c.ConfigEnum.CONNECTION_TIMEOUT: 2.0,
+    c.ConfigEnum.CONNECTION_RETRIES: 3,
+    c.ConfigEnum.OUTBOUND_QUEUE_MAX_MSGS: 256,
+    c.ConfigEnum.OUTBOUND_QUEUE_MAX_BYTES: 1024 * 1024,
+    c.ConfigEnum.OUTBOUND_QUEUE_POLICY:
+        outboundqueue.OverflowPolicy.REJECT.value,
+    c.ConfigEnum.HEARTBEAT_INTERVAL: 10.0,
+    c.ConfigEnum.HEARTBEAT_TIMEOUT: 30.0,
+    c.ConfigEnum.HANDSHAKE_TIMEOUT: 10.0,
+    c.ConfigEnum.MAX_OPEN_CONNECTIONS: 64,
+    c.ConfigEnum.IDLE_TIMEOUT: 600.0,
+    c.ConfigEnum.DOWNLOAD_DIR: os.path.join(os.path.expanduser('~'),
+                                            'Downloads'),
+    c.ConfigEnum.MAX_INCOMING_FILE_SIZE: 4 * 1024 ** 3,
+    c.ConfigEnum.FILE_STREAMS: 4,
+    c.ConfigEnum.COMPRESSION: True,
+    c.ConfigEnum.COMPRESSION_DICT: None
+}
+
+# Max bytes moved from a connection's queue into its send buffer at once.
+# Anything beyond this stays in the bounded queue so backpressure applies.
+_g_TX_HIGH_WATER_BYTES = 64 * 1024
+
+# Bytes each writable connection may send per round, and the max bytes sent
+# over all connections before the mainloop goes back to servicing reads
+_g_SEND_QUANTUM_BYTES = 16 * 1024
+_g_SEND_BUDGET_BYTES = 256 * 1024
+
+# Limits on chunked messages being reassembled per connection
+_g_MAX_PENDING_CHUNKED_MSGS = 4
+_g_MAX_CHUNKED_MSG_SZ_BYTES = 16 * 1024 * 1024
+
+# Max bytes of a file sent per segment. Messages queued meanwhile wait for
+# the segment in progress, so this bounds the delay files add to chat.
+_g_FILE_SEGMENT_SZ_BYTES = 256 * 1024
+
+# Files with at least this much left to send are split over parallel
+# streams, each on its own connection, leaving the Endpoint's connection
+# free for messages
+_g_PARALLEL_FILE_MIN_SZ_BYTES = 64 * 1024 * 1024
+
+# Seconds between reports of file transfer progress to the UI
+_g_FILE_PROGRESS_INTERVAL_SEC = 1.0
+
+# Source of IDs for file transfers offered by the host
+_g_file_transfer_ids = itertools.count()
+
+# Messages serialized shorter than this are never compressed, compressing
+# them saves too little to be worth the time
+_g_COMPRESSION_MIN_SZ_BYTES = 256
+
+# Longest message accepted out of a compressed message
+_g_MAX_DECOMPRESSED_SZ_BYTES = 1024 * 1024
+
+# Resolution and size of the timer wheel holding the mainloop's deadlines
+_g_TIMER_TICK_SEC = 0.1
+_g_TIMER_SLOTS = 512
+
+# Outbound queue lane each type of message is sent in. Signalling is never
+# held up behind user communication.
+_g_MSG_LANES = {
+    msg.MsgType.ENDPOINT_CONNECTION_START: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_CONNECTION_OPTIONS: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_DISCONNECTION: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_CONNECTION_PARK: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_COMMUNICATION_ACK: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_PING: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_PONG: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_FILE_ACCEPT: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_FILE_DECLINE: outboundqueue.Lane.CONTROL,
+    msg.MsgType.ENDPOINT_TEXT_COMMUNICATION: outboundqueue.Lane.CHAT,
+    msg.MsgType.ENDPOINT_FILE_OFFER: outboundqueue.Lane.CHAT,
+    msg.MsgType.ENDPOINT_CHUNK: outboundqueue.Lane.BULK
+}
+
+# Error codes reported by a non-blocking connect which is still in progress
+_g_CONNECT_IN_PROGRESS = (errno.EINPROGRESS,
+                          errno.EWOULDBLOCK,
+                          getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+
 
 class Connection(object):
     '''Class defining all data related to a connection'''
-    def __init__(self, name, sock):
+    def __init__(self, name, sock, guid=None, address=None, outbound=False,
+                 protocol_version=handshakeprotocol.g_ORIGINAL_VERSION):
+        '''
+        :param name: Friendly name of the Endpoint, None if not yet known
+        :param sock: TCP socket connected to the Endpoint
+        :param guid: GUID of the Endpoint, None if not yet known
+        :param address: Remote socket address of the connection
+        :param outbound: True if the host opened the connection
+        :param protocol_version: Protocol version the Endpoint is known to
+                                 speak, updated once options are negotiated
+        '''
+        self.guid = guid
+        self.address = address
+        self.outbound = outbound
+        self.retired = False  # Lost to a duplicate connection, closing
         self.friendly_name = name
         self.tcp_socket = sock
-        self.outmsg_queue = queue.Queue()
+        self.outmsg_queue = outboundqueue.OutboundQueue(
+            *_g_outbound_limits, on_congestion=self.report_congestion)
+        self.rx_buffer = framebuffer.FrameBuffer()
+        self.tx_buffer = sendbuffer.SendBuffer()
+        self.reassembler = chunkprotocol.Reassembler(
+            _g_MAX_PENDING_CHUNKED_MSGS, _g_MAX_CHUNKED_MSG_SZ_BYTES)
+        self.last_rx_time = time.monotonic()  # When data was last received
+        self.last_active_time = self.last_rx_time  # When last used by user
+        self.timer = None  # Timer for the next handshake/liveness deadline
+        self.sending_files = collections.deque()  # Accepted OutgoingFiles
+        self.incoming_files = {}  # {transfer ID: IncomingFile}
+        self.rx_file = None  # IncomingFile whose raw data is being received
+        self.options_sent = False  # Host's options were sent to the Endpoint
+        self.protocol_version = protocol_version
+        self.options = handshakeprotocol.Option(0)  # Options agreed on
+        self.encoder = wireencoder.select(self.options)
+        self.compressor = None  # MessageCompressor once compression agreed
+        self.decompressor = None  # MessageDecompressor once agreed
+
+    def report_congestion(self, congested):
+        '''
+        Tells the UI whether the Endpoint is keeping up with sent data.
+        Called by the outbound queue from whichever thread used it.
+
+        :param congested: True if the queue filled up, False once drained
+        '''
+        if self.guid is not None:
+            datapassing.pass_msg(dproto.DPBackpressureMsg(self.guid,
+                                                          congested))
+
+
+class ParkedPeer(object):
+    '''
+    Structure representing an Endpoint whose idle connection was closed.
+    Endpoint stays known to the UI and is reconnected to when sent to.
+    '''
+    def __init__(self, net_id, address, outmsg_queue, protocol_version,
+                 options):
+        '''
+        :param net_id: NetID of the Endpoint
+        :param address: Socket address to reconnect to as (host, port)
+        :param outmsg_queue: OutboundQueue of packets awaiting reconnection
+        :param protocol_version: Protocol version the Endpoint spoke
+        :param options: handshakeprotocol.Option flags the Endpoint agreed to
+        '''
+        self.net_id = net_id
+        self.address = address
+        self.outmsg_queue = outmsg_queue
+        self.protocol_version = protocol_version
+        self.options = options
+
+
+def send_text_msg(text_message):
+    '''
+    Queues text message to be sent to an Endpoint. Safe to call from any
+    thread. Called on the data passing thread, which every message between
+    the UI and backend goes through, so by default a full queue rejects
+    the message instead of blocking.
+
+    :param text_message: DPTextMsg to send
+    '''
+    dst_guid = text_message.destination_id
+
+    if dst_guid == _g_HOST_GUID:
+        _g_logger.error("Tried to send text message to self")
+        return
+
+    # Construct Endpoint message
+    endpoint_msg = msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION,
+                           text_message.data,
+                           text_message.timestamp)
+
+    connection = _g_connection_registry.get(dst_guid)
+    parked = _g_parked_peers.get(dst_guid)
+
+    if connection is not None:
+        connection.last_active_time = time.monotonic()
+        outmsg_queue = connection.outmsg_queue
+        encoder = connection.encoder
+
+    elif parked is not None:
+        # Idle connection was closed, packet waits for reconnection. Format
+        # the next connection negotiates is not known yet, so the original
+        # format is used, chunked if the Endpoint agreed to chunks before.
+        outmsg_queue = parked.outmsg_queue
+        encoder = wireencoder.select(
+            parked.options & handshakeprotocol.Option.CHUNKING)
+
+    else:
+        _g_logger.error("Unable to send packet to unknown Endpoint")
+        return
+
+    try:
+        encoded_pkts, lane = __packetize(dst_guid, endpoint_msg, encoder)
+    except ValueError as e:
+        _g_logger.error(f'Unable to send message to {dst_guid}: {e}')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            'Unable to send message, too long for peer'))
+        return
+
+    # Queue packets directly, bounded queue pushes back on a slow Endpoint.
+    # Packets of a chunked message are only ever queued or dropped together.
+    try:
+        was_empty = outmsg_queue.put_all(encoded_pkts, lane)
+    except queue.Full:
+        _g_logger.error(f'Outbound queue to {dst_guid} full, '
+                        'dropping message')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            'Unable to send message, peer is slow'))
+        return
+
+    if not was_empty:
+        # Mainloop was already told about earlier packets
+        pass
+    elif connection is not None:
+        # Have the mainloop start watching the socket for writability
+        _g_command_queue.put(__watch_writable, connection)
+    else:
+        _g_command_queue.put(__reconnect, dst_guid)
+
+
+def send_file(file_message):
+    '''
+    Offers a file to an Endpoint. Safe to call from any thread. File is
+    sent once the Endpoint accepts it and offered again whenever the
+    Endpoint reconnects before the whole file was sent.
+
+    :param file_message: DPFileMsg naming the file to send
+    '''
+    if file_message.destination_id == _g_HOST_GUID:
+        _g_logger.error("Tried to send file to self")
+        return
+
+    _g_command_queue.put(__offer_file,
+                         file_message.destination_id,
+                         file_message.path)
+
+
+def answer_file_offer(offer_message):
+    '''
+    Accepts or declines a file the user was asked about. Safe to call from
+    any thread.
+
+    :param offer_message: DPFileOfferMsg carrying the user's answer
+    '''
+    _g_command_queue.put(__answer_file_offer,
+                         offer_message.endpoint_id,
+                         offer_message.file_id,
+                         offer_message.accepted)
+
+
+def __packetize(dst_guid, message, encoder):
+    '''
+    Serializes a message into the packets which carry it. Long messages are
+    split into chunks sent in the bulk lane, so other traffic keeps flowing
+    while they stream.
+
+    :param dst_guid: GUID of destination Endpoint
+    :param message: Msg to send
+    :param encoder: WireEncoder negotiated with the Endpoint
+    :returns: Tuple of (list of serialized NetPackets, outboundqueue.Lane)
+    :raises ValueError: If the message is too long for the Endpoint
+    '''
+    packets = list(encoder.packetize(_g_HOST_GUID, dst_guid, message))
+
+    # Every packet of a message carries the same type of message
+    return [encoded_pkt for encoded_pkt, _ in packets], \
+        _g_MSG_LANES[packets[0][1]]
+
+
+def attempt_connection(dst_addr, dst_guid, dst_name,
+                       protocol_version=handshakeprotocol.g_ORIGINAL_VERSION):
+    '''
+    Schedules a TCP connection to the Endpoint at the given address.
+    Returns immediately, the connection is made by the mainloop.
+
+    :param dst_addr: Socket address Endpoint was discovered at
+    :param dst_guid: GUID of the Endpoint
+    :param dst_name: Friendly name of the Endpoint
+    :param protocol_version: Protocol version the Endpoint advertised
+    '''
+    connection_addr = (dst_addr[0], _g_CONNECTION_PORT)
+    target = connectscheduler.ConnectTarget(connection_addr,
+                                            dst_guid,
+                                            dst_name,
+                                            protocol_version)
+
+    _g_command_queue.put(_g_connect_scheduler.request, target)
+
+
+def __start_connects():
+    '''
+    Begins non-blocking connection attempts for every target the scheduler
+    has room for. Must be called from the mainloop's thread.
+    '''
+    for target in _g_connect_scheduler.ready(time.monotonic()):
+        _g_logger.info(f'Attempting connection to \'{target.address}\'')
+
+        # Create socket for connection
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setblocking(False)
+        target.sock = sock
+
+        try:
+            err = sock.connect_ex(target.address)
+        except OSError as e:
+            err = e.errno
+
+        if err not in _g_CONNECT_IN_PROGRESS and err != 0:
+            __connect_failed(target, err)
+            continue
+
+        # Socket becomes writable once the connection completes or fails
+        _g_selector.register(sock, selectors.EVENT_WRITE, target)
+        target.timer = _g_timer_wheel.schedule(target.deadline,
+                                               __connect_failed,
+                                               target,
+                                               'timed out')
+
+
+def __connect_failed(target, err):
+    '''
+    Releases a failed connection attempt and retries it if allowed
+
+    :param target: ConnectTarget whose attempt failed
+    :param err: Error code or description of the failure
+    '''
+    __close_socket(target.sock)
+
+    if target.timer is not None:
+        target.timer.cancel()
+
+    if _g_connect_scheduler.failed(target, time.monotonic()):
+        _g_logger.info(f'Connection to {target} failed ({err}), retrying')
+
+        # Wake mainloop to start the retry once its backoff has passed
+        _g_timer_wheel.schedule(target.ready_time, __start_connects)
+    else:
+        _g_logger.error(f'Unable to create connection to {target} ({err})')
+        # TODO UI notification on failed connection?
+
+        parked = _g_parked_peers.pop(target.guid, None)
+
+        if parked is not None:
+            # Endpoint is gone, drop its packets and stop listing it
+            __notify_ui_of_disconnect(parked.net_id)
+
+
+def __handle_connect(key):
+    '''
+    Completes a connection attempt the selector reported as writable
+
+    :param key: SelectorKey of the connecting socket
+    '''
+    target = key.data
+    sock = key.fileobj
+
+    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    if err != 0:
+        __connect_failed(target, err)
+        return
+
+    target.timer.cancel()
+    _g_connect_scheduler.succeeded(target)
+    _g_selector.unregister(sock)
+
+    # Hand new connection over to normal processing
+    connection = Connection(target.name, sock, target.guid, target.address,
+                            outbound=True,
+                            protocol_version=target.protocol_version)
+    __add_connection(connection)
+
+
+def __select_timeout():
+    '''
+    :returns: Seconds until mainloop must next wake or None to block
+    '''
+    deadline = _g_timer_wheel.next_deadline()
+
+    if deadline is None:
+        return None
+
+    return max(0.0, deadline - time.monotonic())
+
+
+def __queue_on_connection(connection, encoded_pkt, lane):
+    '''
+    Queues packet for sending over a connection regardless of the queue's
+    limits. Used for the mainloop's own packets (e.g. handshakes), which
+    must never be dropped or block. Must be called from the mainloop's
+    thread.
+
+    :param connection: Connection to send over
+    :param encoded_pkt: Serialized NetPacket
+    :param lane: outboundqueue.Lane to send packet in
+    '''
+    connection.outmsg_queue.put(encoded_pkt, lane, force=True)
+
+    __watch_writable(connection)
+
+
+def __watch_writable(connection):
+    '''
+    Has the selector watch a connection's socket for writability. Must be
+    called from the mainloop's thread.
+
+    :param connection: Connection with data queued
+    '''
+    sock = connection.tcp_socket
+
+    if connection.retired:
+        # Connection lost to a duplicate or was parked since data was
+        # queued, move data over to wherever the Endpoint is now reached
+        winner = _g_connection_registry.get(connection.guid)
+        parked = _g_parked_peers.get(connection.guid)
+
+        if winner is not None and winner is not connection:
+            for encoded_pkts, lane in connection.outmsg_queue.drain():
+                winner.outmsg_queue.put_all(encoded_pkts, lane, force=True)
+
+            if winner.outmsg_queue:
+                __watch_writable(winner)
+
+        elif parked is not None:
+            for encoded_pkts, lane in connection.outmsg_queue.drain():
+                parked.outmsg_queue.put_all(encoded_pkts, lane, force=True)
+
+            __reconnect(connection.guid)
+        return
+
+    if sock.fileno() == -1:
+        # Connection closed since data was queued
+        return
+
+    events = selectors.EVENT_READ | selectors.EVENT_WRITE
+
+    if _g_selector.get_key(sock).events != events:
+        _g_selector.modify(connection.tcp_socket, events, connection)
+
+
+def __add_connection(connection):
+    '''
+    Registers an outgoing connection and starts the connection handshake.
+    Must be called from the mainloop's thread.
+
+    :param connection: Newly connected Connection
+    '''
+    existing = _g_connection_registry.get(connection.guid)
+
+    # Record/Update active connection, UI still lists parked Endpoints
+    if existing is None:
+        if connection.guid not in _g_parked_peers:
+            __notify_ui_of_connection(netid.intern(connection.guid,
+                                                   connection.friendly_name))
+
+    elif __resolve_duplicate(existing, connection) is existing:
+        # Endpoint's connection to the host is kept, never handshake on ours
+        _g_logger.info(f'Dropping duplicate connection to {existing.guid}')
+        __close_socket(connection.tcp_socket)
+        return
+
+    _g_connection_registry.add(connection)
+    _g_selector.register(connection.tcp_socket,
+                         selectors.EVENT_READ,
+                         connection)
+    __unpark(connection)
+
+    # Construct Endpoint message
+    host_netid = netid.intern(_g_HOST_GUID,
+                              c.Config.get(c.ConfigEnum.ENDPOINT_NAME))
+
+    connection_msg = msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_START,
+                             host_netid)
+
+    # Construct network packet
+    serialized_pkt = __encode_pkt(connection.guid, connection_msg)
+
+    __queue_on_connection(connection, serialized_pkt,
+                          _g_MSG_LANES[connection_msg.msg_type])
+
+    if connection.protocol_version != handshakeprotocol.g_ORIGINAL_VERSION:
+        # Options follow the handshake to an Endpoint which advertised them,
+        # older Endpoints never see a message they do not know
+        connection.options_sent = True
+        __queue_on_connection(connection,
+                              __serialize_options_pkt(connection.guid),
+                              _g_MSG_LANES[
+                                  msg.MsgType.ENDPOINT_CONNECTION_OPTIONS])
+
+    __start_heartbeat(connection)
+
+    if existing is not None:
+        __retire_connection(existing, connection)
+
+    __enforce_connection_cap(connection)
+
+
+def __reconnect(guid):
+    '''
+    Makes sure packets queued for an Endpoint get sent, reconnecting to it
+    if its idle connection was parked
+
+    :param guid: GUID of the Endpoint
+    '''
+    connection = _g_connection_registry.get(guid)
+
+    if connection is not None:
+        # Endpoint reconnected since the packets were queued
+        __watch_writable(connection)
+        return
+
+    parked = _g_parked_peers.get(guid)
+
+    if parked is not None:
+        _g_logger.info(f'Reconnecting to parked Endpoint {guid}')
+        _g_connect_scheduler.request(
+            connectscheduler.ConnectTarget(parked.address,
+                                           guid,
+                                           parked.net_id.name,
+                                           parked.protocol_version))
+
+
+def __unpark(connection):
+    '''
+    Hands packets queued for a parked Endpoint over to its new connection.
+    Connection takes over the parked queue itself so packets queued by
+    other threads while this runs are not lost.
+
+    :param connection: Newly registered connection
+    :returns: True if the Endpoint was parked, False otherwise
+    '''
+    parked = _g_parked_peers.pop(connection.guid, None)
+
+    if parked is None:
+        return False
+
+    _g_logger.info(f'Parked Endpoint {connection.guid} reconnected')
+
+    new_queue = connection.outmsg_queue
+    connection.outmsg_queue = parked.outmsg_queue
+
+    for encoded_pkts, lane in new_queue.drain():
+        connection.outmsg_queue.put_all(encoded_pkts, lane, force=True)
+
+    if connection.outmsg_queue:
+        __watch_writable(connection)
+
+    return True
+
+
+def __park_connection(connection, notify_peer):
+    '''
+    Closes an idle connection while keeping its Endpoint known. Packets
+    later sent to the Endpoint are queued until it is reconnected to.
+
+    :param connection: Registered connection with nothing left to send,
+                       whose Endpoint agreed to parking
+    :param notify_peer: True to tell the Endpoint why the connection closes
+    '''
+    _g_logger.info(f'Parking idle connection to {connection.guid}')
+
+    _g_connection_registry.remove(connection)
+    __cancel_timer(connection)
+
+    parked = ParkedPeer(netid.intern(connection.guid,
+                                     connection.friendly_name),
+                        (connection.address[0], _g_CONNECTION_PORT),
+                        connection.outmsg_queue,
+                        connection.protocol_version,
+                        connection.options)
+    _g_parked_peers[connection.guid] = parked
+
+    # Connection winds down like one which lost to a duplicate
+    connection.outmsg_queue = outboundqueue.OutboundQueue(*_g_outbound_limits)
+    connection.retired = True
+
+    __suspend_sending_files(connection)
+    __close_incoming_files(connection)
+
+    if notify_peer:
+        host_netid = netid.intern(_g_HOST_GUID,
+                                  c.Config.get(c.ConfigEnum.ENDPOINT_NAME))
+        park_msg = msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_PARK, host_netid)
+
+        # Sent ahead of anything queued, connection is no longer served
+        __append_pkt(connection, __encode_pkt(connection.guid, park_msg))
+        _g_selector.modify(connection.tcp_socket,
+                           selectors.EVENT_READ | selectors.EVENT_WRITE,
+                           connection)
+
+    elif not connection.tx_buffer:
+        __shutdown_retired(connection)
+
+    if parked.outmsg_queue:
+        # Packets raced in while parking, reconnect right away
+        __reconnect(connection.guid)
+
+
+def __enforce_connection_cap(new_connection):
+    '''
+    Parks the least recently used idle connections while more connections
+    are open than allowed. Only connections whose Endpoints agreed to
+    parking are parked, others stay open.
+
+    :param new_connection: Connection just opened, never parked
+    '''
+    while len(_g_connection_registry) > _g_max_open_connections:
+        idle = [connection
+                for connection in _g_connection_registry.snapshot().values()
+                if connection is not new_connection
+                and connection.options & handshakeprotocol.Option.PARKING
+                and not connection.outmsg_queue
+                and not connection.tx_buffer
+                and not connection.sending_files]
+
+        if not idle:
+            _g_logger.warning('Connection limit exceeded, no idle '
+                              'connection to close')
+            break
+
+        __park_connection(min(idle, key=lambda conn: conn.last_active_time),
+                          notify_peer=True)
+
+
+def __resolve_duplicate(existing, connection):
+    '''
+    Picks which of two connections to the same Endpoint survives. Both
+    Endpoints apply the same rule, so they agree without exchanging any
+    further messages: the connection opened by the Endpoint with the lower
+    GUID is kept. If one Endpoint opened both, the newer one is kept since
+    the older one is stale.
+
+    :param existing: Connection currently registered for the Endpoint
+    :param connection: New connection to the same Endpoint
+    :returns: Connection to keep
+    '''
+    if existing.outbound == connection.outbound:
+        return connection
+
+    keep_outbound = _g_HOST_GUID < connection.guid
+
+    if existing.outbound == keep_outbound:
+        return existing
+
+    return connection
+
+
+def __retire_connection(loser, winner):
+    '''
+    Winds down a connection which lost to a duplicate. Packets which have
+    not started sending are moved over to the surviving connection, the
+    rest are flushed before the loser's sending side is shut down. The
+    loser keeps being read until the Endpoint closes its side.
+
+    :param loser: Connection being retired
+    :param winner: Connection to the same Endpoint which survives
+    '''
+    _g_logger.info(f'Retiring duplicate connection to {loser.guid}')
+
+    loser.retired = True
+
+    for encoded_pkts, lane in loser.outmsg_queue.drain():
+        if not __is_handshake_pkt(encoded_pkts[0]):
+            winner.outmsg_queue.put_all(encoded_pkts, lane, force=True)
+
+    if winner.outmsg_queue:
+        __watch_writable(winner)
+
+    # Files resume over the winner, incoming ones keep arriving on the
+    # loser until the Endpoint closes it
+    __suspend_sending_files(loser)
+    __offer_files(winner)
+
+    if not loser.tx_buffer:
+        __shutdown_retired(loser)
+
+
+def __shutdown_retired(connection):
+    '''
+    Shuts down the sending side of a retired connection once all of its
+    buffered data has been sent
+
+    :param connection: Retired connection with nothing left to send
+    '''
+    sock = connection.tcp_socket
+
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        # Endpoint already gone, nothing to wind down
+        __close_socket(sock)
+        return
+
+    _g_selector.modify(sock, selectors.EVENT_READ, connection)
+
+
+def __is_handshake_pkt(encoded_pkt):
+    '''
+    :param encoded_pkt: Serialized NetPacket
+    :returns: True if packet carries a connection handshake message
+    '''
+    return _g_codec.view_packet(encoded_pkt).msg.msg_type \
+        in (msg.MsgType.ENDPOINT_CONNECTION_START,
+            msg.MsgType.ENDPOINT_CONNECTION_OPTIONS)
+
+
+def __serialize_options_pkt(dst_guid):
+    '''
+    :param dst_guid: GUID of destination Endpoint
+    :returns: Serialized NetPacket listing the options the host supports
+    '''
+    options_msg = msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_OPTIONS,
+                          handshakeprotocol.pack_options(
+                              _g_host_options, _g_compression_dict_id,
+                              handshakeprotocol.g_PROTOCOL_VERSION))
+
+    return __encode_pkt(dst_guid, options_msg)
+
+
+def __negotiate_options(connection, payload):
+    '''
+    Enables the options both the host and an Endpoint support on their
+    connection and picks the fastest wire format they share. Endpoint which
+    opened the connection is sent the host's options in reply first, so
+    everything the host sends from then on may use them. Files are only
+    offered once the Endpoint agreed to file transfers.
+
+    :param connection: Identified connection
+    :param payload: Payload of the Endpoint's options message
+    '''
+    try:
+        options, dict_id, version \
+            = handshakeprotocol.unpack_options(payload)
+    except ValueError as e:
+        _g_logger.error(f'Received invalid connection options: {e}')
+        return
+
+    if not connection.options_sent:
+        # Sent ahead of anything queued, which may be compressed
+        connection.options_sent = True
+        connection.tx_buffer.append(__serialize_options_pkt(connection.guid))
+        __watch_writable(connection)
+
+    common = options & _g_host_options
+    offer_files = common & handshakeprotocol.Option.FILE_TRANSFER \
+        and not connection.options & handshakeprotocol.Option.FILE_TRANSFER
+
+    connection.protocol_version = min(version,
+                                      handshakeprotocol.g_PROTOCOL_VERSION)
+    connection.options = common
+    connection.encoder = wireencoder.select(common)
+
+    _g_logger.info(f'Endpoint {connection.guid} speaks protocol version '
+                   f'{version}, using {connection.encoder}')
+
+    # Liveness is only watched as far as the Endpoint agreed to
+    __start_heartbeat(connection)
+
+    if offer_files:
+        __offer_files(connection)
+
+    if common & handshakeprotocol.Option.COMPRESSION \
+            and connection.compressor is None:
+        # Dictionary is only used if both Endpoints have the same one
+        if dict_id == _g_compression_dict_id:
+            zdict = _g_compression_dict
+        else:
+            zdict = None
+
+        _g_logger.info(f'Compressing messages to {connection.guid}')
+
+        connection.compressor = compression.MessageCompressor(
+            _g_COMPRESSION_MIN_SZ_BYTES, zdict)
+        connection.decompressor = compression.MessageDecompressor(
+            _g_MAX_DECOMPRESSED_SZ_BYTES, zdict)
+
+
+def __take_pkt(connection):
+    '''
+    Takes the next packet to send from a connection's queue. Short messages
+    queued one after another are sent together in a batch if the Endpoint
+    agreed to batching.
+
+    :param connection: Connection with data queued
+    :returns: Serialized NetPacket to send
+    :raises queue.Empty: If nothing is queued
+    '''
+    outmsg_queue = connection.outmsg_queue
+    encoder = connection.encoder
+    encoded_pkt = outmsg_queue.get_nowait()
+
+    if not outmsg_queue or not encoder.is_batchable(encoded_pkt):
+        return encoded_pkt
+
+    batch = [encoded_pkt]
+    batch_sz = len(encoded_pkt)
+
+    while outmsg_queue:
+        try:
+            encoded_pkt = outmsg_queue.get_nowait(
+                lambda pkt: encoder.is_batchable(pkt, batch_sz))
+        except queue.Empty:
+            break
+
+        batch.append(encoded_pkt)
+        batch_sz += len(encoded_pkt)
+
+    if len(batch) == 1:
+        return batch[0]
+
+    return encoder.batch(_g_HOST_GUID, connection.guid, batch)
+
+
+def __append_pkt(connection, encoded_pkt):
+    '''
+    Appends a packet to a connection's send buffer, in the framing agreed
+    with the Endpoint
+
+    :param connection: Connection the packet is sent over
+    :param encoded_pkt: Serialized NetPacket
+    '''
+    for data in connection.encoder.frame(encoded_pkt):
+        connection.tx_buffer.append(data)
+
+
+def __compress_pkt(connection, encoded_pkt):
+    '''
+    Compresses the message of a packet about to be sent if the Endpoint
+    agreed to compression and the message is worth compressing. Packets are
+    compressed in the order they are sent, the order the Endpoint
+    decompresses them in.
+
+    :param connection: Connection the packet is sent over
+    :param encoded_pkt: Serialized NetPacket
+    :returns: Serialized NetPacket to send in its place
+    '''
+    if connection.compressor is None:
+        return encoded_pkt
+
+    payload = memoryview(encoded_pkt)[netprotocol.header_size(encoded_pkt):]
+    compressed = connection.compressor.compress(payload)
+
+    if compressed is None:
+        return encoded_pkt
+
+    compressed_msg = msg.Msg(msg.MsgType.ENDPOINT_COMPRESSED, compressed)
+
+    return connection.encoder.codec.encode_packet(_g_HOST_GUID,
+                                                  connection.guid,
+                                                  compressed_msg)
+
+
+def __start_heartbeat(connection):
+    '''
+    Begins periodic liveness checks on a connection which has completed
+    its handshake, replacing any handshake deadline. Connections whose
+    Endpoints agreed to neither heartbeats nor parking are left to TCP
+    keepalive.
+
+    :param connection: Identified connection
+    '''
+    __cancel_timer(connection)
+
+    if not connection.options & (handshakeprotocol.Option.HEARTBEATS
+                                 | handshakeprotocol.Option.PARKING):
+        return
+
+    connection.timer = _g_timer_wheel.schedule(
+        connection.last_rx_time + _g_heartbeat_interval,
+        __check_liveness,
+        connection)
+
+
+def __check_liveness(connection):
+    '''
+    Pings a connection which has been quiet for a heartbeat interval and
+    disconnects it once it has been quiet for the heartbeat timeout. Data
+    received for any reason counts as a sign of life, so busy connections
+    are never pinged. Only Endpoints which agreed to heartbeats are pinged
+    or timed out, and only those which agreed to parking are parked.
+
+    :param connection: Connection whose liveness deadline passed
+    '''
+    if connection.tcp_socket.fileno() == -1:
+        return
+
+    now = time.monotonic()
+    idle_time = now - connection.last_rx_time
+    heartbeats = connection.options & handshakeprotocol.Option.HEARTBEATS
+
+    if heartbeats and idle_time >= _g_heartbeat_timeout:
+        _g_logger.info(f'Connection to {connection.guid} timed out')
+        __process_disconnect(connection)
+        return
+
+    if not connection.retired \
+            and connection.options & handshakeprotocol.Option.PARKING \
+            and now - connection.last_active_time >= _g_idle_timeout \
+            and not connection.outmsg_queue and not connection.tx_buffer \
+            and not connection.sending_files:
+        # Nothing sent or received by the user in a long time
+        __park_connection(connection, notify_peer=True)
+        return
+
+    if not heartbeats:
+        # Only watching for the connection going idle
+        deadline = now + _g_heartbeat_interval
+    elif idle_time < _g_heartbeat_interval:
+        # Data arrived since the check was scheduled
+        deadline = connection.last_rx_time + _g_heartbeat_interval
+    else:
+        if not connection.retired:
+            __queue_heartbeat(connection, msg.MsgType.ENDPOINT_PING)
+
+        deadline = now + min(_g_heartbeat_interval,
+                             _g_heartbeat_timeout - idle_time)
+
+    connection.timer = _g_timer_wheel.schedule(deadline,
+                                               __check_liveness,
+                                               connection)
+
+
+def __handshake_expired(connection):
+    '''
+    Drops an accepted connection which never completed its handshake
+
+    :param connection: Connection whose handshake deadline passed
+    '''
+    if connection.guid is None and connection.tcp_socket.fileno() != -1:
+        _g_logger.info(f'Handshake from {connection.address} timed out')
+        __process_disconnect(connection)
+
+
+def __queue_heartbeat(connection, msg_type):
+    '''
+    Queues a heartbeat message on a connection
+
+    :param connection: Connection to send over
+    :param msg_type: MsgType.ENDPOINT_PING or MsgType.ENDPOINT_PONG
+    '''
+    heartbeat_msg = msg.Msg(msg_type, b'')
+
+    __queue_on_connection(connection,
+                          __encode_pkt(connection.guid, heartbeat_msg),
+                          _g_MSG_LANES[msg_type])
+
+
+def __offer_file(dst_guid, path):
+    '''
+    Starts a transfer of a file to an Endpoint
+
+    :param dst_guid: GUID of the Endpoint
+    :param path: Path of the file to send
+    '''
+    connection = _g_connection_registry.get(dst_guid)
+    parked = _g_parked_peers.get(dst_guid)
+
+    if connection is not None:
+        options = connection.options
+    elif parked is not None:
+        options = parked.options
+    else:
+        _g_logger.error("Unable to send file to unknown Endpoint")
+        return
+
+    if not options & handshakeprotocol.Option.FILE_TRANSFER:
+        _g_logger.error(f'Endpoint {dst_guid} does not accept files')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            'Unable to send file, peer does not accept files'))
+        return
+
+    transfer_id = next(_g_file_transfer_ids) & fileprotocol.g_MAX_TRANSFER_ID
+
+    try:
+        transfer = filetransfer.OutgoingFile(transfer_id, path)
+    except OSError as e:
+        _g_logger.error(f'Unable to open file to send: {e}')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            f'Unable to send file: {e.strerror}'))
+        return
+
+    _g_outgoing_files.setdefault(dst_guid, {})[transfer_id] = transfer
+
+    if connection is not None:
+        connection.last_active_time = time.monotonic()
+        __queue_file_offer(connection, transfer)
+    else:
+        # Offered once the parked Endpoint is reconnected to
+        __reconnect(dst_guid)
+
+
+def __offer_files(connection):
+    '''
+    Offers every unfinished file for an Endpoint over its newly registered
+    connection once the Endpoint agreed to file transfers. Endpoint accepts
+    each from where it left off.
+
+    :param connection: Registered connection
+    '''
+    if not connection.options & handshakeprotocol.Option.FILE_TRANSFER:
+        return
+
+    for transfer in _g_outgoing_files.get(connection.guid, {}).values():
+        if not transfer.num_streams:
+            # Streams still running offer the file again if they fail
+            __queue_file_offer(connection, transfer)
+
+
+def __queue_file_offer(connection, transfer):
+    '''
+    Queues the offer of a file on a connection
+
+    :param connection: Connection to send over
+    :param transfer: OutgoingFile to offer
+    '''
+    _g_logger.info(f'Offering {transfer} to {connection.guid}')
+
+    offer_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_OFFER,
+                        fileprotocol.pack_offer(transfer.transfer_id,
+                                                transfer.size,
+                                                transfer.file_id,
+                                                transfer.name))
+
+    __queue_on_connection(connection,
+                          __encode_pkt(connection.guid, offer_msg),
+                          _g_MSG_LANES[offer_msg.msg_type])
+
+
+def __receive_file_offer(connection, payload):
+    '''
+    Acts on a file offered over a connection. Files over the size limit are
+    declined and files accepted before resume, the user is asked about any
+    other file.
+
+    :param connection: Connection the offer was received over
+    :param payload: Payload of the file offer message
+    '''
+    try:
+        transfer_id, file_sz, file_id, name \
+            = fileprotocol.unpack_offer(payload)
+    except ValueError as e:
+        _g_logger.error(f'Unable to receive offered file: {e}')
+        return
+
+    if file_sz > _g_max_file_size:
+        _g_logger.error(f'Declining {name} ({file_sz} bytes) from '
+                        f'{connection.guid}, over the size limit')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            f'Declined file \'{name}\', larger than allowed'))
+        __queue_file_decline(connection, transfer_id)
+        return
+
+    if filetransfer.IncomingFile.is_partial(
+            _g_download_dir, __file_key(connection.guid, file_id)):
+        # User accepted the file before, resume it
+        __accept_file(connection, transfer_id, file_sz, file_id, name)
+        return
+
+    offer_key = (connection.guid, file_id)
+    asked = offer_key in _g_file_offers
+
+    # Offer repeated after a reconnect replaces the one asked about
+    _g_file_offers[offer_key] = (transfer_id, file_sz, name)
+
+    if not asked:
+        datapassing.pass_msg(dproto.DPFileOfferMsg(
+            dproto.DPMsgDst.DPMSG_DST_UI, connection.guid, file_id, name,
+            file_sz))
+
+
+def __answer_file_offer(guid, file_id, accepted):
+    '''
+    Accepts or declines a file the user was asked about
+
+    :param guid: GUID of the Endpoint which offered the file
+    :param file_id: Endpoint's ID for the file's content
+    :param accepted: True if the user accepted the file
+    '''
+    offer = _g_file_offers.pop((guid, file_id), None)
+    connection = _g_connection_registry.get(guid)
+
+    if offer is None or connection is None:
+        # Endpoint offers the file again once reconnected
+        return
+
+    transfer_id, file_sz, name = offer
+
+    if accepted:
+        __accept_file(connection, transfer_id, file_sz, file_id, name)
+    else:
+        _g_logger.info(f'Declining {name} from {guid}')
+        __queue_file_decline(connection, transfer_id)
+
+
+def __queue_file_decline(connection, transfer_id):
+    '''
+    Queues the refusal of a file offered over a connection
+
+    :param connection: Connection the offer was received over
+    :param transfer_id: ID of the transfer declined
+    '''
+    decline_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_DECLINE,
+                          fileprotocol.pack_decline(transfer_id))
+
+    __queue_on_connection(connection,
+                          __encode_pkt(connection.guid, decline_msg),
+                          _g_MSG_LANES[decline_msg.msg_type])
+
+
+def __file_key(guid, file_id):
+    '''
+    :param guid: GUID of the Endpoint sending a file
+    :param file_id: Endpoint's ID for the file's content
+    :returns: Key identifying the file among every file received
+    '''
+    return f'{guid:032x}-{file_id:016x}'
+
+
+def __accept_file(connection, transfer_id, file_sz, file_id, name):
+    '''
+    Accepts a file offered over a connection, resuming from whatever was
+    received of the same file before
+
+    :param connection: Connection the offer was received over
+    :param transfer_id: ID of the transfer
+    :param file_sz: Size of the file in bytes
+    :param file_id: Endpoint's ID for the file's content
+    :param name: Name of the file
+    '''
+    try:
+        # Offer repeated after a reconnect replaces the earlier transfer
+        previous = connection.incoming_files.pop(transfer_id, None)
+
+        if previous is not None:
+            _g_file_progress.pop((connection.guid, previous), None)
+            previous.close()
+
+        incoming = filetransfer.IncomingFile(
+            transfer_id, name, file_sz, _g_download_dir,
+            __file_key(connection.guid, file_id))
+
+    except (ValueError, OSError) as e:
+        _g_logger.error(f'Unable to receive offered file: {e}')
+        return
+
+    _g_logger.info(f'Accepting {incoming} from {connection.guid}')
+
+    connection.incoming_files[transfer_id] = incoming
+    __track_file_progress(connection.guid, incoming)
+
+    accept_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_ACCEPT,
+                         fileprotocol.pack_accept(transfer_id,
+                                                  incoming.offset))
+
+    __queue_on_connection(connection,
+                          __encode_pkt(connection.guid, accept_msg),
+                          _g_MSG_LANES[accept_msg.msg_type])
+
+    if incoming.complete:
+        # Nothing left to receive (e.g. an empty file)
+        __complete_incoming_file(connection, incoming)
+
+
+def __start_sending_file(connection, payload):
+    '''
+    Starts sending a file the Endpoint accepted
+
+    :param connection: Connection the acceptance was received over
+    :param payload: Payload of the file accept message
+    '''
+    try:
+        transfer_id, offset = fileprotocol.unpack_accept(payload)
+    except ValueError as e:
+        _g_logger.error(f'Received invalid file acceptance: {e}')
+        return
+
+    transfer = _g_outgoing_files.get(connection.guid, {}).get(transfer_id)
+
+    if transfer is None or offset > transfer.size:
+        _g_logger.error(f'Endpoint accepted unknown file {transfer_id}')
+        return
+
+    if transfer in connection.sending_files or transfer.num_streams:
+        # Repeated offer was accepted where sending already continues
+        return
+
+    transfer.accept(offset)
+    __track_file_progress(connection.guid, transfer)
+
+    if transfer.size - offset >= _g_PARALLEL_FILE_MIN_SZ_BYTES \
+            and _g_file_streams > 1:
+        __start_file_streams(connection, transfer)
+    else:
+        connection.sending_files.append(transfer)
+        __watch_writable(connection)
+
+
+def __start_file_streams(connection, transfer):
+    '''
+    Splits the rest of a file into ranges each sent over its own stream by
+    a worker thread
+
+    :param connection: Connection to the Endpoint which accepted the file
+    :param transfer: Accepted OutgoingFile
+    '''
+    address = (connection.address[0], _g_CONNECTION_PORT)
+    ranges = transfer.split(_g_file_streams)
+
+    _g_logger.info(f'Sending {transfer} to {connection.guid} over '
+                   f'{len(ranges)} streams')
+
+    for offset, length in ranges:
+        threading.Thread(target=__send_file_stream,
+                         args=(connection.guid, address, transfer,
+                               offset, length),
+                         daemon=True).start()
+
+
+def __send_file_stream(dst_guid, address, transfer, offset, length):
+    '''
+    Opens a stream to an Endpoint and sends a range of a file over it. Runs
+    on a worker thread.
+
+    :param dst_guid: GUID of the Endpoint
+    :param address: Socket address of the Endpoint's connection server
+    :param transfer: OutgoingFile being sent
+    :param offset: Offset of the range within the file
+    :param length: Length of the range in bytes
+    '''
+    stream_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_STREAM,
+                         fileprotocol.pack_stream(transfer.transfer_id,
+                                                  offset,
+                                                  length))
+    error = None
+
+    try:
+        with socket.create_connection(address,
+                                      _g_connect_scheduler.timeout) as sock:
+            sock.settimeout(_g_heartbeat_timeout)
+            sock.sendall(__encode_pkt(dst_guid, stream_msg))
+            transfer.send_range(sock, offset, length)
+
+    except OSError as e:
+        error = e
+
+    _g_command_queue.put(__file_stream_sent, dst_guid, transfer, error)
+
 
+def __file_stream_sent(dst_guid, transfer, error):
+    '''
+    Acts on a stream which stopped sending a range of a file. Once every
+    stream of the file stopped, the file is done or, if any stream failed,
+    offered again so the Endpoint can accept what it is missing.
 
-def send_text_msg(text_message):
-    ''''''
-    dst_guid = text_message.destination_id
+    :param dst_guid: GUID of the Endpoint
+    :param transfer: OutgoingFile being sent
+    :param error: OSError which stopped the stream, None if range was sent
+    '''
+    transfer.num_streams -= 1
 
-    if dst_guid == _g_HOST_GUID:
-        _g_logger.error("Tried to send text message to self")
+    if error is not None:
+        _g_logger.error(f'Stream sending {transfer} failed: {error}')
+        transfer.suspend()
+
+    if transfer.num_streams:
         return
 
-    # Construct Endpoint message
-    endpoint_msg = msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION,
-                           text_message.data,
-                           text_message.timestamp)
+    if transfer.offset is None:
+        _g_file_progress.pop((dst_guid, transfer), None)
 
-    encoded_msg = msgprotocol.serialize(endpoint_msg)
+        connection = _g_connection_registry.get(dst_guid)
+
+        # Otherwise offered once the Endpoint agrees to file transfers
+        if connection is not None and connection.options \
+                & handshakeprotocol.Option.FILE_TRANSFER:
+            __queue_file_offer(connection, transfer)
+
+        return
+
+    transfer.close()
+    __complete_outgoing_file(dst_guid, transfer)
 
-    # Construct network packet
-    net_pkt = netpacket.NetPacket(_g_HOST_GUID, dst_guid, encoded_msg)
 
-    encoded_pkt = netprotocol.serialize(net_pkt)
+def __cancel_outgoing_file(connection, payload):
+    '''
+    Forgets a file the Endpoint declined
 
-    # Queue message to be sent over appropriate socket
+    :param connection: Connection the refusal was received over
+    :param payload: Payload of the file decline message
+    '''
     try:
-        connection = _g_connection_map[dst_guid]
-        connection.outmsg_queue.put_nowait(encoded_pkt)
+        transfer_id = fileprotocol.unpack_decline(payload)
+    except ValueError as e:
+        _g_logger.error(f'Invalid file decline: {e}')
+        return
+
+    transfers = _g_outgoing_files.get(connection.guid, {})
+    transfer = transfers.get(transfer_id)
 
-        if connection.tcp_socket not in _g_outputs:
-            _g_outputs.append(connection.tcp_socket)
+    if transfer is None or transfer.offset is not None:
+        # Unknown or already accepted
+        _g_logger.error(f'Endpoint declined unknown file {transfer_id}')
+        return
 
-        # Interrupt on success so socket is added to select call
-        _g_interrupt_sock.send(b'1')
+    _g_logger.info(f'{connection.guid} declined {transfer}')
 
-    except queue.Full:
-        _g_logger.error("Unable to send text message")
+    del transfers[transfer_id]
 
+    if not transfers:
+        del _g_outgoing_files[connection.guid]
 
-def attempt_connection(dst_addr, dst_guid, dst_name):
-    '''Attempts to make a TCP connection at the given address'''
-    # Create socket for connection
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.settimeout(2.0)  # TODO Constant
+    __untrack_file_progress(connection.guid, transfer)
+    transfer.close()
+
+    datapassing.pass_msg(dproto.DPBackendErrMsg(
+        f'File \'{transfer.name}\' was declined'))
+
+
+def __complete_outgoing_file(dst_guid, transfer):
+    '''
+    Forgets a file which has been completely sent
+
+    :param dst_guid: GUID of the Endpoint the file was sent to
+    :param transfer: OutgoingFile which was sent
+    '''
+    _g_logger.info(f'Sent {transfer} to {dst_guid}')
+
+    transfers = _g_outgoing_files[dst_guid]
+    del transfers[transfer.transfer_id]
+
+    if not transfers:
+        del _g_outgoing_files[dst_guid]
+
+    __untrack_file_progress(dst_guid, transfer)
 
-    # Attempt connection to destination
-    connection_addr = (dst_addr[0], _g_CONNECTION_PORT)
-    _g_logger.info(f'Attempting connection to \'{connection_addr}\'')
 
+def __append_file_segment(connection):
+    '''
+    Moves the next segment of the oldest accepted file into a connection's
+    send buffer, announced by a data message
+
+    :param connection: Connection to send over
+    :returns: False if no file is waiting to be sent, True otherwise
+    '''
+    if not connection.sending_files:
+        return False
+
+    transfer = connection.sending_files[0]
+
+    if transfer.done:
+        # Endpoint already held the whole file, no segment closes it
+        transfer.close()
+    else:
+        offset = transfer.offset
+        segment = transfer.next_segment(_g_FILE_SEGMENT_SZ_BYTES)
+
+        data_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_DATA,
+                           fileprotocol.pack_data(transfer.transfer_id,
+                                                  offset,
+                                                  len(segment)))
+
+        __append_pkt(connection, __encode_pkt(connection.guid, data_msg))
+        connection.tx_buffer.append(segment)
+        connection.last_active_time = time.monotonic()
+
+    if transfer.done:
+        connection.sending_files.popleft()
+        __complete_outgoing_file(connection.guid, transfer)
+
+    return True
+
+
+def __start_receiving_file(connection, payload):
+    '''
+    Prepares to receive the raw file data announced by a data message
+
+    :param connection: Connection the message was received over
+    :param payload: Payload of the file data message
+    '''
     try:
-        sock.connect(connection_addr)
-    except socket.timeout:
-        _g_logger.error('Unable to create connection')
-        # TODO UI notification on failed connection?
+        transfer_id, offset, length = fileprotocol.unpack_data(payload)
+        incoming = connection.incoming_files[transfer_id]
+        incoming.start_segment(offset, length)
+
+    except (ValueError, KeyError) as e:
+        # Unexpected data follows, nothing further on the stream can be
+        # trusted
+        _g_logger.error(f'Received invalid file data: {e}')
+        __process_disconnect(connection)
         return
 
-    # Record/Update active connection {GUID: (name, socket)}
-    if dst_guid not in _g_connection_map:
-        __notify_ui_of_connection(netid.NetID(dst_guid, dst_name))
+    connection.rx_file = incoming
 
-    connection = Connection(dst_name, sock)
-    _g_connection_map[dst_guid] = connection
 
-    sock.setblocking(False)
-    _g_inputs.append(sock)
+def __start_receiving_file_stream(connection, src_guid, payload):
+    '''
+    Hands a newly accepted stream of file data over to a worker thread
+    which receives its range straight into the file
 
-    # Construct Endpoint message
-    host_netid = netid.NetID(_g_HOST_GUID,
-                             c.Config.get(c.ConfigEnum.ENDPOINT_NAME))
+    :param connection: Connection the stream message was received over
+    :param src_guid: GUID of the Endpoint sending the file
+    :param payload: Payload of the file stream message
+    '''
+    primary = _g_connection_registry.get(src_guid)
 
-    connection_msg = msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_START,
-                             host_netid)
-    serialized_msg = msgprotocol.serialize(connection_msg)
+    try:
+        transfer_id, offset, length = fileprotocol.unpack_stream(payload)
+        incoming = primary.incoming_files[transfer_id]
 
-    # Construct network packet
-    pkt = netpacket.NetPacket(_g_HOST_GUID, dst_guid, serialized_msg)
-    serialized_pkt = netprotocol.serialize(pkt)
+    except (ValueError, KeyError, AttributeError) as e:
+        _g_logger.error(f'Received invalid file stream: {e}')
+        __process_disconnect(connection)
+        return
+
+    # Stream leaves the mainloop along with data received with its header
+    data = bytes(connection.rx_buffer.take(length))
+    sock = connection.tcp_socket.dup()
+
+    __close_socket(connection.tcp_socket)
+    __cancel_timer(connection)
+
+    sock.settimeout(_g_heartbeat_timeout)
+
+    threading.Thread(target=__receive_file_stream,
+                     args=(primary, incoming, sock, offset, length, data),
+                     daemon=True).start()
+
+
+def __receive_file_stream(connection, incoming, sock, offset, length, data):
+    '''
+    Receives a range of a file over a stream. Runs on a worker thread.
+
+    :param connection: Connection to the Endpoint sending the file
+    :param incoming: IncomingFile being received
+    :param sock: Socket of the stream
+    :param offset: Offset of the range within the file
+    :param length: Length of the range in bytes
+    :param data: Start of the range received along with its header
+    '''
+    error = None
 
-    # Queue message to be sent over appropriate socket
     try:
-        connection.outmsg_queue.put_nowait(serialized_pkt)
+        with sock:
+            incoming.receive_range(sock, offset, length, data)
 
-        # Add new socket to outputs
-        if connection.tcp_socket not in _g_outputs:
-            _g_outputs.append(connection.tcp_socket)
+    except (ValueError, OSError) as e:
+        error = e
 
-        # Interrupt on success so socket is added to select call
-        _g_interrupt_sock.send(b'1')
+    _g_command_queue.put(__file_stream_received, connection, incoming, error)
 
-    except queue.Full:
-        _g_logger.error("Unable to send text message")
+
+def __file_stream_received(connection, incoming, error):
+    '''
+    Acts on a stream which stopped receiving a range of a file, saving the
+    file once every range has been received
+
+    :param connection: Connection to the Endpoint sending the file
+    :param incoming: IncomingFile being received
+    :param error: Exception which stopped the stream, None if range was
+                  received
+    '''
+    if error is not None:
+        _g_logger.error(f'Stream receiving {incoming} failed: {error}')
+
+    if connection.incoming_files.get(incoming.transfer_id) is not incoming:
+        # File was closed or offered again since
+        return
+
+    try:
+        incoming.end_segment()
+    except OSError as e:
+        _g_logger.error(f'Unable to record progress of file: {e}')
+
+    if incoming.complete:
+        __complete_incoming_file(connection, incoming)
+
+
+def __fill_rx_file(connection):
+    '''
+    Moves raw file data received along with earlier frames into the file
+    being received, finishing the segment if it is complete
+
+    :param connection: Connection receiving a file segment
+    '''
+    incoming = connection.rx_file
+
+    incoming.write(connection.rx_buffer.take(incoming.remaining))
+
+    if incoming.remaining:
+        # Rest of the segment is received straight into the file
+        return
+
+    connection.rx_file = None
+    connection.last_active_time = time.monotonic()
+
+    try:
+        incoming.end_segment()
+    except OSError as e:
+        _g_logger.error(f'Unable to record progress of file: {e}')
+
+    if incoming.complete:
+        __complete_incoming_file(connection, incoming)
+
+
+def __complete_incoming_file(connection, incoming):
+    '''
+    Saves a completely received file and reports it to the UI
+
+    :param connection: Connection the file was received over
+    :param incoming: Complete IncomingFile
+    '''
+    del connection.incoming_files[incoming.transfer_id]
+    __untrack_file_progress(connection.guid, incoming)
+
+    try:
+        incoming.finish()
+    except OSError as e:
+        _g_logger.error(f'Unable to save received file: {e}')
+        datapassing.pass_msg(dproto.DPBackendErrMsg(
+            f'Unable to save received file: {e.strerror}'))
+        return
+
+    _g_logger.info(f'Received {incoming} from {connection.guid}')
+
+    ui_message = dproto.DPFileMsg(dproto.DPMsgDst.DPMSG_DST_UI,
+                                  connection.guid,
+                                  timeutils.get_ns_timestamp(),
+                                  incoming.path)
+    datapassing.pass_msg(ui_message)
+
+
+def __suspend_sending_files(connection):
+    '''
+    Stops sending files over a connection which is closing. Files are
+    offered again once the Endpoint is reconnected to.
+
+    :param connection: Connection no longer used for sending files
+    '''
+    for transfer in connection.sending_files:
+        transfer.suspend()
+        _g_file_progress.pop((connection.guid, transfer), None)
+
+    connection.sending_files.clear()
+
+
+def __close_incoming_files(connection):
+    '''
+    Stops receiving files over a closed connection, keeping what was
+    received of them for resuming
+
+    :param connection: Connection no longer used for receiving files
+    '''
+    for incoming in connection.incoming_files.values():
+        _g_file_progress.pop((connection.guid, incoming), None)
+
+        try:
+            incoming.close()
+        except OSError as e:
+            _g_logger.error(f'Unable to record progress of file: {e}')
+
+    connection.incoming_files.clear()
+    connection.rx_file = None
+
+
+def __track_file_progress(guid, transfer):
+    '''
+    Starts reporting the progress of a file transfer to the UI
+
+    :param guid: GUID of the Endpoint the file is transferred with
+    :param transfer: OutgoingFile or IncomingFile
+    '''
+    global _g_progress_timer
+
+    _g_file_progress[(guid, transfer)] = transfer.progress
+
+    if _g_progress_timer is None:
+        now = time.monotonic()
+
+        _g_progress_timer = _g_timer_wheel.schedule(
+            now + _g_FILE_PROGRESS_INTERVAL_SEC, __report_file_progress, now)
+
+
+def __untrack_file_progress(guid, transfer):
+    '''
+    Stops reporting the progress of a finished file transfer, letting the
+    UI know it finished
+
+    :param guid: GUID of the Endpoint the file was transferred with
+    :param transfer: OutgoingFile or IncomingFile
+    '''
+    if _g_file_progress.pop((guid, transfer), None) is not None:
+        datapassing.pass_msg(dproto.DPFileProgressMsg(
+            guid, transfer.name, transfer.size, transfer.size, 0.0))
+
+
+def __report_file_progress(last_report_time):
+    '''
+    Reports progress and throughput of every running file transfer to the
+    UI, repeating while any transfer is running
+
+    :param last_report_time: Monotonic time progress was last reported
+    '''
+    global _g_progress_timer
+
+    now = time.monotonic()
+    elapsed = now - last_report_time
+
+    for key, reported in _g_file_progress.items():
+        guid, transfer = key
+        progress = transfer.progress
+        _g_file_progress[key] = progress
+
+        datapassing.pass_msg(dproto.DPFileProgressMsg(
+            guid, transfer.name, progress, transfer.size,
+            (progress - reported) / elapsed))
+
+    if _g_file_progress:
+        _g_progress_timer = _g_timer_wheel.schedule(
+            now + _g_FILE_PROGRESS_INTERVAL_SEC, __report_file_progress, now)
+    else:
+        _g_progress_timer = None
+
+
+def __encode_pkt(dst_guid, message):
+    '''
+    Serializes a message sent by the host into a network packet. Safe to
+    call from any thread.
+
+    :param dst_guid: GUID of destination Endpoint
+    :param message: Msg to send
+    :returns: Serialized NetPacket
+    '''
+    return _g_codec.encode_packet(_g_HOST_GUID, dst_guid, message)
+
+
+def __cancel_timer(connection):
+    '''
+    Cancels a connection's pending deadline, if any
+
+    :param connection: Connection to cancel the deadline of
+    '''
+    if connection.timer is not None:
+        connection.timer.cancel()
+        connection.timer = None
 
 
 def __notify_ui_of_connection(net_id):
@@ -138,257 +1711,585 @@ def __notify_ui_of_disconnect(net_id):
     datapassing.pass_msg(ui_message)
 
 
-def __cleanup(sockets):
+def __cleanup(selector):
     '''
     Releases socket resources
 
-    :param sockets: List of sockets to cleanup
+    :param selector: Selector holding the sockets to cleanup
     '''
-    for s in sockets:
-        s.close()
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
 
+    selector.close()
 
-def __validate_pkt(rx_data):
+
+def __close_socket(sock):
+    '''
+    Removes socket from the mainloop's selector and closes it
+
+    :param sock: Socket to close
+    '''
+    try:
+        _g_selector.unregister(sock)
+    except (KeyError, ValueError):
+        # Socket was never registered or is already closed
+        pass
+
+    sock.close()
+
+
+def __validate_pkt(connection, record):
     '''
+    Checks a received frame is a packet from another Endpoint without
+    decoding any more of it than needed
+
+    :param connection: Connection the frame was received over
+    :param record: wirecodec.FrameRecord of a single NetPacket
+    :returns: Tuple of (netprotocol.PacketView or None, True if valid)
     '''
     valid = True
     net_pkt = None
 
-    # Check if data available
-    if not rx_data:
+    # Check the frame carries a message
+    if record.msg_type is None:
         valid = False
-        _g_logger.error('Received empty data')
+        _g_logger.error('Received frame without a valid message: '
+                        f'{bytes(record.frame)}')
 
-    # Deserialize packet
+    # View packet in place
     if valid:
         try:
-            net_pkt = netprotocol.deserialize(rx_data)
+            # Compact packets take their GUIDs from the connection
+            net_pkt = _g_codec.view_frame(record,
+                                          connection.guid,
+                                          _g_HOST_GUID)
         except ValueError:
             valid = False
-            _g_logger.error(f'Received data is not a valid packet: {rx_data}')
+            _g_logger.error('Received data is not a valid packet: '
+                            f'{bytes(record.frame)}')
+
+    # Compact packets are only sent once the Endpoint is identified
+    if valid and net_pkt.src is None:
+        valid = False
+        _g_logger.error('Received compact packet before the handshake')
 
     # Sanity check sender's GUID
     if valid:
-        if net_pkt.src == _g_HOST_GUID:
+        if net_pkt.src_bytes == _g_HOST_GUID_BYTES:
             valid = False
             _g_logger.error(f'Connection received from self: {net_pkt}')
 
     return net_pkt, valid
 
 
-def __process_rx_data(addr, data, sock):
+def __process_rx_frame(connection, record):
+    '''
+    Acts on a single complete frame received over a connection
+
+    :param connection: Connection the frame was received over
+    :param record: wirecodec.FrameRecord of the frame
+    '''
+    # Make sure received data is a valid packet
+    net_pkt, valid = __validate_pkt(connection, record)
+
+    if not valid:
+        _g_logger.error("Received invalid packet")
+        return
+
+    __process_msg(connection, net_pkt, net_pkt.msg)
+
+
+def __process_msg(connection, net_pkt, message):
     '''
+    Acts on a single message received over a connection
+
+    :param connection: Connection the message was received over
+    :param net_pkt: PacketView of the packet which carried the message
+    :param message: MsgView of the message, views are only valid until the
+                    next receive on the connection
     '''
-    global _g_inputs
-    global _g_connection_map
+    sock = connection.tcp_socket
+    msg_type = message.msg_type
 
-    if data:
-        # Make sure received data is a valid packet
-        net_pkt, valid = __validate_pkt(data)
+    if msg_type == msg.MsgType.ENDPOINT_CONNECTION_START:
+        # A connection was accepted
+        _g_logger.info("Connection accepted")
 
-        if not valid:
-            _g_logger.error("Received invalid packet")
+        net_id = message.payload
+
+        if connection.retired:
+            # Connection already lost to a duplicate
             return
 
-        # Extract message type of the packet's payload
-        msg_type = msgprotocol.decode_msgtype(net_pkt.msg_payload)
+        connection.guid = net_id.guid
+        connection.friendly_name = net_id.name
 
-        if msg_type == msg.MsgType.ENDPOINT_CONNECTION_START:
-            # A connection was accepted
-            _g_logger.info("Connection accepted")
+        # Handshake complete, watch the connection's liveness from now on
+        __start_heartbeat(connection)
 
-            message = msgprotocol.deserialize(net_pkt.msg_payload)
-            net_id = message.payload
+        existing = _g_connection_registry.get(net_id.guid)
 
-            # Record/Update active connection {GUID: (name, socket)}
-            if net_id.guid not in _g_connection_map:
+        # Record/Update active connection, UI still lists parked Endpoints
+        if existing is None:
+            if net_id.guid not in _g_parked_peers:
                 __notify_ui_of_connection(net_id)
 
-            connection = Connection(net_id.name, sock)
-            _g_connection_map[net_id.guid] = connection
+            _g_connection_registry.add(connection)
+            __unpark(connection)
+            __enforce_connection_cap(connection)
+
+        elif existing is connection:
+            # Repeated handshake, nothing changes
+            pass
 
-        elif msg_type == msg.MsgType.ENDPOINT_TEXT_COMMUNICATION:
-            # A connection sent text data
-            _g_logger.info("Text data received")
+        elif __resolve_duplicate(existing, connection) is connection:
+            _g_connection_registry.add(connection)
+            __retire_connection(existing, connection)
 
-            message = msgprotocol.deserialize(net_pkt.msg_payload)
-            text_data = message.payload
+        else:
+            __retire_connection(connection, existing)
 
-            __notify_ui_of_text_data(net_pkt.src, message.timestamp, text_data)
+    elif msg_type == msg.MsgType.ENDPOINT_TEXT_COMMUNICATION:
+        # A connection sent text data
+        _g_logger.info("Text data received")
 
-        elif msg_type == msg.MsgType.ENDPOINT_DISCONNECTION:
-            # A connection is getting disconnected
-            _g_logger.info("Disconnection reported")
+        text_data = message.payload
 
-            message = msgprotocol.deserialize(net_pkt.msg_payload)
-            net_id = message.payload
+        connection.last_active_time = time.monotonic()
 
-            # Report disconnection to UI
-            __notify_ui_of_disconnect(net_id)
+        __notify_ui_of_text_data(net_pkt.src, message.timestamp, text_data)
+
+    elif msg_type == msg.MsgType.ENDPOINT_CHUNK:
+        # Piece of a long message, act on the message once complete
+        try:
+            reassembled = connection.reassembler.add(message.payload)
+        except ValueError as e:
+            _g_logger.error(f'Received invalid chunk: {e}')
+            return
+
+        if reassembled is None:
+            return
+
+        try:
+            inner = _g_codec.view_msg(reassembled)
+        except ValueError as e:
+            _g_logger.error(f'Received invalid chunked message: {e}')
+            return
 
-            # Close the connection
-            _g_inputs.remove(sock)
+        if inner.msg_type in (msg.MsgType.ENDPOINT_CHUNK,
+                              msg.MsgType.ENDPOINT_FILE_DATA,
+                              msg.MsgType.ENDPOINT_COMPRESSED):
+            _g_logger.error('Chunked message cannot hold a chunk, file '
+                            'data or compressed message')
+            return
+
+        __process_msg(connection, net_pkt, inner)
+
+    elif msg_type == msg.MsgType.ENDPOINT_COMPRESSED:
+        # Message compressed with the connection's compression stream
+        if connection.decompressor is None:
+            _g_logger.error('Received compressed message without agreeing '
+                            'to compression')
+            return
+
+        try:
+            decompressed \
+                = connection.decompressor.decompress(message.payload)
+        except ValueError as e:
+            # Rest of the compression stream cannot be decompressed
+            _g_logger.error(f'Unable to decompress message: {e}')
+            __process_disconnect(connection)
+            return
+
+        try:
+            inner = _g_codec.view_msg(decompressed)
+        except ValueError as e:
+            _g_logger.error(f'Received invalid compressed message: {e}')
+            return
+
+        if inner.msg_type == msg.MsgType.ENDPOINT_COMPRESSED:
+            _g_logger.error('Compressed message cannot hold a compressed '
+                            'message')
+            return
 
-            if sock in _g_outputs:
-                _g_outputs.remove(sock)
+        __process_msg(connection, net_pkt, inner)
 
-            sock.close()
-            del _g_connection_map[net_id.guid]
+    elif msg_type == msg.MsgType.ENDPOINT_BATCH:
+        # Several messages sent together, acted on in the order sent
+        try:
+            batched = [_g_codec.view_msg(serialized_msg)
+                       for serialized_msg
+                       in batchprotocol.split(message.payload)]
+        except ValueError as e:
+            _g_logger.error(f'Received invalid batch: {e}')
+            return
+
+        if any(inner.msg_type in (msg.MsgType.ENDPOINT_FILE_DATA,
+                                  msg.MsgType.ENDPOINT_BATCH)
+               for inner in batched):
+            _g_logger.error('Batch cannot hold file data or a batch')
+            return
 
+        for inner in batched:
+            __process_msg(connection, net_pkt, inner)
+
+            if sock.fileno() == -1:
+                # Connection closed by a batched message
+                return
+
+    elif msg_type == msg.MsgType.ENDPOINT_CONNECTION_OPTIONS:
+        # Endpoint listed the options it supports on the connection
+        if connection.guid is not None and not connection.retired:
+            __negotiate_options(connection, message.payload)
+
+    elif msg_type == msg.MsgType.ENDPOINT_FILE_OFFER:
+        # Endpoint wants to send a file
+        if connection.guid is not None:
+            __receive_file_offer(connection, message.payload)
+
+    elif msg_type == msg.MsgType.ENDPOINT_FILE_ACCEPT:
+        # Endpoint is ready for a file offered to it
+        if not connection.retired:
+            __start_sending_file(connection, message.payload)
+
+    elif msg_type == msg.MsgType.ENDPOINT_FILE_DECLINE:
+        # Endpoint refused a file offered to it
+        if not connection.retired:
+            __cancel_outgoing_file(connection, message.payload)
+
+    elif msg_type == msg.MsgType.ENDPOINT_FILE_DATA:
+        # Raw file data follows the packet on the stream
+        __start_receiving_file(connection, message.payload)
+
+    elif msg_type == msg.MsgType.ENDPOINT_FILE_STREAM:
+        # Endpoint opened the connection to stream part of a file
+        if connection.guid is None and not connection.outbound:
+            __start_receiving_file_stream(connection, net_pkt.src,
+                                          message.payload)
         else:
-            _g_logger.error('Invalid connection payload type: %s'
-                            % msg_type)
+            _g_logger.error('File stream must start its own connection')
 
-    else:
-        # Socket disconnected
-        _g_inputs.remove(sock)
+    elif msg_type == msg.MsgType.ENDPOINT_PING:
+        # Endpoint checking the connection is alive
+        if connection.guid is not None:
+            __queue_heartbeat(connection, msg.MsgType.ENDPOINT_PONG)
 
-        if sock in _g_outputs:
-            _g_outputs.remove(sock)
+    elif msg_type == msg.MsgType.ENDPOINT_PONG:
+        # Receiving the reply already refreshed the connection's liveness
+        pass
 
-        sock.close()
+    elif msg_type == msg.MsgType.ENDPOINT_CONNECTION_PARK:
+        # Endpoint closing the connection for being idle
+        _g_logger.info("Idle connection parked by Endpoint")
 
-        # Remove connection
-        connection_found = False
+        if _g_connection_registry.get(connection.guid) is connection:
+            __park_connection(connection, notify_peer=False)
 
-        for guid, conn in _g_connection_map.items():
-            if conn.tcp_socket is sock:
-                net_id = netid.NetID(guid, conn.friendly_name)
-                connection_found = True
-                break
+    elif msg_type == msg.MsgType.ENDPOINT_DISCONNECTION:
+        # A connection is getting disconnected
+        _g_logger.info("Disconnection reported")
 
-        if connection_found:
+        net_id = message.payload
+
+        # Close the connection, reporting it to UI unless it was a
+        # duplicate which already lost to another connection
+        if _g_connection_registry.remove(connection):
             __notify_ui_of_disconnect(net_id)
-            del _g_connection_map[net_id.guid]
 
+        __close_socket(sock)
+        __cancel_timer(connection)
+        __suspend_sending_files(connection)
+        __close_incoming_files(connection)
 
-def __mainloop(server):
+    else:
+        _g_logger.error('Invalid connection payload type: %s'
+                        % msg_type)
+
+
+def __process_disconnect(connection):
     '''
-    Connection server's mainloop (should be run in separate thread)
+    Cleans up after a connection whose socket closed or errored
+
+    :param connection: Connection which was disconnected
+    '''
+    # Socket disconnected
+    __close_socket(connection.tcp_socket)
+    __cancel_timer(connection)
+    __suspend_sending_files(connection)
+    __close_incoming_files(connection)
+
+    # Remove connection, only reporting Endpoints the UI knows about
+    if _g_connection_registry.remove(connection):
+        __notify_ui_of_disconnect(netid.intern(connection.guid,
+                                               connection.friendly_name))
+
+
+def __receive(connection):
+    '''
+    Reads available data from a connection's socket and processes every
+    frame which has been completely received
+
+    :param connection: Connection whose socket is readable
+    '''
+    sock = connection.tcp_socket
+
+    try:
+        if connection.rx_file is not None:
+            # Raw file data is received straight into the file
+            num_bytes = connection.rx_file.recv_into(sock)
+        else:
+            num_bytes = connection.rx_buffer.recv_into(sock)
+    except BlockingIOError:
+        return  # Spurious wakeup, nothing to read
+    except OSError as e:
+        # Treat socket errors as a disconnect
+        _g_logger.error(f'Error receiving from socket: {e}')
+        num_bytes = 0
+
+    if num_bytes == 0:
+        __process_disconnect(connection)
+        return
+
+    connection.last_rx_time = time.monotonic()
+
+    _g_logger.debug('Connection server received %d bytes from \'%s\'',
+                    num_bytes, connection.friendly_name)
+
+    try:
+        while sock.fileno() != -1:
+            if connection.rx_file is not None:
+                __fill_rx_file(connection)
+
+                if connection.rx_file is not None:
+                    break  # Rest of the file segment has not arrived yet
+
+            # Frames followed by file data are always the last decoded
+            records = connection.rx_buffer.decode_many(_g_codec)
+
+            if not records:
+                break  # Every complete frame processed
+
+            for record in records:
+                __process_rx_frame(connection, record)
+
+                if sock.fileno() == -1:
+                    break  # Connection closed
+
+    except ValueError as e:
+        # Framing lost, nothing further on the stream can be trusted
+        _g_logger.error(f'Unable to frame received data: {e}')
+        __process_disconnect(connection)
+
+
+def __handle_readable(key, server):
+    '''
+    Services a socket the selector reported as readable
 
+    :param key: SelectorKey of the readable socket
     :param server: Server socket for detecting connections
     '''
-    _g_logger.info('Connection server\'s mainloop started')
+    s = key.fileobj
 
-    global _g_inputs
-    global _g_outputs
+    if s is server:
+        _g_logger.info('Connection server accepting connection')
 
-    RECV_BUF_SZ = 1024  # Max size of received data in bytes
-    done = False        # Flag indicating server mainloop should stop
-    _g_inputs = [server, _g_interrupt_sock_recv]    # Sockets to read
-    _g_outputs = []
+        # Accept connections
+        conn_sock, addr = s.accept()
 
-    while _g_inputs and not done:
-        # Multiplex with 'select' call
-        readable, writable, exceptional = select.select(_g_inputs,
-                                                        _g_outputs,
-                                                        _g_inputs)
+        # Connections will report their name/GUID with a message
+        conn_sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        conn_sock.setblocking(False)
+        connection = Connection(None, conn_sock, address=addr)
+        _g_selector.register(conn_sock, selectors.EVENT_READ, connection)
 
-        # Readable sockets have data ready to read
-        for s in readable:
-            if s is server:
-                _g_logger.info('Connection server accepting connection')
+        # Drop the connection if it never identifies itself
+        connection.timer = _g_timer_wheel.schedule(
+            time.monotonic() + _g_handshake_timeout,
+            __handshake_expired,
+            connection)
 
-                # Accept connections
-                conn_sock, addr = s.accept()
+    elif s is _g_command_queue.wakeup_socket:
+        # Commands are drained once all events are handled
+        _g_command_queue.clear_wakeup()
 
-                # Connections will report their GUID with a message
-                conn_sock.setblocking(False)
-                _g_inputs.append(conn_sock)
+    else:
+        # Established socket sent data
+        __receive(key.data)
 
-            elif s is _g_interrupt_sock_recv:
-                s.recv(RECV_BUF_SZ)  # Clear out dummy data
 
-                if _g_kill_flag:
-                    _g_logger.info('Connection server received kill signal')
-                    done = True  # End server after this iteration of mainloop
+def __send(connection, max_bytes):
+    '''
+    Sends data queued on a connection. Called by the write scheduler.
 
-            else:
-                # Established socket sent data
-                rx_data, rx_addr = s.recvfrom(RECV_BUF_SZ)
-                _g_logger.debug('Connection server received %s from \'%s\'',
-                                rx_data, rx_addr)
+    :param connection: Connection whose socket is writable
+    :param max_bytes: Max number of bytes to send
+    :returns: Tuple of (bytes sent, True if only stopped by max_bytes)
+    '''
+    s = connection.tcp_socket
 
-                __process_rx_data(rx_addr, rx_data, s)
+    if s.fileno() == -1:
+        # Connection closed since it became writable
+        return 0, False
 
-        # Writable sockets have data ready to be sent
-        for s in writable:
-            msg_queue = None
+    tx_buffer = connection.tx_buffer
+    num_sent = 0
 
-            for connection in _g_connection_map.values():
-                # Check if a connection is associated with this socket
-                if connection.tcp_socket is s:
-                    # Get the message queue for that connection
-                    msg_queue = connection.outmsg_queue
-                    break
+    # Endpoints speaking the original protocol take each read as a whole
+    # packet, so they are sent a single packet at a time as they always were
+    one_pkt = connection.protocol_version \
+        == handshakeprotocol.g_ORIGINAL_VERSION
 
-            if msg_queue is not None:
+    try:
+        while True:
+            # Coalesce queued packets into the send buffer up to its limit
+            while len(tx_buffer) < _g_TX_HIGH_WATER_BYTES \
+                    and not (one_pkt and tx_buffer):
                 try:
-                    message = msg_queue.get_nowait()
+                    __append_pkt(connection, __compress_pkt(
+                        connection, __take_pkt(connection)))
                 except queue.Empty:
-                    _g_outputs.remove(s)
+                    # Files are only sent while no messages are waiting
+                    if not __append_file_segment(connection):
+                        break
+
+            num_sent += tx_buffer.flush(s, max_bytes - num_sent)
+
+            if one_pkt or num_sent == max_bytes or tx_buffer \
+                    or not (connection.outmsg_queue
+                            or connection.sending_files):
+                # Share used up, socket is full or nothing more to send
+                break
+
+    except OSError as e:
+        _g_logger.error(f'Error sending over socket: {e}')
+        __process_disconnect(connection)
+        return num_sent, False
+
+    if not tx_buffer and not connection.outmsg_queue \
+            and not connection.sending_files:
+        if connection.retired:
+            # Everything owed on the retired connection has been sent
+            __shutdown_retired(connection)
+        else:
+            # Nothing left to send, stop watching for writability
+            _g_selector.modify(s, selectors.EVENT_READ, connection)
+
+        return num_sent, False
+
+    return num_sent, num_sent == max_bytes and not one_pkt
+
+
+def __mainloop(server):
+    '''
+    Connection server's mainloop (should be run in separate thread)
+
+    :param server: Server socket for detecting connections
+    '''
+    _g_logger.info('Connection server\'s mainloop started')
+
+    done = False  # Flag indicating server mainloop should stop
+
+    _g_selector.register(server, selectors.EVENT_READ)
+    _g_selector.register(_g_command_queue.wakeup_socket, selectors.EVENT_READ)
+
+    while not done:
+        # Multiplex with selector (epoll/kqueue where available)
+        timeout = _g_command_queue.prepare_sleep(__select_timeout())
+        events = _g_selector.select(timeout)
+
+        for key, mask in events:
+            if key.fileobj.fileno() == -1:
+                # Socket closed while handling an earlier event
+                continue
+
+            # Readable sockets have data ready to read
+            if mask & selectors.EVENT_READ:
+                __handle_readable(key, server)
+
+                if key.fileobj.fileno() == -1:
+                    continue
+
+            # Writable sockets have data ready to be sent
+            if mask & selectors.EVENT_WRITE:
+                if isinstance(key.data, connectscheduler.ConnectTarget):
+                    __handle_connect(key)
                 else:
-                    s.send(message)
+                    _g_write_scheduler.ready(key.data)
 
-            else:
-                _g_outputs.remove(s)
+        # Share sending fairly between the writable connections
+        _g_write_scheduler.service(__send)
 
-        # Exceptional sockets experience 'exceptional condition'
-        for s in exceptional:
-            # Raise exception if server is 'exceptional'
-            # Unreleased resources will get garbage collected by OS
-            __cleanup(_g_inputs)
+        # Run commands queued by other threads in a single batch
+        for func, args in _g_command_queue.drain():
+            func(*args)
 
-            if s is server:
-                _g_logger.critical('Connection server encountered fatal error')
-                raise RuntimeError('Connection server encountered fatal error')
+        # Fire due deadlines and service outgoing connection attempts
+        _g_timer_wheel.advance(time.monotonic())
+        __start_connects()
 
-            else:
-                _g_logger.critical('Non-server socket encountered fatal error')
-                raise RuntimeError('Non-server socket encountered fatal error')
+        if _g_kill_flag:
+            _g_logger.info('Connection server received kill signal')
+            done = True  # End server after this iteration of mainloop
 
     # Cleanup sockets on exit
-    __cleanup(_g_inputs)
-    __cleanup(_g_outputs)
+    __cleanup(_g_selector)
+    _g_command_queue.close()
     _g_logger.info('Connection server closed')
 
 
-def start(conn_port, host_guid, connection_map):
+def start(conn_port, host_guid, connection_registry):
     '''
     Starts up connection server's mainloop on separate thread
     and returns control to caller.
 
     :param conn_port: Port for connection server to listen on
     :param host_guid: GUID of local machine
-    :param connection_map: Dictionary for tracking active connections
+    :param connection_registry: ConnectionRegistry for tracking active
+                                connections
     '''
     global _g_HOST_GUID
+    global _g_HOST_GUID_BYTES
+    global _g_codec
     global _g_CONNECTION_PORT
     global _g_kill_flag
-    global _g_interrupt_sock
-    global _g_interrupt_sock_recv
+    global _g_command_queue
     global _g_mainloop_thread
-    global _g_connection_map
+    global _g_connection_registry
+    global _g_selector
+    global _g_connect_scheduler
+    global _g_outbound_limits
+    global _g_write_scheduler
+    global _g_timer_wheel
+    global _g_heartbeat_interval
+    global _g_heartbeat_timeout
+    global _g_handshake_timeout
+    global _g_idle_timeout
+    global _g_max_open_connections
+    global _g_parked_peers
+    global _g_outgoing_files
+    global _g_download_dir
+    global _g_max_file_size
+    global _g_file_offers
+    global _g_file_streams
+    global _g_file_progress
+    global _g_progress_timer
+    global _g_host_options
+    global _g_compression_dict
+    global _g_compression_dict_id
 
     _g_HOST_GUID = host_guid
+    _g_HOST_GUID_BYTES = netprotocol.pack_guid(host_guid)
+    _g_codec = wirecodec.WireCodec(c.Config.get(c.ConfigEnum.BYTE_ENCODING))
     _g_CONNECTION_PORT = conn_port
     opt_val = 1  # For setting socket options
 
-    # Create/Configure TCP socket pair for returning control from 'select'
+    # Create queue for passing commands from other threads to the mainloop.
+    # Queue also returns control from 'select' when the server is killed.
     _g_kill_flag = False
+    _g_command_queue = commandqueue.CommandQueue()
 
-    _g_interrupt_sock, _g_interrupt_sock_recv \
-        = socket.socketpair(family=socket.AF_INET)
-
-    _g_interrupt_sock.setsockopt(socket.SOL_SOCKET,
-                                 socket.SO_REUSEADDR,
-                                 opt_val)
-    _g_interrupt_sock_recv.setsockopt(socket.SOL_SOCKET,
-                                      socket.SO_REUSEADDR,
-                                      opt_val)
-    _g_interrupt_sock_recv.setblocking(False)
-
-    _g_logger.info('Interrupt TCP socket pair created and configured')
+    _g_logger.info('Command queue created and configured')
 
     # Create/Configure TCP server socket to receive TCP connection requests
     server_addr = ('', _g_CONNECTION_PORT)  # Listen on all interfaces
@@ -401,8 +2302,87 @@ def start(conn_port, host_guid, connection_map):
     server.listen(5)  # Begin listening for connections
     _g_logger.info('TCP connection server socket created and configured')
 
-    # Save reference to the connection map
-    _g_connection_map = connection_map
+    # Save reference to the connection registry
+    _g_connection_registry = connection_registry
+
+    # Selector multiplexing all of the server's sockets
+    _g_selector = selectors.DefaultSelector()
+
+    # Scheduler bounding and retrying outgoing connection attempts
+    max_pending = c.Config.get(c.ConfigEnum.MAX_PENDING_CONNECTIONS)
+    timeout = c.Config.get(c.ConfigEnum.CONNECTION_TIMEOUT)
+    retries = c.Config.get(c.ConfigEnum.CONNECTION_RETRIES)
+
+    _g_connect_scheduler = connectscheduler.ConnectScheduler(max_pending,
+                                                             timeout,
+                                                             retries)
+
+    # Timer wheel holding every deadline the mainloop has to meet
+    _g_timer_wheel = timerwheel.TimerWheel(_g_TIMER_TICK_SEC,
+                                           _g_TIMER_SLOTS,
+                                           time.monotonic())
+
+    _g_heartbeat_interval = c.Config.get(c.ConfigEnum.HEARTBEAT_INTERVAL)
+    _g_heartbeat_timeout = c.Config.get(c.ConfigEnum.HEARTBEAT_TIMEOUT)
+    _g_handshake_timeout = c.Config.get(c.ConfigEnum.HANDSHAKE_TIMEOUT)
+    _g_idle_timeout = c.Config.get(c.ConfigEnum.IDLE_TIMEOUT)
+    _g_max_open_connections \
+        = c.Config.get(c.ConfigEnum.MAX_OPEN_CONNECTIONS)
+
+    # Endpoints whose idle connections were closed {GUID: ParkedPeer}
+    _g_parked_peers = {}
+
+    # Files not yet completely sent {GUID: {transfer ID: OutgoingFile}}
+    _g_outgoing_files = {}
+    _g_download_dir = c.Config.get(c.ConfigEnum.DOWNLOAD_DIR)
+    _g_max_file_size = c.Config.get(c.ConfigEnum.MAX_INCOMING_FILE_SIZE)
+
+    # Files offered which the user was asked about
+    # {(GUID, file ID): (transfer ID, file size, file name)}
+    _g_file_offers = {}
+    _g_file_streams = c.Config.get(c.ConfigEnum.FILE_STREAMS)
+
+    # Progress of running file transfers when last reported to the UI
+    # {(GUID, OutgoingFile/IncomingFile): bytes}
+    _g_file_progress = {}
+    _g_progress_timer = None
+
+    # Options the host supports on its connections
+    _g_host_options = handshakeprotocol.Option.LARGE_FRAMES \
+        | handshakeprotocol.Option.BINARY_TIMESTAMPS \
+        | handshakeprotocol.Option.BATCHING \
+        | handshakeprotocol.Option.COMPACT_HEADERS \
+        | handshakeprotocol.Option.HEARTBEATS \
+        | handshakeprotocol.Option.PARKING \
+        | handshakeprotocol.Option.FILE_TRANSFER \
+        | handshakeprotocol.Option.CHUNKING
+    _g_compression_dict = None
+    _g_compression_dict_id = handshakeprotocol.g_NO_DICT_ID
+
+    if c.Config.get(c.ConfigEnum.COMPRESSION):
+        _g_host_options |= handshakeprotocol.Option.COMPRESSION
+        dict_path = c.Config.get(c.ConfigEnum.COMPRESSION_DICT)
+
+        if dict_path:
+            try:
+                with open(dict_path, 'rb') as f:
+                    _g_compression_dict = f.read()
+
+                _g_compression_dict_id = zlib.adler32(_g_compression_dict)
+            except OSError as e:
+                _g_logger.error('Unable to load compression dictionary, '
+                                f'compressing without one: {e}')
+
+    # Scheduler sharing output fairly between connections
+    _g_write_scheduler = writescheduler.WriteScheduler(_g_SEND_QUANTUM_BYTES,
+                                                       _g_SEND_BUDGET_BYTES)
+
+    # Limits applied to the outbound queue of every connection
+    _g_outbound_limits = (
+        c.Config.get(c.ConfigEnum.OUTBOUND_QUEUE_MAX_MSGS),
+        c.Config.get(c.ConfigEnum.OUTBOUND_QUEUE_MAX_BYTES),
+        outboundqueue.OverflowPolicy(
+            c.Config.get(c.ConfigEnum.OUTBOUND_QUEUE_POLICY)))
 
     # Startup server's mainloop and return control to caller
     _g_mainloop_thread = threading.Thread(target=__mainloop, args=(server,))
@@ -438,8 +2418,7 @@ def kill():
     # Signal mainloop to exit
     _g_logger.info('Sending kill signal to connection server')
     _g_kill_flag = True
-    _g_interrupt_sock.send(b'1')
-    _g_interrupt_sock.close()
+    _g_command_queue.wakeup()
 
     # Attempt to join mainloop thread
     _g_mainloop_thread.join(timeout=thread_join_timeout)
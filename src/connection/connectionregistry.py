@@ -0,0 +1,110 @@
+'''
+Module providing a registry of the active Endpoint connections.
+'''
+import threading
+import types
+
+
+class ConnectionRegistry(object):
+    '''
+    Registry of identified connections indexed by GUID. Connections are
+    found by socket through the selector, which holds each socket's
+    Connection, so no other index is kept.
+
+    Writers are serialized with a lock. The GUID index is copy-on-write so
+    readers on other threads can look up connections or take a snapshot
+    without locking.
+    '''
+    def __init__(self):
+        '''ConnectionRegistry initialization'''
+        self._lock = threading.Lock()  # Serializes writers
+        self._by_guid = types.MappingProxyType({})  # {GUID: Connection}
+
+    def __contains__(self, guid):
+        return guid in self._by_guid
+
+    def __len__(self):
+        return len(self._by_guid)
+
+    def __iter__(self):
+        return iter(self._by_guid)
+
+    def add(self, connection):
+        '''
+        Registers connection under its GUID, replacing any connection
+        already registered for that GUID
+
+        :param connection: Connection with 'guid' set
+        :returns: Connection which was replaced or None
+        '''
+        with self._lock:
+            replaced = self._by_guid.get(connection.guid)
+
+            by_guid = dict(self._by_guid)
+            by_guid[connection.guid] = connection
+
+            self._by_guid = types.MappingProxyType(by_guid)
+
+        return replaced
+
+    def remove(self, connection):
+        '''
+        Unregisters connection if it is the one registered for its GUID
+
+        :param connection: Connection to remove
+        :returns: True if connection was removed, False otherwise
+        '''
+        with self._lock:
+            if self._by_guid.get(connection.guid) is not connection:
+                return False
+
+            by_guid = dict(self._by_guid)
+            del by_guid[connection.guid]
+
+            self._by_guid = types.MappingProxyType(by_guid)
+
+        return True
+
+    def get(self, guid, default=None):
+        '''
+        :param guid: GUID of Endpoint
+        :returns: Connection registered for GUID or default
+        '''
+        return self._by_guid.get(guid, default)
+
+    def snapshot(self):
+        '''
+        Gets a read-only view of the registry at this point in time. Later
+        changes to the registry are not reflected in the view.
+
+        :returns: Mapping of {GUID: Connection}
+        '''
+        return self._by_guid
+
+
+# Unit Testing
+def test():
+    first = types.SimpleNamespace(guid=1)
+    second = types.SimpleNamespace(guid=2)
+    replacement = types.SimpleNamespace(guid=1)
+    registry = ConnectionRegistry()
+
+    if registry.add(first) is not None or registry.add(second) is not None:
+        raise ValueError('Connection replaced nothing during testing')
+
+    snapshot = registry.snapshot()
+
+    # Adding a connection for a GUID already registered replaces it
+    if registry.add(replacement) is not first \
+            or registry.get(1) is not replacement:
+        raise ValueError('Connection not replaced during testing')
+
+    # Only the connection registered for a GUID is removed
+    if registry.remove(first) or not registry.remove(second) \
+            or 2 in registry or registry.get(2, 'none') != 'none':
+        raise ValueError('Wrong connection removed during testing')
+
+    # Snapshots are not changed by later writes
+    if snapshot.get(1) is not first or sorted(snapshot) != [1, 2] \
+            or list(registry) != [1] or len(registry) != 1:
+        raise ValueError('Snapshot changed during testing')
@@ -0,0 +1,179 @@
+'''
+Module providing scheduling for outgoing connection attempts.
+'''
+import collections
+import handshakeprotocol
+import random
+
+
+class ConnectTarget(object):
+    '''Structure representing an Endpoint to connect to'''
+    def __init__(self, address, guid, name,
+                 protocol_version=handshakeprotocol.g_ORIGINAL_VERSION):
+        '''
+        :param address: Socket address to connect to as (host, port)
+        :param guid: GUID of the Endpoint
+        :param name: Friendly name of the Endpoint
+        :param protocol_version: Protocol version the Endpoint is known to
+                                 speak
+        '''
+        self.address = address
+        self.guid = guid
+        self.name = name
+        self.protocol_version = protocol_version
+        self.attempts = 0      # Number of connection attempts made
+        self.deadline = None   # Time the current attempt times out
+        self.ready_time = 0.0  # Earliest time the next attempt may start
+        self.sock = None       # Socket of the in-flight attempt
+        self.timer = None      # Owner's timer for the attempt's deadline
+
+    def __repr__(self):
+        return '<%s addr:%s id:%s name:%s attempts:%d>' \
+            % (self.__class__.__name__, self.address, self.guid,
+               self.name, self.attempts)
+
+
+class ConnectScheduler(object):
+    '''
+    Bookkeeping for outgoing connection attempts. Bounds the number of
+    attempts in flight at once, sets their deadlines and retries failed
+    attempts with exponential backoff and random jitter.
+
+    Scheduler does no I/O or timing itself, the owner starts, completes and
+    times out attempts.
+    '''
+    RETRY_DELAY_SEC = 1.0  # Delay before the first retry
+    RETRY_JITTER = 0.5     # Retry delays are randomized by up to +/-50%
+
+    def __init__(self, max_in_flight, timeout, max_retries):
+        '''
+        :param max_in_flight: Max connection attempts in progress at once
+        :param timeout: Seconds before an in-flight attempt is abandoned
+        :param max_retries: Times a failed target is retried
+        '''
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self._waiting = collections.OrderedDict()  # {GUID: ConnectTarget}
+        self._in_flight = {}  # {GUID: ConnectTarget}
+
+    def __len__(self):
+        return len(self._waiting) + len(self._in_flight)
+
+    def request(self, target):
+        '''
+        Schedules a connection attempt. Repeated requests for an Endpoint
+        already waiting or in flight only update the address to use.
+
+        :param target: ConnectTarget to connect to
+        '''
+        existing = self._waiting.get(target.guid) \
+            or self._in_flight.get(target.guid)
+
+        if existing is not None:
+            existing.address = target.address
+            existing.name = target.name
+        else:
+            self._waiting[target.guid] = target
+
+    def ready(self, now):
+        '''
+        Takes targets which should have an attempt started now, marking them
+        in flight. Never exceeds the in-flight limit.
+
+        :param now: Current monotonic time
+        :returns: List of ConnectTargets to start connecting to
+        '''
+        started = []
+
+        for guid, target in list(self._waiting.items()):
+            if len(self._in_flight) >= self.max_in_flight:
+                break
+
+            if target.ready_time > now:
+                continue
+
+            del self._waiting[guid]
+
+            target.attempts += 1
+            target.deadline = now + self.timeout
+            self._in_flight[guid] = target
+            started.append(target)
+
+        return started
+
+    def succeeded(self, target):
+        '''
+        Marks an in-flight attempt as connected
+
+        :param target: ConnectTarget which connected
+        '''
+        self._in_flight.pop(target.guid, None)
+        target.sock = None
+
+    def failed(self, target, now):
+        '''
+        Marks an in-flight attempt as failed and schedules a retry if the
+        target has retries remaining
+
+        :param target: ConnectTarget which failed to connect
+        :param now: Current monotonic time
+        :returns: True if a retry was scheduled, False otherwise
+        '''
+        self._in_flight.pop(target.guid, None)
+        target.sock = None
+        target.deadline = None
+
+        if target.attempts > self.max_retries:
+            return False
+
+        # Exponential backoff with jitter so peers do not retry in lockstep
+        delay = ConnectScheduler.RETRY_DELAY_SEC * 2 ** (target.attempts - 1)
+        jitter = ConnectScheduler.RETRY_JITTER
+
+        target.ready_time = now + delay * random.uniform(1 - jitter,
+                                                         1 + jitter)
+        self._waiting[target.guid] = target
+
+        return True
+
+
+# Unit Testing
+def test():
+    scheduler = ConnectScheduler(max_in_flight=2, timeout=2.0, max_retries=1)
+    targets = [ConnectTarget(('127.0.0.1', 5000 + guid), guid, f'ep{guid}')
+               for guid in range(3)]
+
+    for target in targets:
+        scheduler.request(target)
+
+    # Repeated requests only update the address
+    scheduler.request(ConnectTarget(('127.0.0.2', 6000), 0, 'moved'))
+
+    # In-flight limit holds back the last target
+    started = scheduler.ready(now=10.0)
+
+    if started != targets[:2] or len(scheduler) != 3 \
+            or started[0].address != ('127.0.0.2', 6000) \
+            or started[0].deadline != 12.0:
+        raise ValueError('Wrong targets started during testing')
+
+    scheduler.succeeded(targets[0])
+
+    # Failed targets are retried after a jittered backoff, then dropped
+    if not scheduler.failed(targets[1], now=11.0) \
+            or not 11.5 <= targets[1].ready_time <= 12.5:
+        raise ValueError('Failed target not retried during testing')
+
+    if scheduler.ready(now=11.0) != [targets[2]] \
+            or scheduler.ready(now=13.0) != [targets[1]]:
+        raise ValueError('Retry started at wrong time during testing')
+
+    if scheduler.failed(targets[1], now=13.0):
+        raise ValueError('Target retried too often during testing')
+
+    scheduler.succeeded(targets[2])
+
+    if len(scheduler) or scheduler.ready(now=100.0):
+        raise ValueError('Targets left over during testing')
@@ -0,0 +1,636 @@
+'''
+Module providing state for files being sent to or received from Endpoints.
+'''
+import hashlib
+import itertools
+import mmap
+import os
+import socket
+import struct
+import threading
+
+# Zero-copy sending is not available on every platform (e.g. Windows)
+_g_HAS_SENDFILE = hasattr(os, 'sendfile')
+
+
+class FileSegment(object):
+    '''
+    Range of an open file queued for sending. Data is sent straight from the
+    file to the socket without being read into memory.
+    '''
+    def __init__(self, file, offset, length, last):
+        '''
+        :param file: File object opened for reading in binary mode
+        :param offset: Offset of the range within the file
+        :param length: Length of the range in bytes
+        :param last: True if the file is closed once the range is sent
+        '''
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.last = last
+
+    def __len__(self):
+        return self.length
+
+    def sendfile(self, sock, start, max_bytes):
+        '''
+        Sends part of the range over a socket
+
+        :param sock: Non-blocking socket to send over
+        :param start: Bytes at the start of the range already sent
+        :param max_bytes: Max number of bytes to send
+        :returns: Number of bytes sent
+        :raises OSError: If the socket cannot accept data or errors
+        '''
+        count = min(self.length - start, max_bytes)
+
+        if _g_HAS_SENDFILE:
+            num_sent = os.sendfile(sock.fileno(), self.file.fileno(),
+                                   self.offset + start, count)
+        else:
+            self.file.seek(self.offset + start)
+            num_sent = sock.send(self.file.read(count))
+
+        if not num_sent:
+            raise OSError(f'File \'{self.file.name}\' shrank while sending')
+
+        return num_sent
+
+    def release(self):
+        '''Called once the whole range has been sent'''
+        if self.last:
+            self.file.close()
+
+
+class OutgoingFile(object):
+    '''
+    File offered to an Endpoint. Once accepted it is either sent in segments
+    over the Endpoint's connection or split into ranges sent over parallel
+    streams by worker threads.
+    '''
+    # Bytes a stream sends between updates of the transfer's progress
+    STREAM_STEP_SZ_BYTES = 1024 * 1024
+
+    def __init__(self, transfer_id, path):
+        '''
+        :param transfer_id: ID of the transfer
+        :param path: Path of the file to send
+        :raises OSError: If the file cannot be opened
+        '''
+        self.transfer_id = transfer_id
+        self.path = path
+        self.name = os.path.basename(path)
+        self.file = open(path, 'rb')
+
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+
+        # Content is taken to be the same while the file's path, size and
+        # modification time are, so it is never hashed
+        digest = hashlib.blake2b(os.fsencode(os.path.abspath(path)),
+                                 digest_size=8)
+        digest.update(struct.pack('!Qq', stat.st_size, stat.st_mtime_ns))
+        self.file_id = int.from_bytes(digest.digest(), 'big')
+        self.offset = None  # Next byte to send, None until accepted
+        self.num_streams = 0  # Parallel streams still sending the file
+
+        self._accepted_offset = 0  # Offset the Endpoint accepted from
+        self._num_sent = 0  # Bytes sent since the file was accepted
+        self._lock = threading.Lock()  # Guards progress made by streams
+
+    def __repr__(self):
+        return '<%s id:%d name:%s size:%d offset:%s>' \
+            % (self.__class__.__name__, self.transfer_id, self.name,
+               self.size, self.offset)
+
+    @property
+    def done(self):
+        '''True once every byte of the file has been queued for sending'''
+        return self.offset == self.size
+
+    @property
+    def progress(self):
+        '''Bytes of the file the Endpoint holds or which were sent to it'''
+        return self._accepted_offset + self._num_sent
+
+    def accept(self, offset):
+        '''
+        Starts sending the file
+
+        :param offset: Offset the Endpoint accepted the file from
+        '''
+        self.offset = offset
+        self._accepted_offset = offset
+        self._num_sent = 0
+
+    def suspend(self):
+        '''Stops sending the file until it is accepted again'''
+        self.offset = None
+
+    def next_segment(self, max_sz):
+        '''
+        Takes the next range of the file to send. Transfer must have been
+        accepted and not be done.
+
+        :param max_sz: Max length of the range in bytes
+        :returns: FileSegment, closing the file once sent if it is the last
+        '''
+        length = min(self.size - self.offset, max_sz)
+        segment = FileSegment(self.file, self.offset, length,
+                              self.offset + length == self.size)
+
+        self.offset += length
+        self._num_sent += length
+
+        return segment
+
+    def split(self, num_ranges):
+        '''
+        Takes the rest of an accepted file as ranges to send over parallel
+        streams
+
+        :param num_ranges: Max number of ranges to split the file into
+        :returns: List of (offset, length) tuples
+        '''
+        remaining = self.size - self.offset
+        range_len = -(-remaining // num_ranges)  # Rounded up
+
+        ranges = [(offset, min(range_len, self.size - offset))
+                  for offset in range(self.offset, self.size, range_len)]
+
+        self.offset = self.size
+        self.num_streams = len(ranges)
+
+        return ranges
+
+    def send_range(self, sock, offset, length):
+        '''
+        Sends a range of the file over a stream. Called from the stream's
+        worker thread. File is opened again so streams never share a file
+        position.
+
+        :param sock: Blocking socket (optionally with a timeout) to send over
+        :param offset: Offset of the range within the file
+        :param length: Length of the range in bytes
+        :raises OSError: If the file cannot be read or the socket errors
+        '''
+        with open(self.path, 'rb') as file:
+            num_sent = 0
+
+            while num_sent < length:
+                # Socket waits out timeouts and uses 'sendfile' if it can
+                step = sock.sendfile(file, offset + num_sent,
+                                     min(length - num_sent,
+                                         OutgoingFile.STREAM_STEP_SZ_BYTES))
+
+                if not step:
+                    raise OSError(f'File \'{self.path}\' shrank while '
+                                  'sending')
+
+                num_sent += step
+
+                with self._lock:
+                    self._num_sent += step
+
+    def close(self):
+        '''Closes the file, used when no segment is left to close it'''
+        self.file.close()
+
+
+class IncomingFile(object):
+    '''
+    File being received from an Endpoint. Data is received straight into a
+    memory map of a partial file which is preallocated at the file's full
+    size. How much of the partial file is complete is recorded after every
+    segment, so a later offer of the same file resumes from there. Partial
+    files are named by a key identifying the file rather than by its name,
+    so files of the same name never resume from each other.
+
+    Data arrives either in segments over the Endpoint's connection or in
+    ranges over parallel streams, each received by its own worker thread.
+    '''
+    PART_SUFFIX = '.part'  # Suffix of the file while it is received
+    PROGRESS_SUFFIX = '.progress'  # Suffix of the record of bytes received
+
+    def __init__(self, transfer_id, name, size, directory, key):
+        '''
+        :param transfer_id: ID of the transfer
+        :param name: Name of the file, without any directory
+        :param size: Size of the file in bytes
+        :param directory: Directory to save the file in
+        :param key: Key identifying the file (e.g. its sender and content)
+                    among every file received, a plain file name
+        :raises ValueError: If the name is not a plain file name
+        :raises OSError: If the partial file cannot be opened
+        '''
+        if name in ('', os.curdir, os.pardir) \
+                or os.path.basename(name) != name:
+            raise ValueError(f'Invalid file name \'{name}\'')
+
+        self.transfer_id = transfer_id
+        self.name = name
+        self.size = size
+        self.path = None  # Path of the file once complete
+
+        self._directory = directory
+        self._part_path = os.path.join(directory,
+                                       key + IncomingFile.PART_SUFFIX)
+        self._progress_path = os.path.join(directory,
+                                           key + IncomingFile.PROGRESS_SUFFIX)
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.offset = self.__load_progress()  # Bytes received in order
+        self._segment_end = self.offset  # End of the segment being received
+
+        # Ranges received over parallel streams {start: [end, received to]}
+        self._ranges = {}
+        self._streams = set()  # Sockets of streams still receiving
+        self._closing = False  # Set once the file is being released
+        self._lock = threading.Lock()  # Guards state shared with streams
+
+        fd = os.open(self._part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = open(fd, 'r+b')
+        self._file.truncate(size)
+
+        # Files cannot be mapped empty, nothing is received for them anyway
+        self._map = mmap.mmap(self._file.fileno(), size) if size else None
+
+        # Recorded straight away, later offers of the file resume from the
+        # partial file rather than being asked about again
+        self.__save_progress()
+
+    def __repr__(self):
+        return '<%s id:%d name:%s size:%d offset:%d>' \
+            % (self.__class__.__name__, self.transfer_id, self.name,
+               self.size, self.offset)
+
+    @staticmethod
+    def is_partial(directory, key):
+        '''
+        :param directory: Directory files are saved in
+        :param key: Key identifying the file
+        :returns: True if the file was accepted before and is not yet
+                  completely received
+        '''
+        return os.path.exists(os.path.join(directory,
+                                           key + IncomingFile.PROGRESS_SUFFIX))
+
+    @property
+    def complete(self):
+        '''True once every byte of the file has been received'''
+        with self._lock:
+            return not self._streams and self.__received_to() == self.size
+
+    @property
+    def progress(self):
+        '''Bytes of the file received, in order or not'''
+        with self._lock:
+            return self.offset + sum(received_to - start
+                                     for start, (_, received_to)
+                                     in self._ranges.items())
+
+    @property
+    def remaining(self):
+        '''Bytes of the current segment not yet received'''
+        return self._segment_end - self.offset
+
+    def start_segment(self, offset, length):
+        '''
+        Prepares to receive a segment of the file
+
+        :param offset: Offset of the segment within the file
+        :param length: Length of the segment in bytes
+        :raises ValueError: If the segment does not continue the file
+        '''
+        if offset != self.offset or offset + length > self.size:
+            raise ValueError(f'Segment at {offset} of {length} bytes does '
+                             f'not follow {self.offset} of {self.size}')
+
+        self._segment_end = offset + length
+
+    def recv_into(self, sock):
+        '''
+        Receives the current segment directly into the file
+
+        :param sock: Socket to receive from
+        :returns: Number of bytes received, 0 if peer closed the stream
+        '''
+        with memoryview(self._map) as view:
+            num_bytes = sock.recv_into(view[self.offset:self._segment_end])
+
+        self.offset += num_bytes
+
+        return num_bytes
+
+    def write(self, data):
+        '''
+        Copies data already received into the current segment
+
+        :param data: Bytes-like object no longer than the remaining segment
+        '''
+        if data:
+            self._map[self.offset:self.offset + len(data)] = data
+            self.offset += len(data)
+
+    def receive_range(self, sock, offset, length, data):
+        '''
+        Receives a range of the file sent over a stream. Called from the
+        stream's worker thread.
+
+        :param sock: Blocking socket to receive from
+        :param offset: Offset of the range within the file
+        :param length: Length of the range in bytes
+        :param data: Start of the range already received with its header
+        :raises ValueError: If the range is invalid or the file was closed
+        :raises OSError: If the stream errors or closes early
+        '''
+        end = offset + length
+
+        with self._lock:
+            if self._closing:
+                raise ValueError('File is no longer being received')
+
+            if not self.offset <= offset < end <= self.size \
+                    or any(offset < range_end and start < end
+                           for start, (range_end, _)
+                           in self._ranges.items()):
+                raise ValueError(f'Range at {offset} of {length} bytes '
+                                 f'overlaps received data')
+
+            self._ranges[offset] = [end, offset]
+            self._streams.add(sock)
+
+        try:
+            received_to = offset + len(data)
+            self._map[offset:received_to] = data
+
+            with memoryview(self._map) as view:
+                while True:
+                    with self._lock:
+                        self._ranges[offset][1] = received_to
+
+                    if received_to == end:
+                        break
+
+                    num_bytes = sock.recv_into(view[received_to:end])
+
+                    if not num_bytes:
+                        raise ConnectionError('Stream closed before the '
+                                              'whole range was received')
+
+                    received_to += num_bytes
+
+        finally:
+            with self._lock:
+                self._streams.discard(sock)
+                released = self._closing and not self._streams
+
+            if released:
+                # File was closed while this stream was receiving
+                self.__save_progress()
+                self.__close_file()
+
+    def end_segment(self):
+        '''Records that the current segment was completely received'''
+        if self._map is not None:
+            self._map.flush()
+
+        self.__save_progress()
+
+    def finish(self):
+        '''
+        Moves the complete file to its final path. Existing files are never
+        replaced, a number is added to the name instead (e.g. 'name (1).txt').
+
+        :raises OSError: If the file cannot be moved
+        '''
+        self._closing = True
+        self.__close_file()
+
+        self.path = self.__reserve_path()
+        os.replace(self._part_path, self.path)
+
+        try:
+            os.remove(self._progress_path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        '''
+        Stops receiving, keeping what was received for resuming. Streams
+        still receiving are shut down, the last one to stop releases the
+        file.
+        '''
+        with self._lock:
+            if self._closing:
+                return
+
+            self._closing = True
+            streams = list(self._streams)
+
+        for sock in streams:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Stream already closed
+
+        if not streams:
+            self.end_segment()
+            self.__close_file()
+
+    def __received_to(self):
+        '''
+        Finds how far the file has been received without gaps. Lock must be
+        held.
+
+        :returns: Offset of the first byte not yet received
+        '''
+        received_to = self.offset
+
+        while received_to in self._ranges:
+            range_end, range_received_to = self._ranges[received_to]
+
+            if range_received_to < range_end:
+                return range_received_to
+
+            received_to = range_end
+
+        return received_to
+
+    def __reserve_path(self):
+        '''
+        Creates an empty file at the first free path named after the file,
+        so nothing else takes the path before the file is moved there
+
+        :returns: Path reserved
+        :raises OSError: If no file can be created in the directory
+        '''
+        stem, ext = os.path.splitext(self.name)
+
+        for num in itertools.count():
+            name = f'{stem} ({num}){ext}' if num else self.name
+            path = os.path.join(self._directory, name)
+
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                                 0o644))
+            except FileExistsError:
+                continue
+
+            return path
+
+    def __close_file(self):
+        '''Releases the memory map and partial file'''
+        if self._map is not None:
+            self._map.close()
+
+        self._file.close()
+
+    def __load_progress(self):
+        '''
+        :returns: Bytes of the partial file already received, 0 if there is
+                  no partial file of the same size
+        '''
+        try:
+            with open(self._progress_path) as f:
+                size, offset = (int(field) for field in f.read().split())
+
+            if size == self.size and offset <= size \
+                    and os.path.getsize(self._part_path) == size:
+                return offset
+
+        except (OSError, ValueError):
+            # No usable record, start over
+            pass
+
+        return 0
+
+    def __save_progress(self):
+        '''Records how much of the partial file has been received'''
+        with self._lock:
+            received_to = self.__received_to()
+
+        with open(self._progress_path, 'w') as f:
+            f.write(f'{self.size} {received_to}')
+
+
+# Unit Testing
+def test():
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    download_dir = os.path.join(directory, 'downloads')
+    src_path = os.path.join(directory, 'data.bin')
+    data = os.urandom(10000)
+
+    with open(src_path, 'wb') as f:
+        f.write(data)
+
+    send_sock, recv_sock = socket.socketpair()
+
+    try:
+        # Content ID only changes with the file
+        transfer = OutgoingFile(1, src_path)
+        same = OutgoingFile(2, src_path)
+        same.close()
+
+        if transfer.file_id != same.file_id or transfer.size != len(data):
+            raise ValueError('File identified wrongly during testing')
+
+        # Accepted file is sent in segments from the accepted offset
+        transfer.accept(4000)
+
+        while not transfer.done:
+            segment = transfer.next_segment(2500)
+            num_sent = 0
+
+            while num_sent < len(segment):
+                num_sent += segment.sendfile(send_sock, num_sent,
+                                             len(segment))
+
+            segment.release()
+
+        received = bytearray()
+
+        while len(received) < len(data) - 4000:
+            received += recv_sock.recv(len(data))
+
+        if received != data[4000:] or transfer.progress != len(data) \
+                or not transfer.file.closed:
+            raise ValueError('File sent wrongly during testing')
+
+        transfer.accept(1000)
+
+        if transfer.split(4) != [(1000, 2250), (3250, 2250), (5500, 2250),
+                                 (7750, 2250)] or transfer.num_streams != 4:
+            raise ValueError('File split wrongly during testing')
+
+        # Interrupted file resumes from what was received
+        incoming = IncomingFile(1, 'data.bin', len(data), download_dir,
+                                'key')
+        incoming.start_segment(0, 3000)
+        incoming.write(data[:3000])
+        incoming.end_segment()
+        incoming.close()
+
+        if not IncomingFile.is_partial(download_dir, 'key') \
+                or IncomingFile.is_partial(download_dir, 'other key'):
+            raise ValueError('Partial file not found during testing')
+
+        incoming = IncomingFile(2, 'data.bin', len(data), download_dir,
+                                'key')
+
+        if incoming.offset != 3000:
+            raise ValueError('File not resumed during testing')
+
+        # Rest arrives over the connection and a stream, out of order
+        send_sock.sendall(data[7000:] + data[3000:6000])
+        incoming.receive_range(recv_sock, 7000, 3000, b'')
+
+        try:
+            incoming.receive_range(recv_sock, 6500, 1000, b'')
+        except ValueError:
+            pass
+        else:
+            raise ValueError('Overlapping range accepted during testing')
+
+        incoming.start_segment(3000, 3000)
+
+        while incoming.remaining:
+            incoming.recv_into(recv_sock)
+
+        incoming.end_segment()
+        incoming.start_segment(6000, 1000)
+        incoming.write(data[6000:7000])
+
+        # Existing files are never replaced
+        with open(os.path.join(download_dir, 'data.bin'), 'wb') as f:
+            f.write(b'existing')
+
+        if not incoming.complete or incoming.progress != len(data):
+            raise ValueError('File not complete during testing')
+
+        incoming.finish()
+
+        with open(incoming.path, 'rb') as f:
+            if f.read() != data \
+                    or os.path.basename(incoming.path) != 'data (1).bin' \
+                    or sorted(os.listdir(download_dir)) \
+                    != ['data (1).bin', 'data.bin']:
+                raise ValueError('File saved wrongly during testing')
+
+        for name in ('', os.pardir, os.path.join('sub', 'data.bin')):
+            try:
+                IncomingFile(3, name, 1, download_dir, 'invalid')
+            except ValueError:
+                continue
+
+            raise ValueError('Invalid file name accepted during testing')
+
+    finally:
+        send_sock.close()
+        recv_sock.close()
+        shutil.rmtree(directory)
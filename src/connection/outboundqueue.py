@@ -0,0 +1,421 @@
+'''
+Module providing bounded queues for data waiting to be sent to an Endpoint.
+'''
+import collections
+import enum
+import queue
+import threading
+
+
+@enum.unique
+class OverflowPolicy(enum.Enum):
+    '''Enum of actions taken when a full queue is asked to take more'''
+    # Wait for room, rejecting if none is made before a timeout. The caller
+    # is held up meanwhile, along with everything else on its thread.
+    BLOCK = 'block'
+    # Discard the oldest queued items until there is room
+    DROP_OLDEST = 'drop_oldest'
+    # Refuse the new item
+    REJECT = 'reject'
+
+
+@enum.unique
+class Lane(enum.IntEnum):
+    '''Enum of priority lanes, lower values are served first'''
+    # Connection signalling, always served before any other lane
+    CONTROL = 0
+    # User communication
+    CHAT = 1
+    # Large transfers
+    BULK = 2
+
+
+class OutboundQueue(object):
+    '''
+    Thread-safe queue of items split over priority lanes. Each lane is a
+    FIFO. CONTROL items are always taken first; the remaining lanes share
+    what is left by weight, so no lane starves.
+
+    Items carrying the same message (e.g. the chunks of a long message) are
+    queued together and only ever accepted, rejected or dropped together,
+    so the Endpoint is never sent part of a message it cannot complete. A
+    message is never dropped once its first item has been taken.
+
+    Limits on the number of items and total bytes apply to every lane but
+    CONTROL, which always accepts items.
+
+    Queue is congested from the moment a put finds it full until it drains
+    to half of both limits. Transitions are reported through the optional
+    'on_congestion' callback, which is called without the queue's lock held
+    and never concurrently with itself.
+    '''
+    BLOCK_TIMEOUT_SEC = 5.0  # Max time a put waits under BLOCK policy
+
+    # Items taken from a lane per round when other lanes are waiting
+    LANE_WEIGHTS = {Lane.CHAT: 4, Lane.BULK: 1}
+
+    def __init__(self, max_items, max_bytes, policy, on_congestion=None):
+        '''
+        :param max_items: Max number of items queued outside CONTROL
+        :param max_bytes: Max total bytes queued outside CONTROL
+        :param policy: OverflowPolicy applied when the queue is full
+        :param on_congestion: Callable taking True when the queue becomes
+                              congested and False once it has drained
+        '''
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_congestion = on_congestion
+        self.congested = False
+
+        # Messages queued in each lane, each a deque of its items
+        self._lanes = {lane: collections.deque() for lane in Lane}
+        # Lanes whose oldest message has had items taken
+        self._started = set()
+        self._credits = dict(OutboundQueue.LANE_WEIGHTS)  # Left this round
+        self._len = 0  # Items queued in every lane
+        self._num_items = 0  # Items queued outside the CONTROL lane
+        self._num_bytes = 0  # Bytes queued outside the CONTROL lane
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._report_lock = threading.Lock()  # Serializes callbacks
+        self._reported = False  # Congestion state last reported
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def num_bytes(self):
+        '''Total length of the items queued outside the CONTROL lane'''
+        return self._num_bytes
+
+    def put(self, item, lane=Lane.CHAT, force=False):
+        '''
+        Queues an item carrying a whole message, applying the overflow
+        policy if the queue is full
+
+        :param item: Bytes-like object to queue
+        :param lane: Lane to queue the item in
+        :param force: True to ignore the limits (e.g. when moving items
+                      between queues)
+        :returns: True if the queue was empty before the item was added
+        :raises queue.Full: If the item was rejected
+        '''
+        return self.put_all((item,), lane, force)
+
+    def put_all(self, items, lane=Lane.CHAT, force=False):
+        '''
+        Queues the items carrying one message, applying the overflow policy
+        to all of them at once if the queue is full
+
+        :param items: Non-empty sequence of bytes-like objects, in sending
+                      order
+        :param lane: Lane to queue the items in
+        :param force: True to ignore the limits (e.g. when moving items
+                      between queues)
+        :returns: True if the queue was empty before the items were added
+        :raises queue.Full: If the items were rejected
+        '''
+        num_bytes = sum(len(item) for item in items)
+        full = False
+
+        try:
+            with self._lock:
+                limited = lane != Lane.CONTROL
+
+                if limited and not force \
+                        and self.__is_full(len(items), num_bytes):
+                    full = True
+                    self.congested = True
+                    self.__make_room(len(items), num_bytes)
+
+                was_empty = not self._len
+
+                self._lanes[lane].append(collections.deque(items))
+                self._len += len(items)
+
+                if limited:
+                    self._num_items += len(items)
+                    self._num_bytes += num_bytes
+
+        finally:
+            if full:
+                self.__report_congestion()
+
+        return was_empty
+
+    def get_nowait(self, accept=None):
+        '''
+        Takes the next item to send from the queue
+
+        :param accept: Optional callable taking the next item and returning
+                       False to leave it queued
+        :returns: Oldest item of the lane being served
+        :raises queue.Empty: If the queue is empty or the item was not
+                             accepted
+        '''
+        with self._lock:
+            lane = self.__next_lane()
+
+            if lane is None:
+                raise queue.Empty
+
+            oldest = self._lanes[lane][0]
+
+            if accept is not None and not accept(oldest[0]):
+                # Lane keeps its turn for when the item is taken
+                if lane != Lane.CONTROL:
+                    self._credits[lane] += 1
+
+                raise queue.Empty
+
+            item = oldest.popleft()
+            self._len -= 1
+
+            if oldest:
+                # Rest of the message must follow, it can no longer drop
+                self._started.add(lane)
+            else:
+                self._lanes[lane].popleft()
+                self._started.discard(lane)
+
+            if lane != Lane.CONTROL:
+                self._num_items -= 1
+                self._num_bytes -= len(item)
+                self._not_full.notify()
+
+            relieved = self.congested and self.__is_drained()
+
+            if relieved:
+                self.congested = False
+
+        if relieved:
+            self.__report_congestion()
+
+        return item
+
+    def drain(self):
+        '''
+        Takes every item from the queue
+
+        :returns: List of (items of a message, Lane) pairs, each lane oldest
+                  first
+        '''
+        msgs = []
+
+        with self._lock:
+            for lane, lane_msgs in self._lanes.items():
+                msgs.extend((list(items), lane) for items in lane_msgs)
+                lane_msgs.clear()
+
+            self._started.clear()
+            self._len = 0
+            self._num_items = 0
+            self._num_bytes = 0
+            self._not_full.notify_all()
+
+            relieved = self.congested
+
+            self.congested = False
+
+        if relieved:
+            self.__report_congestion()
+
+        return msgs
+
+    def __next_lane(self):
+        '''
+        Picks the lane to take the next item from. Lock must be held.
+
+        :returns: Lane to serve or None if every lane is empty
+        '''
+        if self._lanes[Lane.CONTROL]:
+            return Lane.CONTROL
+
+        waiting = [lane for lane in OutboundQueue.LANE_WEIGHTS
+                   if self._lanes[lane]]
+
+        if not waiting:
+            return None
+
+        # Start a new round once waiting lanes have used up their share
+        if not any(self._credits[lane] for lane in waiting):
+            self._credits = dict(OutboundQueue.LANE_WEIGHTS)
+
+        for lane in waiting:
+            if self._credits[lane]:
+                self._credits[lane] -= 1
+                return lane
+
+    def __is_full(self, num_items, num_bytes):
+        '''
+        Checks if there is no room for a message. Lock must be held.
+
+        :param num_items: Number of items carrying the message
+        :param num_bytes: Total length of the items in bytes
+        :returns: True if adding the message would exceed a limit
+        '''
+        if not self._num_items:
+            # Always take a message into an empty queue, however large
+            return False
+
+        return self._num_items + num_items > self.max_items \
+            or self._num_bytes + num_bytes > self.max_bytes
+
+    def __is_drained(self):
+        '''
+        Checks if the queue has drained enough to no longer be congested.
+        Lock must be held.
+        '''
+        return self._num_items <= self.max_items // 2 \
+            and self._num_bytes <= self.max_bytes // 2
+
+    def __make_room(self, num_items, num_bytes):
+        '''
+        Applies the overflow policy to a full queue. Lock must be held.
+
+        :param num_items: Number of items carrying the message needing room
+        :param num_bytes: Total length of the items in bytes
+        :raises queue.Full: If the message was rejected
+        '''
+        if self.policy == OverflowPolicy.DROP_OLDEST:
+            while self.__is_full(num_items, num_bytes) \
+                    and self.__drop_oldest():
+                pass
+
+        elif self.policy == OverflowPolicy.BLOCK:
+            room = self._not_full.wait_for(
+                lambda: not self.__is_full(num_items, num_bytes),
+                timeout=OutboundQueue.BLOCK_TIMEOUT_SEC)
+
+            if not room:
+                raise queue.Full
+
+        else:
+            raise queue.Full
+
+    def __drop_oldest(self):
+        '''
+        Drops the oldest message of the lowest priority lane holding one
+        which has not started sending. Lock must be held.
+
+        :returns: False if no message could be dropped
+        '''
+        for lane in reversed(Lane):
+            if lane == Lane.CONTROL:
+                continue
+
+            lane_msgs = self._lanes[lane]
+            # Message being sent has to be finished
+            index = 1 if lane in self._started else 0
+
+            if len(lane_msgs) > index:
+                dropped = lane_msgs[index]
+                del lane_msgs[index]
+
+                self._len -= len(dropped)
+                self._num_items -= len(dropped)
+                self._num_bytes -= sum(len(item) for item in dropped)
+
+                return True
+
+        return False
+
+    def __report_congestion(self):
+        '''
+        Calls the congestion callback, if one was given, with the current
+        congestion state unless that state was already reported
+        '''
+        if self.on_congestion is None:
+            return
+
+        with self._report_lock:
+            congested = self.congested
+
+            if congested != self._reported:
+                self._reported = congested
+                self.on_congestion(congested)
+
+
+# Unit Testing
+def test():
+    import time
+
+    def take_all(out_queue):
+        items = []
+
+        while True:
+            try:
+                items.append(out_queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    # CONTROL goes first, the other lanes share by weight
+    out_queue = OutboundQueue(100, 10000, OverflowPolicy.REJECT)
+
+    for item, lane in ((b'c1', Lane.CHAT), (b'b1', Lane.BULK),
+                       (b'c2', Lane.CHAT), (b'b2', Lane.BULK),
+                       (b'c3', Lane.CHAT), (b'c4', Lane.CHAT),
+                       (b'c5', Lane.CHAT), (b'c6', Lane.CHAT),
+                       (b'ctl', Lane.CONTROL)):
+        out_queue.put(item, lane)
+
+    try:
+        out_queue.get_nowait(accept=lambda item: False)
+    except queue.Empty:
+        pass
+    else:
+        raise ValueError('Item not accepted was taken during testing')
+
+    if take_all(out_queue) != [b'ctl', b'c1', b'c2', b'c3', b'c4', b'b1',
+                               b'c5', b'c6', b'b2']:
+        raise ValueError('Lanes served in wrong order during testing')
+
+    # Full queue rejects until drained to half, CONTROL is never limited
+    reports = []
+    out_queue = OutboundQueue(4, 10000, OverflowPolicy.REJECT,
+                              reports.append)
+
+    if not out_queue.put(bytes(20000)):
+        raise ValueError('Empty queue refused a message during testing')
+
+    out_queue.drain()
+
+    for _ in range(4):
+        out_queue.put(b'chat')
+
+    try:
+        out_queue.put(b'rejected')
+    except queue.Full:
+        pass
+    else:
+        raise ValueError('Full queue took a message during testing')
+
+    out_queue.put(b'ctl', Lane.CONTROL)
+    take_all(out_queue)
+
+    if reports != [True, False] or len(out_queue) or out_queue.num_bytes:
+        raise ValueError('Congestion reported wrongly during testing')
+
+    # Whole messages are dropped, never one which started sending
+    out_queue = OutboundQueue(4, 10000, OverflowPolicy.DROP_OLDEST)
+    out_queue.put_all((b'b1', b'b2'), Lane.BULK)
+    out_queue.get_nowait()
+    out_queue.put_all((b'c1', b'c2', b'c3'))
+    out_queue.put(b'c4')
+
+    if take_all(out_queue) != [b'c4', b'b2']:
+        raise ValueError('Wrong message dropped during testing')
+
+    # Blocked put waits for room to be made
+    out_queue = OutboundQueue(1, 10000, OverflowPolicy.BLOCK)
+    out_queue.put(b'first')
+    consumer = threading.Timer(0.1, out_queue.get_nowait)
+    consumer.start()
+    start = time.monotonic()
+    out_queue.put(b'second')
+    consumer.join()
+
+    if time.monotonic() - start >= OutboundQueue.BLOCK_TIMEOUT_SEC \
+            or take_all(out_queue) != [b'second']:
+        raise ValueError('Blocked put failed during testing')
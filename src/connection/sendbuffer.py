@@ -0,0 +1,197 @@
+'''
+Module providing buffering for data waiting to be sent over a stream socket.
+'''
+import collections
+import socket
+
+# Scatter/gather sending is not available on every platform (e.g. Windows)
+_g_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+class SendBuffer(object):
+    '''
+    Outbound buffer which coalesces queued packets and flushes as many as the
+    socket will accept, correctly resuming after partial sends.
+
+    Besides bytes-like objects the buffer takes chunks which send themselves
+    (e.g. ranges of a file), identified by a 'sendfile' method taking
+    (socket, bytes already sent, max bytes) and a 'release' method called
+    once the chunk is completely sent.
+    '''
+    MAX_IOVECS = 64  # Max buffers handed to a single 'sendmsg' call
+
+    def __init__(self):
+        '''SendBuffer initialization'''
+        self._chunks = collections.deque()  # Queued bytes-like objects
+        self._offset = 0  # Bytes of first chunk which were already sent
+        self._size = 0    # Total unsent bytes
+
+    def __len__(self):
+        '''
+        Gets the number of bytes waiting to be sent
+
+        :returns: Number of unsent bytes
+        '''
+        return self._size
+
+    def append(self, data):
+        '''
+        Queues data to be sent after all currently buffered data
+
+        :param data: Bytes-like object or chunk which sends itself
+        '''
+        if data:
+            self._chunks.append(data)
+            self._size += len(data)
+
+    def flush(self, sock, max_bytes=None):
+        '''
+        Sends buffered data until the buffer is empty, the socket's send
+        buffer is full or max_bytes have been sent
+
+        :param sock: Non-blocking socket to send over
+        :param max_bytes: Max number of bytes to send, None for no limit
+        :returns: Number of bytes sent
+        :raises OSError: If the socket errors for any reason other than
+                         being unable to accept more data
+        '''
+        total_sent = 0
+
+        if max_bytes is None:
+            max_bytes = self._size
+
+        while self._size and total_sent < max_bytes:
+            max_chunk_bytes = max_bytes - total_sent
+
+            try:
+                if hasattr(self._chunks[0], 'sendfile'):
+                    num_sent = self._chunks[0].sendfile(sock, self._offset,
+                                                        max_chunk_bytes)
+                else:
+                    buffers = self.__pending_buffers(max_chunk_bytes)
+
+                    if _g_HAS_SENDMSG:
+                        num_sent = sock.sendmsg(buffers)
+                    else:
+                        num_sent = sock.send(buffers[0])
+
+            except (BlockingIOError, InterruptedError):
+                # Socket cannot take any more data right now
+                break
+
+            self.__consume(num_sent)
+            total_sent += num_sent
+
+        return total_sent
+
+    def __pending_buffers(self, max_bytes):
+        '''
+        Gets views of the unsent data without copying it
+
+        :param max_bytes: Max total length of the views
+        :returns: List of memoryviews in sending order
+        '''
+        buffers = []
+        offset = self._offset  # Skip part of first chunk already sent
+
+        for chunk in self._chunks:
+            if hasattr(chunk, 'sendfile'):
+                # Sent by the chunk itself once reached
+                break
+
+            view = memoryview(chunk)[offset:offset + max_bytes]
+            offset = 0
+
+            buffers.append(view)
+            max_bytes -= len(view)
+
+            if not max_bytes or len(buffers) == SendBuffer.MAX_IOVECS:
+                break
+
+        return buffers
+
+    def __consume(self, num_bytes):
+        '''
+        Discards bytes which were successfully sent
+
+        :param num_bytes: Number of bytes sent from the front of the buffer
+        '''
+        self._size -= num_bytes
+        num_bytes += self._offset
+
+        while self._chunks and num_bytes >= len(self._chunks[0]):
+            chunk = self._chunks.popleft()
+            num_bytes -= len(chunk)
+
+            if hasattr(chunk, 'release'):
+                chunk.release()
+
+        self._offset = num_bytes
+
+
+# Unit Testing
+def test():
+    class _Socket(object):
+        '''Socket accepting a few bytes per send until its buffer fills'''
+        def __init__(self):
+            self.sent = bytearray()
+            self.room = 0
+
+        def sendmsg(self, buffers):
+            return self.send(b''.join(buffers))
+
+        def send(self, data):
+            if not self.room:
+                raise BlockingIOError
+
+            num_sent = min(len(data), 7, self.room)
+            self.sent += data[:num_sent]
+            self.room -= num_sent
+
+            return num_sent
+
+    class _Chunk(object):
+        '''Chunk sending itself, as a range of a file does'''
+        def __init__(self, data):
+            self.data = data
+            self.released = False
+
+        def __len__(self):
+            return len(self.data)
+
+        def sendfile(self, sock, offset, max_bytes):
+            return sock.send(self.data[offset:offset + max_bytes])
+
+        def release(self):
+            self.released = True
+
+    sock = _Socket()
+    send_buffer = SendBuffer()
+    file_chunk = _Chunk(b'<file range>')
+
+    for data in (b'first packet', b'', bytearray(b'second'), file_chunk,
+                 memoryview(b'after the file')):
+        send_buffer.append(data)
+
+    expected = b'first packet' b'second' b'<file range>' b'after the file'
+
+    if len(send_buffer) != len(expected) or send_buffer.flush(sock):
+        raise ValueError('Data sent to a full socket during testing')
+
+    # Partial sends resume where they stopped, limits are kept to
+    sock.room = 10
+
+    if send_buffer.flush(sock) != 10 or send_buffer.flush(sock, 0):
+        raise ValueError('Socket overfilled during testing')
+
+    sock.room = 1000
+
+    if send_buffer.flush(sock, 20) != 20 \
+            or len(send_buffer) != len(expected) - 30:
+        raise ValueError('Send limit exceeded during testing')
+
+    send_buffer.flush(sock)
+
+    if bytes(sock.sent) != expected or len(send_buffer) \
+            or not file_chunk.released:
+        raise ValueError('Data sent wrongly during testing')
@@ -0,0 +1,174 @@
+'''
+Module providing a hashed timer wheel for scheduling deadlines in a
+single-threaded mainloop.
+'''
+import math
+
+
+class Timer(object):
+    '''Handle for a callback scheduled on a TimerWheel'''
+    def __init__(self, deadline, tick, func, args):
+        '''
+        :param deadline: Monotonic time the timer is due
+        :param tick: Wheel tick the timer fires on
+        :param func: Function to call when the timer fires
+        :param args: Arguments to call the function with
+        '''
+        self.deadline = deadline
+        self.tick = tick
+        self.func = func
+        self.args = args
+        self._slot = None  # Wheel slot holding the timer, None once done
+
+    def __repr__(self):
+        return '<%s deadline:%.3f func:%s>' \
+            % (self.__class__.__name__, self.deadline, self.func.__name__)
+
+    @property
+    def active(self):
+        '''True until the timer has fired or been cancelled'''
+        return self._slot is not None
+
+    def cancel(self):
+        '''Stops the timer from firing, does nothing if already done'''
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+
+
+class TimerWheel(object):
+    '''
+    Hashed timer wheel. Time is split into fixed ticks which map onto a ring
+    of slots, so scheduling and cancelling timers costs O(1) regardless of
+    how many timers exist. Timers due beyond one revolution of the wheel
+    share slots with nearer timers and are skipped until their tick comes.
+
+    Timers fire no earlier than their deadline and at most one tick late.
+    Wheel does no waiting itself, the owner advances it from its mainloop.
+    '''
+    def __init__(self, tick_sec, num_slots, now):
+        '''
+        :param tick_sec: Resolution of the wheel in seconds
+        :param num_slots: Number of slots in the ring
+        :param now: Current monotonic time
+        '''
+        self.tick_sec = tick_sec
+        self.num_slots = num_slots
+
+        self._slots = [set() for _ in range(num_slots)]
+        self._tick = math.floor(now / tick_sec)  # Last tick advanced to
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, deadline, func, *args):
+        '''
+        Schedules a function to be called once a deadline passes
+
+        :param deadline: Monotonic time to call the function at
+        :param func: Function to call
+        :param args: Arguments to call the function with
+        :returns: Timer which can be used to cancel the call
+        '''
+        tick = max(math.ceil(deadline / self.tick_sec), self._tick + 1)
+
+        timer = Timer(deadline, tick, func, args)
+        timer._slot = self._slots[tick % self.num_slots]
+        timer._slot.add(timer)
+
+        return timer
+
+    def advance(self, now):
+        '''
+        Fires every timer which is due, in deadline order
+
+        :param now: Current monotonic time
+        :returns: Number of timers fired
+        '''
+        target = math.floor(now / self.tick_sec)
+
+        if target <= self._tick:
+            return 0
+
+        # Each slot needs visiting at most once, however long it has been
+        num_steps = min(target - self._tick, self.num_slots)
+        due = []
+
+        for step in range(1, num_steps + 1):
+            slot = self._slots[(self._tick + step) % self.num_slots]
+
+            due.extend(timer for timer in slot if timer.tick <= target)
+
+        self._tick = target
+
+        due.sort(key=lambda timer: timer.deadline)
+
+        for timer in due:
+            # Earlier callbacks may have cancelled later timers
+            if timer.active:
+                timer.cancel()
+                timer.func(*timer.args)
+
+        return len(due)
+
+    def next_deadline(self):
+        '''
+        :returns: Earliest time a timer may be due or None if there are none
+        '''
+        if not any(self._slots):
+            return None
+
+        for step in range(1, self.num_slots + 1):
+            tick = self._tick + step
+
+            if self._slots[tick % self.num_slots]:
+                # No timer can be due before this slot's tick
+                return tick * self.tick_sec
+
+
+# Unit Testing
+def test():
+    wheel = TimerWheel(tick_sec=0.1, num_slots=8, now=100.0)
+    fired = []
+
+    # Deadlines spanning several revolutions, out of order
+    deadlines = [100.05, 100.75, 100.35, 101.25, 102.95, 100.35]
+
+    for deadline in deadlines:
+        wheel.schedule(deadline, fired.append, deadline)
+
+    cancelled = wheel.schedule(100.5, fired.append, 'cancelled')
+    cancelled.cancel()
+
+    # Timer cancelling a later one from its callback
+    later = wheel.schedule(100.95, fired.append, 'cancelled by callback')
+    wheel.schedule(100.9, later.cancel)
+
+    if len(wheel) != 8 or wheel.next_deadline() is None \
+            or not 100.0 < wheel.next_deadline() <= 100.05 + wheel.tick_sec:
+        raise ValueError('Wrong next deadline during testing')
+
+    # Nothing fires before its deadline, everything fires at most one tick
+    # late and in deadline order
+    now = 100.0
+
+    while now < 103.1:
+        num_fired = len(fired)
+        wheel.advance(now)
+
+        for deadline in fired[num_fired:]:
+            if isinstance(deadline, str) or deadline > now \
+                    or deadline < now - 2 * wheel.tick_sec:
+                raise ValueError('Timer fired at wrong time during testing')
+
+        now += 0.05
+
+    if fired != sorted(deadlines) or len(wheel) \
+            or wheel.next_deadline() is not None or cancelled.active:
+        raise ValueError('Timers fired wrongly during testing')
+
+    # Advancing long after the deadline still fires the timer
+    timer = wheel.schedule(now + 50.0, fired.clear)
+
+    if wheel.advance(now + 1000.0) != 1 or fired or timer.active:
+        raise ValueError('Overdue timer not fired during testing')
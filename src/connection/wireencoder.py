@@ -0,0 +1,260 @@
+'''
+Module providing the serialization of messages into the packets sent to an
+Endpoint.
+
+Which wire format features an Endpoint understands is negotiated when its
+connection starts. Each connection is given the encoder using every feature
+both the host and the Endpoint support, the fastest format they share.
+Endpoints which negotiate nothing get the original format.
+'''
+import batchprotocol
+import chunkprotocol
+import config as c
+import handshakeprotocol
+import itertools
+import msg
+import netprotocol
+import wirecodec
+
+# Source of IDs for chunked messages sent by the host
+_g_chunked_msg_ids = itertools.count()
+
+# Encoders already created {capabilities: WireEncoder}
+_g_encoders = {}
+
+
+class WireEncoder(object):
+    '''
+    Serializes messages sent to an Endpoint. Encoders hold no state of their
+    own, connections negotiating the same features share one.
+    '''
+    # Messages serialized longer than this are streamed in chunks of this
+    # size. Chunks are sent in the bulk lane, so messages queued meanwhile
+    # only wait for the chunk in progress.
+    CHUNK_SZ_BYTES = 32 * 1024
+    # Chunk size for Endpoints receiving large frames. Chunks are then
+    # limited to the delay already accepted for a segment of a file.
+    LARGE_CHUNK_SZ_BYTES = 256 * 1024
+    # Longest packet of messages batched together. Batches only gather
+    # short messages, so one is never held up behind a long one.
+    MAX_BATCH_SZ_BYTES = 16 * 1024
+
+    # Messages never batched. Handshakes must be understood on their own and
+    # raw file data follows file data messages on the stream.
+    _UNBATCHABLE_MSG_TYPES = (msg.MsgType.ENDPOINT_CONNECTION_START,
+                              msg.MsgType.ENDPOINT_CONNECTION_OPTIONS,
+                              msg.MsgType.ENDPOINT_FILE_DATA,
+                              msg.MsgType.ENDPOINT_FILE_STREAM,
+                              msg.MsgType.ENDPOINT_COMPRESSED,
+                              msg.MsgType.ENDPOINT_BATCH)
+
+    def __init__(self, capabilities, codec):
+        '''
+        :param capabilities: handshakeprotocol.Option flags both Endpoints
+                             support
+        :param codec: WireCodec serializing messages and packets
+        '''
+        self.capabilities = capabilities
+        self.codec = codec
+
+        if capabilities & handshakeprotocol.Option.LARGE_FRAMES:
+            self.chunk_sz = WireEncoder.LARGE_CHUNK_SZ_BYTES
+        else:
+            self.chunk_sz = WireEncoder.CHUNK_SZ_BYTES
+
+        self.chunking = bool(capabilities & handshakeprotocol.Option.CHUNKING)
+        self.large_frames = bool(
+            capabilities & handshakeprotocol.Option.LARGE_FRAMES)
+        self.batching = bool(capabilities & handshakeprotocol.Option.BATCHING)
+        self.compact_headers = bool(
+            capabilities & handshakeprotocol.Option.COMPACT_HEADERS)
+
+    def __repr__(self):
+        return '<%s capabilities:%s chunk size:%d>' \
+            % (self.__class__.__name__, self.capabilities, self.chunk_sz)
+
+    def packetize(self, src_guid, dst_guid, message):
+        '''
+        Generator serializing a message into the packets which carry it
+
+        :param src_guid: GUID of source Endpoint
+        :param dst_guid: GUID of destination Endpoint
+        :param message: Msg to send
+        :returns: Iterator of (serialized NetPacket, MsgType it carries)
+        :raises ValueError: If the message is too long for an Endpoint
+                            which agreed to neither chunks nor large frames
+        '''
+        # Most messages fit in a single packet, serialized straight into it
+        encoded_pkt = self.codec.encode_packet(src_guid, dst_guid, message)
+        encoded_msg = memoryview(encoded_pkt)[
+            netprotocol.header_size(encoded_pkt):]
+
+        if not self.chunking:
+            if len(encoded_pkt) > netprotocol.g_MAX_SHORT_PKT_SZ_BYTES \
+                    and not self.large_frames:
+                raise ValueError(f'Message too long ({len(encoded_pkt)} '
+                                 'bytes) for the Endpoint')
+
+            yield encoded_pkt, message.msg_type
+            return
+
+        if len(encoded_msg) <= self.chunk_sz:
+            yield encoded_pkt, message.msg_type
+            return
+
+        msg_id = next(_g_chunked_msg_ids) & chunkprotocol.g_MAX_MSG_ID
+
+        for chunk in chunkprotocol.split(msg_id, encoded_msg, self.chunk_sz):
+            chunk_msg = msg.Msg(msg.MsgType.ENDPOINT_CHUNK,
+                                chunk,
+                                message.timestamp)
+
+            yield (self.codec.encode_packet(src_guid, dst_guid, chunk_msg),
+                   chunk_msg.msg_type)
+
+    def frame(self, encoded_pkt):
+        '''
+        Frames a packet for sending over the connection. Packets are queued
+        with full headers, since queued packets may move to another
+        connection to the Endpoint. Once sent over a connection whose
+        Endpoint agreed to compact headers the GUIDs are left out.
+
+        :param encoded_pkt: Serialized NetPacket about to be sent
+        :returns: Tuple of bytes-like objects to send in its place
+        '''
+        if not self.compact_headers:
+            return (encoded_pkt,)
+
+        encoded_msg = memoryview(encoded_pkt)[
+            netprotocol.header_size(encoded_pkt):]
+
+        return self.codec.compact_header(len(encoded_msg)), encoded_msg
+
+    def is_batchable(self, encoded_pkt, batch_sz=0):
+        '''
+        :param encoded_pkt: Serialized NetPacket waiting to be sent
+        :param batch_sz: Length of the packets already batched in bytes
+        :returns: True if the packet's message may be added to the batch
+        '''
+        batch_sz += len(encoded_pkt)
+
+        if not self.batching or batch_sz > WireEncoder.MAX_BATCH_SZ_BYTES:
+            return False
+
+        msg_type = self.codec.view_packet(encoded_pkt).msg.msg_type
+
+        return msg_type not in WireEncoder._UNBATCHABLE_MSG_TYPES
+
+    def batch(self, src_guid, dst_guid, encoded_pkts):
+        '''
+        Serializes the messages of several packets into one batch packet
+
+        :param src_guid: GUID of source Endpoint
+        :param dst_guid: GUID of destination Endpoint
+        :param encoded_pkts: Serialized NetPackets accepted by is_batchable,
+                             in sending order
+        :returns: Serialized NetPacket carrying every message
+        '''
+        payload = batchprotocol.join(
+            memoryview(encoded_pkt)[netprotocol.header_size(encoded_pkt):]
+            for encoded_pkt in encoded_pkts)
+
+        batch_msg = msg.Msg(msg.MsgType.ENDPOINT_BATCH, payload)
+
+        return self.codec.encode_packet(src_guid, dst_guid, batch_msg)
+
+
+def select(capabilities):
+    '''
+    :param capabilities: handshakeprotocol.Option flags both Endpoints
+                         support, 0 for an Endpoint which negotiated nothing
+    :returns: WireEncoder using every supported feature
+    '''
+    encoder = _g_encoders.get(capabilities)
+
+    if encoder is None:
+        codec = wirecodec.WireCodec(
+            c.Config.get(c.ConfigEnum.BYTE_ENCODING),
+            bool(capabilities & handshakeprotocol.Option.BINARY_TIMESTAMPS))
+        encoder = WireEncoder(capabilities, codec)
+        _g_encoders[capabilities] = encoder
+
+    return encoder
+
+
+# Unit Testing
+def test():
+    Option = handshakeprotocol.Option
+    src_guid, dst_guid = 1, 2
+    codec = wirecodec.WireCodec('utf-8')
+    short_msg = msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, 'hi')
+    long_msg = msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION,
+                       'x' * (2 ** 17))
+
+    # Original format carries every message whole, if it fits
+    original = WireEncoder(0, codec)
+    packets = list(original.packetize(src_guid, dst_guid, short_msg))
+
+    if packets != [(codec.encode_packet(src_guid, dst_guid, short_msg),
+                    short_msg.msg_type)] \
+            or original.frame(packets[0][0]) != (packets[0][0],) \
+            or original.is_batchable(packets[0][0]):
+        raise ValueError('Original format changed during testing')
+
+    try:
+        list(original.packetize(src_guid, dst_guid, long_msg))
+    except ValueError:
+        pass
+    else:
+        raise ValueError('Message too long accepted during testing')
+
+    large = WireEncoder(Option.LARGE_FRAMES, codec)
+
+    if len(list(large.packetize(src_guid, dst_guid, long_msg))) != 1:
+        raise ValueError('Large frame split during testing')
+
+    # Chunked messages are reassembled by the receiver
+    chunking = WireEncoder(Option.CHUNKING, codec)
+    reassembler = chunkprotocol.Reassembler(1, 2 ** 20)
+    packets = list(chunking.packetize(src_guid, dst_guid, long_msg))
+
+    for encoded_pkt, msg_type in packets:
+        view = codec.view_packet(encoded_pkt)
+
+        if msg_type != msg.MsgType.ENDPOINT_CHUNK \
+                or len(encoded_pkt) > netprotocol.g_MAX_SHORT_PKT_SZ_BYTES:
+            raise ValueError('Message chunked wrongly during testing')
+
+        reassembled = reassembler.add(view.msg.raw_payload)
+
+    if len(packets) != 5 \
+            or codec.view_msg(reassembled).payload != long_msg.payload:
+        raise ValueError('Chunks not reassembled during testing')
+
+    # Batches carry every message, compact frames leave out the GUIDs
+    everything = WireEncoder(Option.BATCHING | Option.COMPACT_HEADERS,
+                             codec)
+    encoded_pkts = [codec.encode_packet(src_guid, dst_guid, short_msg)
+                    for _ in range(3)]
+
+    if not all(everything.is_batchable(encoded_pkt)
+               for encoded_pkt in encoded_pkts) \
+            or everything.is_batchable(
+                encoded_pkts[0], WireEncoder.MAX_BATCH_SZ_BYTES):
+        raise ValueError('Messages not batched during testing')
+
+    batch_pkt = everything.batch(src_guid, dst_guid, encoded_pkts)
+    compact_pkt = b''.join(everything.frame(batch_pkt))
+    view = codec.view_packet(compact_pkt, src_guid, dst_guid)
+
+    if not view.compact or len(compact_pkt) >= len(batch_pkt) \
+            or view.msg.msg_type != msg.MsgType.ENDPOINT_BATCH \
+            or [codec.view_msg(m).payload
+                for m in batchprotocol.split(view.msg.payload)] \
+            != [short_msg.payload] * 3:
+        raise ValueError('Batch changed in round trip during testing')
+
+    # Encoders are shared between connections with the same capabilities
+    if select(Option.BATCHING) is not select(Option.BATCHING) \
+            or select(0).capabilities != 0:
+        raise ValueError('Encoders not shared during testing')
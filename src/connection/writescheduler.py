@@ -0,0 +1,122 @@
+'''
+Module providing fair scheduling of output across connections.
+'''
+import collections
+
+
+class WriteScheduler(object):
+    '''
+    Deficit round-robin scheduler over connections with data to send.
+
+    Each round a ready connection is granted a quantum of bytes on top of
+    whatever it did not get to use in earlier rounds. Connections are served
+    in turn until none have data left or the per-pass byte budget is spent,
+    so a single busy connection cannot delay the others.
+
+    Scheduler does no I/O itself, the owner sends through a callback.
+    '''
+    def __init__(self, quantum, budget):
+        '''
+        :param quantum: Bytes a connection is granted per round
+        :param budget: Max bytes sent over all connections per pass
+        '''
+        self.quantum = quantum
+        self.budget = budget
+
+        self._active = collections.OrderedDict()  # {Connection: deficit}
+
+    def __len__(self):
+        return len(self._active)
+
+    def __contains__(self, connection):
+        return connection in self._active
+
+    def ready(self, connection):
+        '''
+        Marks a connection as having data it is able to send. Connections
+        already waiting keep their place.
+
+        :param connection: Connection whose socket is writable
+        '''
+        if connection not in self._active:
+            self._active[connection] = 0
+
+    def discard(self, connection):
+        '''
+        Stops serving a connection
+
+        :param connection: Connection to forget
+        '''
+        self._active.pop(connection, None)
+
+    def service(self, send):
+        '''
+        Runs one pass of sending over the ready connections
+
+        :param send: Callable taking (connection, max_bytes) which sends up
+                     to max_bytes and returns (bytes sent, True if sending
+                     stopped only because max_bytes was reached)
+        :returns: Total number of bytes sent
+        '''
+        budget = self.budget
+
+        while self._active and budget > 0:
+            connection, deficit = self._active.popitem(last=False)
+
+            deficit += self.quantum
+            allowance = min(deficit, budget)
+
+            num_sent, more = send(connection, allowance)
+
+            budget -= num_sent
+
+            if more:
+                # Carry unused share over to the connection's next turn
+                self._active[connection] = deficit - num_sent
+
+            # Connections with nothing left (or a full socket) lose their
+            # deficit, as in classic DRR, and are re-added once writable
+
+        return self.budget - budget
+
+
+# Unit Testing
+def test():
+    scheduler = WriteScheduler(quantum=100, budget=1000)
+    pending = {'bulk': 10000, 'chat': 150, 'blocked': 500}
+    sends = []
+
+    def send(connection, max_bytes):
+        # Blocked connection's socket fills after a few bytes
+        if connection == 'blocked':
+            num_sent = min(max_bytes, 30)
+            pending[connection] -= num_sent
+            sends.append((connection, num_sent))
+            return num_sent, False
+
+        num_sent = min(max_bytes, pending[connection])
+        pending[connection] -= num_sent
+        sends.append((connection, num_sent))
+
+        return num_sent, bool(pending[connection])
+
+    for connection in pending:
+        scheduler.ready(connection)
+
+    scheduler.ready('bulk')  # Already waiting, keeps its place
+
+    # Connections take turns until the budget is spent, a full socket or
+    # sending everything ends a connection's turns
+    if scheduler.service(send) != 1000:
+        raise ValueError('Budget not spent during testing')
+
+    if sends[:5] != [('bulk', 100), ('chat', 100), ('blocked', 30),
+                     ('bulk', 100), ('chat', 50)] \
+            or 'blocked' in scheduler or 'chat' in scheduler \
+            or list(scheduler._active) != ['bulk']:
+        raise ValueError('Connections served unfairly during testing')
+
+    scheduler.discard('bulk')
+
+    if len(scheduler) or scheduler.service(send):
+        raise ValueError('Discarded connection served during testing')
@@ -65,6 +65,65 @@ def __process_text_msg(message):
         _g_logger.error("Message had invalid destination")
 
 
+def __process_file_msg(message):
+    '''Logic for processing a file message'''
+    import connection_manager as cm
+
+    mdst = message.destination
+
+    if mdst == dproto.DPMsgDst.DPMSG_DST_UI:
+        # Pass received file to UI
+        try:
+            _g_ui_queue.put_nowait(message)
+        except queue.Full:
+            _g_logger.error("Unable to pass file message to UI")
+
+    elif mdst == dproto.DPMsgDst.DPMSG_DST_BACKEND:
+        # Pass file to send to Backend
+        cm.send_file(message)
+
+    else:
+        _g_logger.error("File message had invalid destination")
+
+
+def __process_file_offer_msg(message):
+    '''Logic for processing a file offer message'''
+    import connection_manager as cm
+
+    mdst = message.destination
+
+    if mdst == dproto.DPMsgDst.DPMSG_DST_UI:
+        # Ask UI whether to accept the file
+        try:
+            _g_ui_queue.put_nowait(message)
+        except queue.Full:
+            _g_logger.error("Unable to pass file offer message to UI")
+
+    elif mdst == dproto.DPMsgDst.DPMSG_DST_BACKEND:
+        # Pass user's answer to Backend
+        cm.answer_file_offer(message)
+
+    else:
+        _g_logger.error("File offer message had invalid destination")
+
+
+def __process_ui_msg(message):
+    '''Logic for processing a message which may only be sent to the UI'''
+    mdst = message.destination
+
+    if mdst == dproto.DPMsgDst.DPMSG_DST_UI:
+        # Pass message to UI
+        try:
+            _g_ui_queue.put_nowait(message)
+        except queue.Full:
+            _g_logger.error("Unable to pass %s message to UI"
+                            % message.msg_type.name)
+
+    else:
+        _g_logger.error("%s message had invalid destination"
+                        % message.msg_type.name)
+
+
 def __process_msg(message):
     '''Logic for processing a queue message'''
     mtype = message.msg_type
@@ -78,6 +137,17 @@ def __process_msg(message):
     elif mtype == dproto.DPMsgType.DPMSG_TYPE_TEXT_MSG:
         __process_text_msg(message)
 
+    elif mtype == dproto.DPMsgType.DPMSG_TYPE_FILE:
+        __process_file_msg(message)
+
+    elif mtype == dproto.DPMsgType.DPMSG_TYPE_FILE_OFFER:
+        __process_file_offer_msg(message)
+
+    elif mtype in (dproto.DPMsgType.DPMSG_TYPE_BACKEND_ERR,
+                   dproto.DPMsgType.DPMSG_TYPE_BACKPRESSURE,
+                   dproto.DPMsgType.DPMSG_TYPE_FILE_PROGRESS):
+        __process_ui_msg(message)
+
     else:
         _g_logger.error("Message had invalid type")
 
@@ -2,6 +2,7 @@
 Module providing functionality for broadcasting connection messages over the
 available network interfaces.
 """
+import handshakeprotocol
 import logging
 import msg
 import msgprotocol
@@ -26,7 +27,9 @@ def __broadcast(data, src_id, dst_addr):
     # Construct netpacket
     serialized_msg = msgprotocol.serialize(data)
 
-    dst_id = 0  # Broadcasting therfore no destination in particular
+    # Broadcasting therfore no destination in particular. Older Endpoints
+    # ignore the destination, it advertises the host's protocol version.
+    dst_id = handshakeprotocol.pack_advert()
     pkt = netpacket.NetPacket(src_id, dst_id, serialized_msg)
 
     serialized_pkt = netprotocol.serialize(pkt)
@@ -3,6 +3,7 @@ Module providing server for responding to Enpoint broadcasts over LAN.
 Server runs on a separate thread from caller.
 """
 import connection_manager as cm
+import handshakeprotocol
 import logging
 import msg
 import msgprotocol
@@ -154,9 +155,11 @@ def __mainloop(server, bcast_port, host_guid, request_queue):
 
                     # Extract information from message
                     net_id = message.payload
+                    version = handshakeprotocol.unpack_advert(net_pkt.dst)
 
                     # Report device connection request
-                    cm.attempt_connection(rx_addr, net_id.guid, net_id.name)
+                    cm.attempt_connection(rx_addr, net_id.guid, net_id.name,
+                                          version)
 
                     __clear_buffer(data_buffer, rx_addr)
 
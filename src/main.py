@@ -1,4 +1,5 @@
 import connection_manager as cm
+import connectionregistry as cr
 import datapassing
 import broadcast as bcast
 import broadcast_listener as bcastl
@@ -12,7 +13,6 @@ import os
 import platform
 import queue
 import config as c
-import synceddict as sd
 import timeutils as timeutils
 import uuid
 
@@ -115,12 +115,20 @@ def main():
         c.Config.set(c.ConfigEnum.BROADCAST_PORT, broadcast_port)
 
     logger.debug('Broadcast Port: %d', broadcast_port)
+
+    # Fill in any connection manager tuning missing from configuration
+    for key, default in cm.CONFIG_DEFAULTS.items():
+        try:
+            c.Config.get(key)
+        except KeyError:
+            c.Config.set(key, default)
+
     logger.info('Loaded configuration from %s', config_path)
 
     c.Config.write()  # Write config to disk since it may have been modified
 
-    # Initialize map for tracking connected devices - {GUID: (name, socket)}
-    connection_map = sd.SyncedDict()
+    # Initialize registry for tracking connected devices
+    connection_registry = cr.ConnectionRegistry()
 
     # Initialize data passing queues
     connection_bcast_queue = queue.Queue()  # Broadcasted connection requests
@@ -130,7 +138,7 @@ def main():
     datapassing.start(ui_queue)
 
     # Start TCP connection manager
-    cm.start(conn_port, host_guid, connection_map)
+    cm.start(conn_port, host_guid, connection_registry)
     logger.info("Connection manager service started")
 
     # Start UDP listener for connection broadcasts
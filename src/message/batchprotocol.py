@@ -0,0 +1,83 @@
+"""
+Module defining the protocol for sending several messages in one packet.
+
+A batch message carries serialized messages for the same Endpoint back to
+back. Each is delimited by its own length prefix, so only messages whose
+length fits in the prefix are batched.
+"""
+import msgprotocol
+import struct
+
+_g_LEN_PREF_STRUCT = struct.Struct('!H')  # Length prefix of a message
+
+
+def join(serialized_msgs):
+    """
+    Joins serialized messages into the payload of a batch message
+
+    :param serialized_msgs: Bytes-like serialized messages, each short
+                            enough to carry its length in its prefix
+
+    :returns: Payload of a batch message
+    """
+    return b''.join(serialized_msgs)
+
+
+def split(payload):
+    """
+    Splits the payload of a batch message into the messages it carries.
+    Every length is checked before any message is returned.
+
+    :param payload: Bytes-like payload of a batch message
+
+    :returns: List of memoryviews of serialized messages in sending order
+    :raises ValueError: If a message's length is invalid
+    """
+    view = memoryview(payload)
+    serialized_msgs = []
+    offset = 0
+
+    while offset < len(view):
+        if len(view) - offset < _g_LEN_PREF_STRUCT.size:
+            raise ValueError('Batched message too short')
+
+        msg_sz, = _g_LEN_PREF_STRUCT.unpack_from(view, offset)
+
+        if msg_sz < msgprotocol.g_BINARY_HEADER_SZ_BYTES \
+                or offset + msg_sz > len(view):
+            raise ValueError('Batched message length is invalid')
+
+        serialized_msgs.append(view[offset:offset + msg_sz])
+        offset += msg_sz
+
+    return serialized_msgs
+
+
+# Unit Testing
+def test():
+    import msg
+
+    serialized_msgs = [
+        msgprotocol.serialize(
+            msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, text))
+        for text in ('first', '', 'third message')]
+
+    # Round trip keeps every message and their order
+    payload = join(serialized_msgs)
+
+    if [bytes(m) for m in split(payload)] != serialized_msgs:
+        raise ValueError('Batch not split into its messages during testing')
+
+    if split(join([])) != []:
+        raise ValueError('Empty batch not split into nothing during testing')
+
+    # Truncated batches and impossible lengths are rejected
+    for bad_payload in (payload[:-1],
+                        payload + b'\x00',
+                        b'\x00\x01' + bytes(msgprotocol.g_HEADER_SZ_BYTES)):
+        try:
+            split(bad_payload)
+        except ValueError:
+            continue
+
+        raise ValueError('Invalid batch accepted during testing')
@@ -0,0 +1,195 @@
+"""
+Module defining the protocol for streaming large messages in chunks.
+"""
+import bisect
+import collections
+import struct
+
+_g_NET_FMT = '!'   # Network(big-endian) byte ordering for packing/unpacking
+_g_MSG_ID_FMT = 'I'  # ID of the chunked message (4 bytes alloted)
+_g_MSG_LEN_FMT = 'I'  # Total length of the chunked message (4 bytes alloted)
+_g_OFFSET_FMT = 'I'  # Offset of chunk data within message (4 bytes alloted)
+
+# Chunk 'header' format
+g_CHUNK_HEADER_FMT = _g_NET_FMT      \
+                   + _g_MSG_ID_FMT   \
+                   + _g_MSG_LEN_FMT  \
+                   + _g_OFFSET_FMT
+
+_g_CHUNK_HEADER_STRUCT = struct.Struct(g_CHUNK_HEADER_FMT)
+
+# Size of chunk 'header'
+g_CHUNK_HEADER_SZ_BYTES = _g_CHUNK_HEADER_STRUCT.size
+
+# Largest message ID, IDs wrap around after this
+g_MAX_MSG_ID \
+    = 2 ** (8 * struct.calcsize(_g_NET_FMT + _g_MSG_ID_FMT)) - 1
+
+
+def split(msg_id, data, chunk_sz):
+    """
+    Splits a serialized message into chunks
+
+    :param msg_id: ID of message, unique among the sender's messages which
+                   are still being sent
+    :param data: Serialized message
+    :param chunk_sz: Max bytes of message data per chunk
+
+    :returns: Iterator of bytes objects, one chunk each in sending order
+    """
+    view = memoryview(data)
+
+    for offset in range(0, len(data), chunk_sz):
+        header = _g_CHUNK_HEADER_STRUCT.pack(msg_id, len(data), offset)
+
+        yield header + view[offset:offset + chunk_sz]
+
+
+class _PartialMessage(object):
+    '''Structure representing a message still being reassembled'''
+    def __init__(self, msg_len):
+        '''
+        :param msg_len: Total length of the message in bytes
+        '''
+        self.buffer = bytearray(msg_len)
+        self.num_received = 0  # Bytes of the message received so far
+
+        # Sorted, disjoint [start, end) ranges of the message received so far
+        self._starts = []
+        self._ends = []
+
+    def receive(self, offset, data):
+        '''
+        Copies chunk data into the buffer, data received earlier (e.g. a
+        duplicated or overlapping chunk) is only counted once
+
+        :param offset: Offset of the data within the message
+        :param data: Bytes-like object holding the chunk data
+        '''
+        end = offset + len(data)
+        self.buffer[offset:end] = data
+
+        # Ranges overlapping or touching the new one are merged into it
+        lo = bisect.bisect_left(self._ends, offset)
+        hi = bisect.bisect_right(self._starts, end)
+
+        overlap = sum(min(end, range_end) - max(offset, range_start)
+                      for range_start, range_end
+                      in zip(self._starts[lo:hi], self._ends[lo:hi]))
+
+        if lo < hi:
+            offset = min(offset, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+
+        self._starts[lo:hi] = [offset]
+        self._ends[lo:hi] = [end]
+        self.num_received += len(data) - overlap
+
+
+class Reassembler(object):
+    '''
+    Reassembles chunked messages received over a connection. Chunks of
+    different messages may be interleaved.
+
+    Each message is written into a buffer allocated at its full size when
+    its first chunk arrives, so chunk data is copied exactly once and the
+    message is never held in pieces alongside a joined copy.
+    '''
+    def __init__(self, max_pending, max_msg_sz):
+        '''
+        :param max_pending: Max messages reassembled at once, the oldest is
+                            dropped to make room for a new one
+        :param max_msg_sz: Longest message accepted in bytes
+        '''
+        self.max_pending = max_pending
+        self.max_msg_sz = max_msg_sz
+
+        self._pending = collections.OrderedDict()  # {ID: _PartialMessage}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, chunk):
+        """
+        Adds a received chunk to its message
+
+        :param chunk: Bytes-like object holding one chunk
+
+        :returns: Serialized message as a bytearray if the chunk completed
+                  it, None otherwise
+        :raises ValueError: If the chunk is malformed or does not match
+                            earlier chunks of its message
+        """
+        if len(chunk) <= g_CHUNK_HEADER_SZ_BYTES:
+            raise ValueError('Chunk too short')
+
+        msg_id, msg_len, offset = _g_CHUNK_HEADER_STRUCT.unpack_from(chunk)
+        data = memoryview(chunk)[g_CHUNK_HEADER_SZ_BYTES:]
+
+        if msg_len > self.max_msg_sz:
+            raise ValueError(f'Chunked message too long ({msg_len} bytes)')
+
+        if offset + len(data) > msg_len:
+            raise ValueError('Chunk extends past end of message')
+
+        partial = self._pending.get(msg_id)
+
+        if partial is None:
+            if len(self._pending) >= self.max_pending:
+                # Sender abandoned a message, drop the oldest
+                self._pending.popitem(last=False)
+
+            partial = _PartialMessage(msg_len)
+            self._pending[msg_id] = partial
+
+        elif len(partial.buffer) != msg_len:
+            raise ValueError('Chunk length does not match message')
+
+        partial.receive(offset, data)
+
+        if partial.num_received < msg_len:
+            return None
+
+        del self._pending[msg_id]
+
+        return partial.buffer
+
+
+# Unit Testing
+def test():
+    data = bytes(range(256)) * 40
+    chunks = list(split(7, data, 1000))
+
+    if len(chunks) != 11:
+        raise ValueError('Message split into wrong chunks during testing')
+
+    # Chunks out of order, duplicated and overlapping are reassembled once
+    overlap = _g_CHUNK_HEADER_STRUCT.pack(7, len(data), 500) + data[500:1500]
+    received = list(reversed(chunks[1:])) + [chunks[3], overlap]
+    reassembler = Reassembler(max_pending=2, max_msg_sz=len(data))
+
+    for chunk in received:
+        if reassembler.add(chunk) is not None:
+            raise ValueError('Message completed too early during testing')
+
+    if reassembler.add(chunks[0]) != data or len(reassembler):
+        raise ValueError('Message not reassembled during testing')
+
+    # Interleaved messages, oldest is dropped once too many are pending
+    for msg_id in (1, 2, 3):
+        reassembler.add(next(split(msg_id, data, 1000)))
+
+    if len(reassembler) != 2 or 1 in reassembler._pending:
+        raise ValueError('Oldest message not dropped during testing')
+
+    # Malformed chunks are rejected
+    for bad_chunk in (chunks[0][:g_CHUNK_HEADER_SZ_BYTES],
+                      _g_CHUNK_HEADER_STRUCT.pack(4, len(data) + 1, 0) + b'x',
+                      _g_CHUNK_HEADER_STRUCT.pack(4, 10, 8) + b'xyz',
+                      _g_CHUNK_HEADER_STRUCT.pack(2, 10, 0) + b'x'):
+        try:
+            reassembler.add(bad_chunk)
+        except ValueError:
+            continue
+
+        raise ValueError('Malformed chunk accepted during testing')
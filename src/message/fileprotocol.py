@@ -0,0 +1,226 @@
+"""
+Module defining the protocol for transferring files between Endpoints.
+
+A transfer starts with an offer naming the file and identifying its content.
+The receiving Endpoint accepts it from the offset it already holds of the
+same content from the same Endpoint, so interrupted transfers resume where
+they left off, or declines it. File data is then sent in segments: each data
+message announces a range of the file whose raw bytes follow the message's
+packet directly on the stream, outside of any framing, so they can be sent
+from and received into the file without passing through a packet.
+
+Large files may instead be split into ranges sent over parallel streams.
+Each stream is a separate connection which starts with a stream message
+announcing its range, all raw bytes of the range follow.
+"""
+import struct
+
+_g_NET_FMT = '!'   # Network(big-endian) byte ordering for packing/unpacking
+_g_TRANSFER_ID_FMT = 'I'  # ID of the transfer (4 bytes alloted)
+_g_FILE_SZ_FMT = 'Q'  # Size of/offset into the file (8 bytes alloted)
+_g_FILE_ID_FMT = 'Q'  # ID of the file's content (8 bytes alloted)
+_g_SEGMENT_LEN_FMT = 'I'  # Length of a segment of file data (4 bytes alloted)
+
+# Offer 'header' format, file name follows the header
+g_OFFER_HEADER_FMT = _g_NET_FMT          \
+                   + _g_TRANSFER_ID_FMT  \
+                   + _g_FILE_SZ_FMT      \
+                   + _g_FILE_ID_FMT
+
+# Accept format
+g_ACCEPT_FMT = _g_NET_FMT          \
+             + _g_TRANSFER_ID_FMT  \
+             + _g_FILE_SZ_FMT
+
+# Decline format
+g_DECLINE_FMT = _g_NET_FMT          \
+              + _g_TRANSFER_ID_FMT
+
+# Data format, raw file data follows the packet carrying it
+g_DATA_FMT = _g_NET_FMT          \
+           + _g_TRANSFER_ID_FMT  \
+           + _g_FILE_SZ_FMT      \
+           + _g_SEGMENT_LEN_FMT
+
+# Stream format, raw file data of the whole range follows the packet
+g_STREAM_FMT = _g_NET_FMT          \
+             + _g_TRANSFER_ID_FMT  \
+             + _g_FILE_SZ_FMT      \
+             + _g_FILE_SZ_FMT
+
+_g_OFFER_HEADER_STRUCT = struct.Struct(g_OFFER_HEADER_FMT)
+_g_ACCEPT_STRUCT = struct.Struct(g_ACCEPT_FMT)
+_g_DECLINE_STRUCT = struct.Struct(g_DECLINE_FMT)
+_g_DATA_STRUCT = struct.Struct(g_DATA_FMT)
+_g_STREAM_STRUCT = struct.Struct(g_STREAM_FMT)
+
+# Encoding of file names
+_g_NAME_ENCODING = 'utf-8'
+
+# Largest transfer ID, IDs wrap around after this
+g_MAX_TRANSFER_ID \
+    = 2 ** (8 * struct.calcsize(_g_NET_FMT + _g_TRANSFER_ID_FMT)) - 1
+
+# Largest file ID
+g_MAX_FILE_ID = 2 ** (8 * struct.calcsize(_g_NET_FMT + _g_FILE_ID_FMT)) - 1
+
+# Longest segment of file data announced by a single data message
+g_MAX_SEGMENT_SZ_BYTES \
+    = 2 ** (8 * struct.calcsize(_g_NET_FMT + _g_SEGMENT_LEN_FMT)) - 1
+
+
+def pack_offer(transfer_id, file_sz, file_id, name):
+    """
+    :param transfer_id: ID of the transfer, unique among the sender's
+                        unfinished transfers
+    :param file_sz: Size of the file in bytes
+    :param file_id: ID of the file's content, changes whenever the file is
+                    modified
+    :param name: Name of the file, without any directory
+    :returns: Payload of a file offer message
+    """
+    return _g_OFFER_HEADER_STRUCT.pack(transfer_id, file_sz, file_id) \
+        + name.encode(_g_NAME_ENCODING)
+
+
+def unpack_offer(payload):
+    """
+    :param payload: Payload of a file offer message
+    :returns: Tuple of (transfer ID, file size, file ID, file name)
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) <= _g_OFFER_HEADER_STRUCT.size:
+        raise ValueError('File offer too short')
+
+    transfer_id, file_sz, file_id \
+        = _g_OFFER_HEADER_STRUCT.unpack_from(payload)
+
+    try:
+        name = bytes(payload[_g_OFFER_HEADER_STRUCT.size:]) \
+            .decode(_g_NAME_ENCODING)
+    except UnicodeDecodeError as e:
+        raise ValueError(f'File name is not valid: {e}')
+
+    return transfer_id, file_sz, file_id, name
+
+
+def pack_accept(transfer_id, offset):
+    """
+    :param transfer_id: ID of the transfer being accepted
+    :param offset: Offset into the file to start sending from
+    :returns: Payload of a file accept message
+    """
+    return _g_ACCEPT_STRUCT.pack(transfer_id, offset)
+
+
+def unpack_accept(payload):
+    """
+    :param payload: Payload of a file accept message
+    :returns: Tuple of (transfer ID, offset)
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) != _g_ACCEPT_STRUCT.size:
+        raise ValueError('File accept has wrong length')
+
+    return _g_ACCEPT_STRUCT.unpack(payload)
+
+
+def pack_decline(transfer_id):
+    """
+    :param transfer_id: ID of the transfer being declined
+    :returns: Payload of a file decline message
+    """
+    return _g_DECLINE_STRUCT.pack(transfer_id)
+
+
+def unpack_decline(payload):
+    """
+    :param payload: Payload of a file decline message
+    :returns: Transfer ID
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) != _g_DECLINE_STRUCT.size:
+        raise ValueError('File decline has wrong length')
+
+    transfer_id, = _g_DECLINE_STRUCT.unpack(payload)
+
+    return transfer_id
+
+
+def pack_data(transfer_id, offset, length):
+    """
+    :param transfer_id: ID of the transfer the data belongs to
+    :param offset: Offset of the data within the file
+    :param length: Number of raw bytes following the message's packet
+    :returns: Payload of a file data message
+    """
+    return _g_DATA_STRUCT.pack(transfer_id, offset, length)
+
+
+def unpack_data(payload):
+    """
+    :param payload: Payload of a file data message
+    :returns: Tuple of (transfer ID, offset, length)
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) != _g_DATA_STRUCT.size:
+        raise ValueError('File data has wrong length')
+
+    return _g_DATA_STRUCT.unpack(payload)
+
+
+def pack_stream(transfer_id, offset, length):
+    """
+    :param transfer_id: ID of the transfer the stream belongs to
+    :param offset: Offset of the stream's range within the file
+    :param length: Length of the range in bytes
+    :returns: Payload of a file stream message
+    """
+    return _g_STREAM_STRUCT.pack(transfer_id, offset, length)
+
+
+def unpack_stream(payload):
+    """
+    :param payload: Payload of a file stream message
+    :returns: Tuple of (transfer ID, offset, length)
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) != _g_STREAM_STRUCT.size:
+        raise ValueError('File stream has wrong length')
+
+    return _g_STREAM_STRUCT.unpack(payload)
+
+
+# Unit Testing
+def test():
+    name = 'résumé (final).pdf'
+
+    # Every message round trips, including the largest values
+    if unpack_offer(pack_offer(g_MAX_TRANSFER_ID, 2 ** 40, g_MAX_FILE_ID,
+                               name)) \
+            != (g_MAX_TRANSFER_ID, 2 ** 40, g_MAX_FILE_ID, name):
+        raise ValueError('Unable to unpack file offer during testing')
+
+    if unpack_accept(pack_accept(3, 4096)) != (3, 4096) \
+            or unpack_decline(pack_decline(3)) != 3 \
+            or unpack_data(pack_data(3, 4096, g_MAX_SEGMENT_SZ_BYTES)) \
+            != (3, 4096, g_MAX_SEGMENT_SZ_BYTES) \
+            or unpack_stream(pack_stream(3, 0, 2 ** 33)) != (3, 0, 2 ** 33):
+        raise ValueError('Unable to unpack file message during testing')
+
+    # Malformed payloads are rejected
+    bad_payloads = ((unpack_offer, pack_offer(1, 1, 1, '')),
+                    (unpack_offer, _g_OFFER_HEADER_STRUCT.pack(1, 1, 1)
+                     + b'\xff'),
+                    (unpack_accept, pack_accept(1, 0)[:-1]),
+                    (unpack_decline, pack_decline(1) + b'\x00'),
+                    (unpack_data, pack_data(1, 0, 1)[:-1]),
+                    (unpack_stream, pack_stream(1, 0, 1) + b'\x00'))
+
+    for unpack, payload in bad_payloads:
+        try:
+            unpack(payload)
+        except ValueError:
+            continue
+
+        raise ValueError('Malformed file message accepted during testing')
@@ -0,0 +1,149 @@
+"""
+Module defining the protocol for negotiating connection options.
+
+Endpoints predating options treat any message type they do not know as a
+fatal error, so options are never sent to an Endpoint which has not shown it
+understands them. Endpoints advertise their protocol version in the
+destination GUID of their broadcasts, which older Endpoints ignore. The
+Endpoint opening a connection to one which advertised a version follows its
+start message with an options message giving its protocol version and the
+capabilities it supports. The accepting Endpoint replies with its own only
+once it receives options, and both use whatever they have in common from
+then on. Every other connection speaks the original protocol.
+
+Fields may be appended to the options in future, unpacking ignores any it
+does not know.
+"""
+import enum
+import struct
+
+_g_NET_FMT = '!'   # Network(big-endian) byte ordering for packing/unpacking
+_g_FLAGS_FMT = 'I'  # Supported options as bit flags (4 bytes alloted)
+_g_DICT_ID_FMT = 'I'  # ID of the compression dictionary (4 bytes alloted)
+_g_VERSION_FMT = 'H'  # Protocol version (2 bytes alloted)
+
+# Options format
+g_OPTIONS_FMT = _g_NET_FMT      \
+              + _g_FLAGS_FMT    \
+              + _g_DICT_ID_FMT  \
+              + _g_VERSION_FMT
+
+_g_OPTIONS_STRUCT = struct.Struct(g_OPTIONS_FMT)
+
+# Dictionary ID sent when compression uses no preset dictionary
+g_NO_DICT_ID = 0
+
+# Protocol versions. Endpoints never sending options speak the original
+# protocol.
+g_ORIGINAL_VERSION = 0
+g_PROTOCOL_VERSION = 2  # Version spoken by the host
+
+# Marker identifying a broadcast destination GUID which advertises the
+# sender's protocol version. Older Endpoints broadcast a destination of 0.
+_g_ADVERT_MARKER = 0x4f505453  # 'OPTS'
+_g_ADVERT_VERSION_BITS = 8 * struct.calcsize(_g_NET_FMT + _g_VERSION_FMT)
+
+
+class Option(enum.IntFlag):
+    '''Bit flags of capabilities an Endpoint supports on a connection'''
+    # Messages may be compressed with a zlib stream spanning the connection
+    COMPRESSION = 0x1
+    # Packets may be longer than the length prefix, in extended frames
+    LARGE_FRAMES = 0x2
+    # Message timestamps may be sent as epoch nanoseconds
+    BINARY_TIMESTAMPS = 0x4
+    # Short messages may be sent together in batch messages
+    BATCHING = 0x8
+    # Packets may leave out the GUIDs both Endpoints know from the connection
+    COMPACT_HEADERS = 0x10
+    # Quiet connections are pinged and dropped if they stop answering
+    HEARTBEATS = 0x20
+    # Idle connections may be closed with a park message and reopened later
+    PARKING = 0x40
+    # Files may be offered and sent over the connection
+    FILE_TRANSFER = 0x80
+    # Long messages may be split into chunks
+    CHUNKING = 0x100
+
+
+def pack_advert(version=g_PROTOCOL_VERSION):
+    """
+    :param version: Protocol version the sender speaks
+    :returns: Destination GUID of a broadcast advertising the version
+    """
+    return (_g_ADVERT_MARKER << _g_ADVERT_VERSION_BITS) | version
+
+
+def unpack_advert(dst_guid):
+    """
+    :param dst_guid: Destination GUID of a received broadcast
+    :returns: Protocol version the broadcasting Endpoint speaks,
+              g_ORIGINAL_VERSION if it advertised none
+    """
+    if dst_guid >> _g_ADVERT_VERSION_BITS != _g_ADVERT_MARKER:
+        return g_ORIGINAL_VERSION
+
+    return dst_guid & ((1 << _g_ADVERT_VERSION_BITS) - 1)
+
+
+def pack_options(options, dict_id=g_NO_DICT_ID, version=g_PROTOCOL_VERSION):
+    """
+    :param options: Option flags the sender supports
+    :param dict_id: Adler-32 checksum of the sender's compression dictionary
+    :param version: Protocol version the sender speaks
+    :returns: Payload of a connection options message
+    """
+    return _g_OPTIONS_STRUCT.pack(options, dict_id, version)
+
+
+def unpack_options(payload):
+    """
+    :param payload: Payload of a connection options message
+    :returns: Tuple of (Option flags, dictionary ID, protocol version).
+              Flags unknown to the receiver are cleared.
+    :raises ValueError: If the payload is malformed
+    """
+    if len(payload) < _g_OPTIONS_STRUCT.size:
+        raise ValueError('Connection options too short')
+
+    flags, dict_id, version = _g_OPTIONS_STRUCT.unpack_from(payload)
+    known = 0
+
+    for option in Option:
+        known |= option
+
+    return Option(flags & known), dict_id, version
+
+
+# Unit Testing
+def test():
+    # Advertised versions round trip, GUIDs of older broadcasts carry none
+    if unpack_advert(pack_advert()) != g_PROTOCOL_VERSION \
+            or unpack_advert(pack_advert(7)) != 7:
+        raise ValueError('Unable to unpack advertised version during testing')
+
+    for dst_guid in (0, 1000, 0x0123456789abcdef0123456789abcdef):
+        if unpack_advert(dst_guid) != g_ORIGINAL_VERSION:
+            raise ValueError('Version found in plain GUID during testing')
+
+    # Options round trip
+    options = Option.COMPRESSION | Option.LARGE_FRAMES
+
+    if unpack_options(pack_options(options, 1234)) \
+            != (options, 1234, g_PROTOCOL_VERSION):
+        raise ValueError('Unable to unpack options during testing')
+
+    # Options of later versions may carry fields and flags the receiver does
+    # not know
+    extended = _g_OPTIONS_STRUCT.pack(options | 0x80000000, g_NO_DICT_ID, 9) \
+        + b'future fields'
+
+    if unpack_options(extended) != (options, g_NO_DICT_ID, 9):
+        raise ValueError('Unable to unpack later version during testing')
+
+    try:
+        unpack_options(extended[:_g_OPTIONS_STRUCT.size - 1])
+    except ValueError:
+        return
+
+    raise ValueError('Truncated options accepted during testing')
@@ -23,12 +23,38 @@ class MsgType(enum.Enum):
     ENDPOINT_TEXT_COMMUNICATION = 4
     # Acknowledgement that communication succeeded
     ENDPOINT_COMMUNICATION_ACK = 5
-
-    NUM_MSG_TYPES = ENDPOINT_COMMUNICATION_ACK + 1
+    # Liveness probe sent over an idle connection
+    ENDPOINT_PING = 6
+    # Reply to a liveness probe
+    ENDPOINT_PONG = 7
+    # Notice that an idle connection is being closed, Endpoint stays known
+    ENDPOINT_CONNECTION_PARK = 8
+    # Piece of a message too long to send in a single packet
+    ENDPOINT_CHUNK = 9
+    # Offer to send a file
+    ENDPOINT_FILE_OFFER = 10
+    # Acceptance of an offered file, from the offset to resume at
+    ENDPOINT_FILE_ACCEPT = 11
+    # Segment of a file, raw file data follows the packet on the stream
+    ENDPOINT_FILE_DATA = 12
+    # Start of a parallel stream of file data, opens its own connection
+    ENDPOINT_FILE_STREAM = 13
+    # Options supported on the connection, follows the connection start
+    ENDPOINT_CONNECTION_OPTIONS = 14
+    # Message compressed with the connection's compression stream
+    ENDPOINT_COMPRESSED = 15
+    # Several short messages sent together in one packet
+    ENDPOINT_BATCH = 16
+    # Refusal of an offered file
+    ENDPOINT_FILE_DECLINE = 17
+
+    NUM_MSG_TYPES = ENDPOINT_FILE_DECLINE + 1
 
 
 class Msg(object):
     '''Structure representing message to be sent between Endpoints'''
+    __slots__ = ('msg_type', 'payload', 'timestamp')
+
     TIMESTAMP_SZ_BYTES = 19  # Length of ISO formatted time string
 
     def __init__(self, msg_type, payload, timestamp=None):
@@ -37,10 +63,11 @@ class Msg(object):
 
         :param msg_type: Type of message denoted given by MsgType enum
         :param payload: Message data as 'bytes' object
-        :param timestamp: Optional timestamp, if None current timestamp used
+        :param timestamp: Optional ISO timestamp string or epoch
+                          nanoseconds, if None current timestamp used
         """
         if timestamp is None:
-            self.timestamp = timeutils.get_iso_timestamp()
+            self.timestamp = timeutils.get_ns_timestamp()
         else:
             self.timestamp = timestamp
 
@@ -61,11 +88,28 @@ class Msg(object):
 # Used for validation of MsgType
 CONNECTION_MSG_TYPES = [MsgType.ENDPOINT_CONNECTION_BROADCAST,
                         MsgType.ENDPOINT_CONNECTION_START,
-                        MsgType.ENDPOINT_DISCONNECTION]
+                        MsgType.ENDPOINT_DISCONNECTION,
+                        MsgType.ENDPOINT_CONNECTION_PARK]
 
 COMMUNICATION_MSG_TYPES = [MsgType.ENDPOINT_TEXT_COMMUNICATION,
                            MsgType.ENDPOINT_COMMUNICATION_ACK]
 
+BINARY_MSG_TYPES = [MsgType.ENDPOINT_PING,
+                    MsgType.ENDPOINT_PONG,
+                    MsgType.ENDPOINT_CHUNK,
+                    MsgType.ENDPOINT_FILE_OFFER,
+                    MsgType.ENDPOINT_FILE_ACCEPT,
+                    MsgType.ENDPOINT_FILE_DECLINE,
+                    MsgType.ENDPOINT_FILE_DATA,
+                    MsgType.ENDPOINT_FILE_STREAM,
+                    MsgType.ENDPOINT_CONNECTION_OPTIONS,
+                    MsgType.ENDPOINT_COMPRESSED,
+                    MsgType.ENDPOINT_BATCH]
+
+# Messages followed on the stream by raw data instead of further packets
+RAW_DATA_MSG_TYPES = [MsgType.ENDPOINT_FILE_DATA,
+                      MsgType.ENDPOINT_FILE_STREAM]
+
 
 def encode_payload(msg_type, payload):
     '''Encodes the message's payload'''
@@ -82,6 +126,10 @@ def encode_payload(msg_type, payload):
             # Bytes object so no need to encode
             pass
 
+    elif msg_type in BINARY_MSG_TYPES:
+        # Payload is an opaque 'bytes' object
+        pass
+
     else:
         raise ValueError(f'{str(msg_type)} is not a supported MsgType')
 
@@ -95,8 +143,12 @@ def decode_payload(msg_type, raw_payload):
         return netid.frombytes(raw_payload)
 
     elif msg_type in COMMUNICATION_MSG_TYPES:
-        # Payload is a string or bytes object
-        return raw_payload.decode(c.Config.get(c.ConfigEnum.BYTE_ENCODING))
+        # Payload is a string or bytes-like object
+        return str(raw_payload, c.Config.get(c.ConfigEnum.BYTE_ENCODING))
+
+    elif msg_type in BINARY_MSG_TYPES:
+        # Payload is an opaque 'bytes' object
+        return raw_payload
 
     else:
         raise ValueError('%s is not a supported MsgType'
@@ -4,6 +4,7 @@ Module defining the protocol for serializing and deserializing messages.
 import msg
 import config as c
 import struct
+import timeutils
 
 
 _g_NET_FMT = '!'   # Network(big-endian) byte ordering for packing/unpacking
@@ -25,6 +26,26 @@ g_MSG_HEADER_FMT = _g_NET_FMT           \
 # Size of msg 'header'
 g_HEADER_SZ_BYTES = struct.calcsize(g_MSG_HEADER_FMT)
 
+# Flag set in the message type field of messages whose header carries the
+# timestamp as epoch nanoseconds in place of the ISO string. Only sent to
+# Endpoints which negotiated binary timestamps.
+g_BINARY_TIMESTAMP_FLAG = 0x80
+_g_BINARY_TIMESTAMP_FMT = 'Q'  # Epoch nanoseconds (8 bytes alloted)
+
+# Msg 'header' format with a binary timestamp
+g_BINARY_MSG_HEADER_FMT = _g_NET_FMT           \
+                        + _g_LEN_PREF_FMT      \
+                        + _g_MSG_TYPE_FMT      \
+                        + _g_BINARY_TIMESTAMP_FMT
+
+# Size of msg 'header' with a binary timestamp
+g_BINARY_HEADER_SZ_BYTES = struct.calcsize(g_BINARY_MSG_HEADER_FMT)
+
+# Longest message whose length fits in the length prefix. Longer messages
+# carry 0 in the prefix and extend to the end of their packet.
+g_MAX_SHORT_MSG_SZ_BYTES = 2 ** (8 * g_LEN_PREF_SZ_BYTES) - 1
+g_UNKNOWN_LEN = 0
+
 variable_data_fmt = '%ds'  # Format for variable message data
 
 pack_fmt = g_MSG_HEADER_FMT + variable_data_fmt  # Packing format
@@ -33,15 +54,15 @@ unpack_fmt = g_MSG_HEADER_FMT + variable_data_fmt  # Unpacking format
 
 def serialize(message):
     """
-    Serializes message for sending over wire
+    Serializes message for sending over wire, with an ISO timestamp
 
     :param message: message to send
 
     :returns: Bytes object representing message to send
     """
     # Encode the timestamp and payload
-    encoded_timestamp \
-        = message.timestamp.encode(c.Config.get(c.ConfigEnum.BYTE_ENCODING))
+    encoded_timestamp = timeutils.to_iso(message.timestamp).encode(
+        c.Config.get(c.ConfigEnum.BYTE_ENCODING))
 
     encoded_payload = msg.encode_payload(message.msg_type, message.payload)
 
@@ -49,6 +70,9 @@ def serialize(message):
     dynamic_fmt = pack_fmt % (len(encoded_payload))
     msg_sz = struct.calcsize(dynamic_fmt)
 
+    if msg_sz > g_MAX_SHORT_MSG_SZ_BYTES:
+        msg_sz = g_UNKNOWN_LEN
+
     return struct.pack(dynamic_fmt,
                        msg_sz,
                        message.msg_type.value,
@@ -68,21 +92,108 @@ def deserialize(byte_data):
     if not is_valid_msg(byte_data):
         raise ValueError('Attempt to deserialize invalid message')
 
+    if has_binary_timestamp(byte_data):
+        header_fmt = g_BINARY_MSG_HEADER_FMT
+    else:
+        header_fmt = g_MSG_HEADER_FMT
+
     # Calculate the size of the payload and construct unpacking format
-    payload_sz = len(byte_data) - g_HEADER_SZ_BYTES
-    dynamic_fmt = unpack_fmt % (payload_sz)
+    payload_sz = len(byte_data) - header_size(byte_data)
+    dynamic_fmt = header_fmt + variable_data_fmt % (payload_sz)
 
     # Unpack the binary data
     msg_len, raw_msg_type, raw_timestamp, raw_payload \
         = struct.unpack(dynamic_fmt, byte_data)
 
-    msg_type = msg.MsgType(raw_msg_type)
+    msg_type = msg.MsgType(raw_msg_type & ~g_BINARY_TIMESTAMP_FLAG)
     payload = msg.decode_payload(msg_type, raw_payload)
-    timestamp = raw_timestamp.decode(c.Config.get(c.ConfigEnum.BYTE_ENCODING))
+
+    if isinstance(raw_timestamp, int):
+        timestamp = raw_timestamp
+    else:
+        timestamp = raw_timestamp.decode(
+            c.Config.get(c.ConfigEnum.BYTE_ENCODING))
 
     return msg.Msg(msg_type, payload, timestamp)
 
 
+class MsgView(object):
+    """
+    Read-only view of a serialized message. Message type is read when the
+    view is created, everything else is only decoded when accessed and the
+    message's bytes are never copied.
+    """
+    __slots__ = ('msg_type', '_data', '_codec', '_header_sz')
+
+    def __init__(self, byte_data, codec=None):
+        """
+        :param byte_data: Bytes-like object holding exactly one serialized
+                          message. View is only valid as long as it is.
+        :param codec: WireCodec to decode with, None to decode with the
+                      configured byte encoding
+        :raises ValueError: If bytes do not represent a valid message
+        """
+        if len(byte_data) <= g_LEN_PREF_SZ_BYTES:
+            raise ValueError('Message too short')
+
+        header_sz = header_size(byte_data)
+
+        if len(byte_data) < header_sz:
+            raise ValueError('Message too short')
+
+        raw_msg_type = byte_data[g_LEN_PREF_SZ_BYTES] \
+            & ~g_BINARY_TIMESTAMP_FLAG
+
+        if codec is None:
+            # Enum raises ValueError for an invalid MsgType
+            self.msg_type = msg.MsgType(raw_msg_type)
+        else:
+            self.msg_type = codec.msg_type(raw_msg_type)
+
+        self._data = memoryview(byte_data)
+        self._codec = codec
+        self._header_sz = header_sz
+
+    def __repr__(self):
+        return '<%s type:%s len:%d>' \
+            % (self.__class__.__name__, self.msg_type.name, len(self._data))
+
+    @property
+    def timestamp(self):
+        """
+        Timestamp the message was sent at, as epoch nanoseconds if the
+        message carries a binary timestamp and as an ISO string otherwise
+        """
+        timestamp_start = g_LEN_PREF_SZ_BYTES + g_MSG_TYPE_SZ_BYTES
+
+        if self._header_sz == g_BINARY_HEADER_SZ_BYTES:
+            return int.from_bytes(
+                self._data[timestamp_start:self._header_sz], 'big')
+
+        if self._codec is None:
+            encoding = c.Config.get(c.ConfigEnum.BYTE_ENCODING)
+        else:
+            encoding = self._codec.encoding
+
+        return str(self._data[timestamp_start:g_HEADER_SZ_BYTES], encoding)
+
+    @property
+    def raw_payload(self):
+        """Memoryview of the message's encoded payload"""
+        return self._data[self._header_sz:]
+
+    @property
+    def payload(self):
+        """
+        Message's payload decoded to the correct object. Binary payloads
+        stay views of the message's bytes.
+        """
+        if self._codec is None:
+            return msg.decode_payload(self.msg_type, self.raw_payload)
+
+        return self._codec.decode_payload(self.msg_type, self.raw_payload)
+
+
 def __get_raw_msg_type(byte_data):
     '''
     Extracts the raw message type from the byte data
@@ -98,7 +209,27 @@ def __get_raw_msg_type(byte_data):
     msg_type_bytes = byte_data[msg_type_start:msg_type_end]
     raw_msg_type = int.from_bytes(msg_type_bytes, 'big')
 
-    return raw_msg_type
+    return raw_msg_type & ~g_BINARY_TIMESTAMP_FLAG
+
+
+def has_binary_timestamp(byte_data):
+    '''
+    :param byte_data: Bytes representing message, at least up to its type
+    :returns: True if the message's timestamp is epoch nanoseconds, False
+              if it is an ISO string
+    '''
+    return bool(byte_data[g_LEN_PREF_SZ_BYTES] & g_BINARY_TIMESTAMP_FLAG)
+
+
+def header_size(byte_data):
+    '''
+    :param byte_data: Bytes representing message, at least up to its type
+    :returns: Size of the message's header in bytes
+    '''
+    if has_binary_timestamp(byte_data):
+        return g_BINARY_HEADER_SZ_BYTES
+
+    return g_HEADER_SZ_BYTES
 
 
 def is_valid_msg(byte_data):
@@ -110,7 +241,8 @@ def is_valid_msg(byte_data):
     '''
     valid = False
 
-    if len(byte_data) < g_HEADER_SZ_BYTES:
+    if len(byte_data) <= g_LEN_PREF_SZ_BYTES \
+            or len(byte_data) < header_size(byte_data):
         # Message length check
         valid = False
     else:
@@ -0,0 +1,227 @@
+'''
+Module providing buffering for reassembling length-prefixed frames received
+over a stream socket.
+'''
+import netprotocol
+import struct
+
+
+class FrameBuffer(object):
+    '''
+    Growable receive buffer which reassembles partial reads and splits
+    coalesced reads into complete NetPacket frames.
+
+    Data is received directly into the buffer so the stream is only copied
+    once on its way out of the kernel. Frames are handed out as memoryviews
+    into the buffer and are only valid until the next call to 'recv_into'.
+    '''
+    INITIAL_SZ_BYTES = 4096  # Starting capacity of the buffer
+    MIN_READ_SZ_BYTES = 1024  # Minimum free space offered to each read
+    MAX_FRAME_SZ_BYTES = 16 * 1024 * 1024  # Longest frame accepted
+
+    # Length prefix of a frame (includes the prefix itself)
+    _LEN_PREF_STRUCT = struct.Struct('!H')
+    # Extended length field following the prefix of long frames
+    _EXT_LEN_STRUCT = struct.Struct('!I')
+
+    def __init__(self, size=INITIAL_SZ_BYTES):
+        '''
+        FrameBuffer initialization
+
+        :param size: Initial capacity of the buffer in bytes
+        '''
+        self._buf = bytearray(size)
+        self._start = 0  # Index of first unconsumed byte
+        self._end = 0    # Index one past the last received byte
+
+    def __len__(self):
+        '''
+        Gets the number of buffered bytes not yet consumed as frames
+
+        :returns: Number of unconsumed bytes
+        '''
+        return self._end - self._start
+
+    def recv_into(self, sock):
+        '''
+        Receives data from socket directly into the buffer's free space
+
+        :param sock: Socket to receive from
+        :returns: Number of bytes received, 0 if peer closed the stream
+        '''
+        self.__reserve()
+
+        with memoryview(self._buf) as view:
+            num_bytes = sock.recv_into(view[self._end:])
+
+        self._end += num_bytes
+
+        return num_bytes
+
+    def decode_many(self, codec):
+        '''
+        Consumes every complete frame currently buffered, reading their
+        headers in a single pass. Frames followed by raw data end the pass,
+        the data is left to be taken.
+
+        :param codec: WireCodec reading the frames' headers
+        :returns: List of wirecodec.FrameRecords in stream order, frames are
+                  only valid until the next call to 'recv_into'
+        :raises ValueError: If a frame's length prefix is invalid
+        '''
+        pending = memoryview(self._buf)[self._start:self._end]
+        records, num_bytes = codec.decode_many(pending,
+                                               FrameBuffer.MAX_FRAME_SZ_BYTES)
+
+        self._start += num_bytes
+
+        return records
+
+    def take(self, max_bytes):
+        '''
+        Consumes buffered bytes which are not framed (e.g. raw data which
+        follows a frame announcing it)
+
+        :param max_bytes: Max number of bytes to take
+        :returns: Memoryview of the bytes, valid until the next call to
+                  'recv_into'
+        '''
+        num_bytes = min(len(self), max_bytes)
+        start = self._start
+
+        self._start += num_bytes
+
+        return memoryview(self._buf)[start:self._start]
+
+    def __next_frame_len(self):
+        '''
+        Reads the length prefix of the next frame if it has been received
+
+        :returns: Length of next frame in bytes or None if not yet known
+        :raises ValueError: If the length prefix is invalid
+        '''
+        if len(self) < netprotocol.g_LEN_PREF_SZ_BYTES:
+            return None
+
+        frame_len, = FrameBuffer._LEN_PREF_STRUCT.unpack_from(self._buf,
+                                                              self._start)
+        min_len = netprotocol.g_HEADER_SZ_BYTES
+
+        if frame_len in (netprotocol.g_EXT_LEN_MARKER,
+                         netprotocol.g_COMPACT_LEN_MARKER):
+            # Real length of a long or compact frame follows the prefix
+            if len(self) < netprotocol.g_LEN_PREF_SZ_BYTES \
+                    + netprotocol.g_EXT_LEN_SZ_BYTES:
+                return None
+
+            if frame_len == netprotocol.g_EXT_LEN_MARKER:
+                min_len = netprotocol.g_EXT_HEADER_SZ_BYTES
+            else:
+                min_len = netprotocol.g_COMPACT_HEADER_SZ_BYTES
+
+            frame_len, = FrameBuffer._EXT_LEN_STRUCT.unpack_from(
+                self._buf, self._start + netprotocol.g_LEN_PREF_SZ_BYTES)
+
+        if not min_len <= frame_len <= FrameBuffer.MAX_FRAME_SZ_BYTES:
+            raise ValueError(f'Invalid frame length {frame_len}')
+
+        return frame_len
+
+    def __reserve(self):
+        '''
+        Makes room at the end of the buffer for the next read. Unconsumed
+        data is moved to the front of the buffer and the buffer is grown
+        so the rest of a partially received frame will fit.
+        '''
+        if self._start == self._end:
+            # Everything consumed, reuse buffer from the start
+            self._start = self._end = 0
+
+        try:
+            needed = self.__next_frame_len() or 0
+        except ValueError:
+            needed = 0  # Reported when frames are next requested
+
+        needed = max(needed, len(self) + FrameBuffer.MIN_READ_SZ_BYTES)
+
+        if len(self._buf) - self._start >= needed:
+            # Enough room without moving anything
+            return
+
+        unconsumed = len(self)
+
+        if len(self._buf) >= needed:
+            # Shift unconsumed data to the front of the buffer
+            self._buf[:unconsumed] = self._buf[self._start:self._end]
+        else:
+            # Grow into a new buffer holding the unconsumed data
+            new_buf = bytearray(max(needed, 2 * len(self._buf)))
+            new_buf[:unconsumed] = self._buf[self._start:self._end]
+            self._buf = new_buf
+
+        self._start = 0
+        self._end = unconsumed
+
+
+# Unit Testing
+def test():
+    import msg
+    import wirecodec
+
+    class _Socket(object):
+        '''Socket delivering a stream in reads of varying size'''
+        def __init__(self, data):
+            self.data = data
+            self.pos = 0
+            self.num_reads = 0
+
+        def recv_into(self, view):
+            self.num_reads += 1
+            num_bytes = min(len(view), 1 + self.num_reads * 997 % 5000,
+                            len(self.data) - self.pos)
+            view[:num_bytes] = self.data[self.pos:self.pos + num_bytes]
+            self.pos += num_bytes
+
+            return num_bytes
+
+    codec = wirecodec.WireCodec('utf-8')
+    texts = ['x' * (num * 311 % 3000) for num in range(100)] \
+        + ['y' * (2 ** 17)]
+
+    # Frames split over reads and coalesced into one read are reassembled,
+    # the buffer grows for frames longer than it
+    stream = b''.join(codec.encode_packet(
+        1, 2, msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, text))
+        for text in texts)
+    sock = _Socket(stream)
+    rx_buffer = FrameBuffer()
+    received = []
+
+    while rx_buffer.recv_into(sock):
+        received += [codec.view_frame(record).msg.payload
+                     for record in rx_buffer.decode_many(codec)]
+
+    if received != texts or len(rx_buffer):
+        raise ValueError('Frames not reassembled during testing')
+
+    # Raw data following a frame is taken as it is
+    data_pkt = codec.encode_packet(
+        1, 2, msg.Msg(msg.MsgType.ENDPOINT_FILE_DATA, bytes(16)))
+    rx_buffer.recv_into(_Socket(data_pkt + b'raw data' + stream[:100]))
+
+    if len(rx_buffer.decode_many(codec)) != 1 \
+            or rx_buffer.take(8) != b'raw data' or len(rx_buffer) != 100:
+        raise ValueError('Raw data not taken during testing')
+
+    # Frames longer than accepted are rejected
+    rx_buffer = FrameBuffer()
+    rx_buffer.recv_into(_Socket(b'\x00\x00'
+                                + (FrameBuffer.MAX_FRAME_SZ_BYTES + 1)
+                                .to_bytes(4, 'big')))
+
+    try:
+        rx_buffer.decode_many(codec)
+    except ValueError:
+        return
+
+    raise ValueError('Frame too long accepted during testing')
@@ -1,15 +1,27 @@
 '''
 Module defining structure for Endpoint identifying information
 '''
+import collections
 import config as c
 import struct
 import sys
+import threading
+
+# Most NetIDs kept for sharing, the least recently used are dropped
+_g_MAX_INTERNED = 1024
+
+# NetIDs shared by everything identifying an Endpoint {guid: NetID}, least
+# recently used first
+_g_interned = collections.OrderedDict()
+_g_interned_lock = threading.Lock()
 
 
 class NetID(object):
     '''
     Structure representing Endpoint identification
     '''
+    __slots__ = ('guid', 'name')
+
     GUID_SZ_BYTES = 16  # GUIDs are 128-bit integers
     GUID_PACK_FMT = f'{GUID_SZ_BYTES}s'  # GUID as bytes
     NAME_PACK_FMT = '%ds'  # Name string as bytes with dynamic length
@@ -35,6 +47,34 @@ class NetID(object):
             % (self.__class__.__name__, self.guid, self.name)
 
 
+def intern(guid, name):
+    '''
+    Gets an Endpoint's NetID, sharing one object between everything which
+    identifies the Endpoint by the same name. Shared NetIDs must not be
+    modified.
+
+    :param guid: Endpoint GUID
+    :param name: Endpoint friendly name
+    :returns: NetID
+    '''
+    with _g_interned_lock:
+        nid = _g_interned.get(guid)
+
+        if nid is not None and nid.name == name:
+            _g_interned.move_to_end(guid)
+            return nid
+
+        # New Endpoint or a new name for it
+        nid = NetID(guid, name)
+        _g_interned[guid] = nid
+        _g_interned.move_to_end(guid)
+
+        if len(_g_interned) > _g_MAX_INTERNED:
+            _g_interned.popitem(last=False)
+
+    return nid
+
+
 # Use struct.pack so identifications of various data types
 # can be added to NetID in future
 def tobytes(nid):
@@ -69,7 +109,7 @@ def frombytes(nid):
     name = enc_name.decode(c.Config.get(c.ConfigEnum.BYTE_ENCODING))
     guid = int.from_bytes(guid_bytes, byteorder=sys.byteorder)
 
-    return NetID(guid, name)
+    return intern(guid, name)
 
 
 # Unit Testing
@@ -7,6 +7,7 @@ class NetPacket(object):
     """
     Structure for sending data between Endpoints
     """
+    __slots__ = ('src', 'dst', 'msg_payload')
 
     def __init__(self, endpoint_src, endpoint_dst, msg_payload):
         """
@@ -11,6 +11,7 @@ import sys
 
 _g_NET_FMT = '!'   # Network(big-endian) byte ordering for packing/unpacking
 _g_LEN_PREF_FMT = 'H'  # Length-prefix formatting (2 bytes alloted)
+_g_EXT_LEN_FMT = 'I'  # Extended length formatting (4 bytes alloted)
 _g_SRC_ID_FMT = netid.NetID.GUID_PACK_FMT  # Src GUID format
 _g_DST_ID_FMT = netid.NetID.GUID_PACK_FMT  # Dst GUID format
 
@@ -21,11 +22,46 @@ g_MSG_HEADER_FMT = _g_NET_FMT + _g_LEN_PREF_FMT + _g_SRC_ID_FMT + _g_DST_ID_FMT
 # Size of msg 'header'
 g_HEADER_SZ_BYTES = struct.calcsize(g_MSG_HEADER_FMT)
 
+# Packets too long for the length prefix carry this in the prefix, with the
+# real length following in an extended length field
+g_EXT_LEN_MARKER = 0
+# Longest packet whose length fits in the length prefix
+g_MAX_SHORT_PKT_SZ_BYTES = 2 ** (8 * g_LEN_PREF_SZ_BYTES) - 1
+# Bytes alloted for extended length field
+g_EXT_LEN_SZ_BYTES = struct.calcsize(_g_NET_FMT + _g_EXT_LEN_FMT)
+# Extended pkt 'header' format
+g_EXT_HEADER_FMT = _g_NET_FMT + _g_LEN_PREF_FMT + _g_EXT_LEN_FMT \
+    + _g_SRC_ID_FMT + _g_DST_ID_FMT
+# Size of extended pkt 'header'
+g_EXT_HEADER_SZ_BYTES = struct.calcsize(g_EXT_HEADER_FMT)
+
+# Packets sent over a connection whose Endpoints agreed to compact headers
+# carry this in the prefix, with the real length following. GUIDs are left
+# out, the receiver knows them from the connection.
+g_COMPACT_LEN_MARKER = 1
+# Compact pkt 'header' format
+g_COMPACT_HEADER_FMT = _g_NET_FMT + _g_LEN_PREF_FMT + _g_EXT_LEN_FMT
+# Size of compact pkt 'header'
+g_COMPACT_HEADER_SZ_BYTES = struct.calcsize(g_COMPACT_HEADER_FMT)
+
 variable_data_fmt = '%ds'  # Format for variable message data
 
 pack_fmt = g_MSG_HEADER_FMT + variable_data_fmt  # Packing format
 unpack_fmt = g_MSG_HEADER_FMT + variable_data_fmt  # Unpacking format
 
+ext_pack_fmt = g_EXT_HEADER_FMT + variable_data_fmt  # Extended packing
+ext_unpack_fmt = g_EXT_HEADER_FMT + variable_data_fmt  # Extended unpacking
+
+
+def pack_guid(guid):
+    """
+    :param guid: Endpoint GUID as int
+    :returns: GUID as it is serialized in packet headers
+    """
+    return guid.to_bytes(netid.NetID.GUID_SZ_BYTES,
+                         byteorder=sys.byteorder,
+                         signed=False)
+
 
 def serialize(packet):
     """
@@ -38,12 +74,20 @@ def serialize(packet):
     dynamic_fmt = pack_fmt % (len(packet))
     msg_sz = struct.calcsize(dynamic_fmt)
 
-    src_guid_bytes = packet.src.to_bytes(netid.NetID.GUID_SZ_BYTES,
-                                         byteorder=sys.byteorder,
-                                         signed=False)
-    dst_guid_bytes = packet.dst.to_bytes(netid.NetID.GUID_SZ_BYTES,
-                                         byteorder=sys.byteorder,
-                                         signed=False)
+    src_guid_bytes = pack_guid(packet.src)
+    dst_guid_bytes = pack_guid(packet.dst)
+
+    if msg_sz > g_MAX_SHORT_PKT_SZ_BYTES:
+        # Length does not fit in the prefix, use an extended length field
+        dynamic_fmt = ext_pack_fmt % (len(packet))
+        msg_sz = struct.calcsize(dynamic_fmt)
+
+        return struct.pack(dynamic_fmt,
+                           g_EXT_LEN_MARKER,
+                           msg_sz,
+                           src_guid_bytes,
+                           dst_guid_bytes,
+                           packet.msg_payload)
 
     return struct.pack(dynamic_fmt,
                        msg_sz,
@@ -64,11 +108,21 @@ def deserialize(byte_data):
     if not is_valid_pkt(byte_data):
         raise ValueError('Attempt to deserialize invalid packet')
 
-    payload_sz = len(byte_data) - g_HEADER_SZ_BYTES
-    dynamic_fmt = unpack_fmt % (payload_sz)
+    if is_compact(byte_data):
+        raise ValueError('Compact packet has no GUIDs to deserialize')
+
+    if is_extended(byte_data):
+        payload_sz = len(byte_data) - g_EXT_HEADER_SZ_BYTES
+        dynamic_fmt = ext_unpack_fmt % (payload_sz)
+
+        marker, pkt_len, src_bytes, dst_bytes, payload \
+            = struct.unpack(dynamic_fmt, byte_data)
+    else:
+        payload_sz = len(byte_data) - g_HEADER_SZ_BYTES
+        dynamic_fmt = unpack_fmt % (payload_sz)
 
-    pkt_len, src_bytes, dst_bytes, payload = struct.unpack(dynamic_fmt,
-                                                           byte_data)
+        pkt_len, src_bytes, dst_bytes, payload = struct.unpack(dynamic_fmt,
+                                                               byte_data)
 
     src = int.from_bytes(src_bytes,
                          byteorder=sys.byteorder,
@@ -81,6 +135,147 @@ def deserialize(byte_data):
     return np.NetPacket(src, dst, payload)
 
 
+class PacketView(object):
+    """
+    Read-only view of a serialized NetPacket. Nothing is copied or converted
+    when the view is created. Header fields are read from the packet's
+    bytes when accessed and the message is only decoded once its payload is
+    used, so routing a packet on its message type or GUIDs is cheap.
+    """
+    __slots__ = ('msg', '_data', '_src_start', '_guids')
+
+    def __init__(self, byte_data, codec=None, src_guid=None, dst_guid=None,
+                 header_sz=None):
+        """
+        :param byte_data: Bytes-like object holding exactly one serialized
+                          NetPacket. View is only valid as long as it is.
+        :param codec: WireCodec to decode the message with, None to decode
+                      with the configured byte encoding
+        :param src_guid: GUID of the Endpoint which sent a compact packet,
+                         if known
+        :param dst_guid: GUID of the Endpoint a compact packet was sent to,
+                         if known
+        :param header_sz: Size of the packet's header if already known
+        :raises ValueError: If bytes do not represent a valid NetPacket
+        """
+        data = memoryview(byte_data)
+
+        if header_sz is None:
+            header_sz = header_size(data)
+
+        if len(data) < header_sz:
+            raise ValueError('Packet too short')
+
+        self._data = data
+
+        if header_sz == g_COMPACT_HEADER_SZ_BYTES:
+            # GUIDs are not in the packet, only known from its connection
+            self._src_start = None
+            self._guids = (src_guid, dst_guid)
+        else:
+            self._src_start = header_sz - 2 * netid.NetID.GUID_SZ_BYTES
+
+        # View of the packet's message, validated along with the packet
+        self.msg = msgprotocol.MsgView(data[header_sz:], codec)
+
+    def __repr__(self):
+        return '<%s len:%d msg:%r>' \
+            % (self.__class__.__name__, len(self._data), self.msg)
+
+    @property
+    def compact(self):
+        """True if the packet's GUIDs are only known from its connection"""
+        return self._src_start is None
+
+    @property
+    def src_bytes(self):
+        """
+        Source Endpoint's serialized GUID, a memoryview into the packet
+        unless the packet is compact. None if unknown.
+        """
+        if self.compact:
+            return self.__pack_known_guid(self._guids[0])
+
+        return self._data[self._src_start:
+                          self._src_start + netid.NetID.GUID_SZ_BYTES]
+
+    @property
+    def dst_bytes(self):
+        """
+        Destination Endpoint's serialized GUID, a memoryview into the packet
+        unless the packet is compact. None if unknown.
+        """
+        if self.compact:
+            return self.__pack_known_guid(self._guids[1])
+
+        dst_start = self._src_start + netid.NetID.GUID_SZ_BYTES
+
+        return self._data[dst_start:dst_start + netid.NetID.GUID_SZ_BYTES]
+
+    @property
+    def src(self):
+        """Source Endpoint's GUID as int, None if unknown"""
+        if self.compact:
+            return self._guids[0]
+
+        return int.from_bytes(self.src_bytes, byteorder=sys.byteorder)
+
+    @property
+    def dst(self):
+        """Destination Endpoint's GUID as int, None if unknown"""
+        if self.compact:
+            return self._guids[1]
+
+        return int.from_bytes(self.dst_bytes, byteorder=sys.byteorder)
+
+    @staticmethod
+    def __pack_known_guid(guid):
+        """
+        :param guid: GUID as int or None
+        :returns: Serialized GUID, None if the GUID is None
+        """
+        if guid is None:
+            return None
+
+        return pack_guid(guid)
+
+
+def is_extended(byte_data):
+    '''
+    Checks whether bytes represent a packet with an extended length field
+
+    :param byte_data: Bytes to check
+    :returns: True if packet length follows the length prefix
+    '''
+    return len(byte_data) >= g_LEN_PREF_SZ_BYTES \
+        and byte_data[0] == byte_data[1] == g_EXT_LEN_MARKER
+
+
+def is_compact(byte_data):
+    '''
+    Checks whether bytes represent a packet with a compact header
+
+    :param byte_data: Bytes to check
+    :returns: True if packet leaves out the Endpoints' GUIDs
+    '''
+    return len(byte_data) >= g_LEN_PREF_SZ_BYTES \
+        and byte_data[0] == 0 and byte_data[1] == g_COMPACT_LEN_MARKER
+
+
+def header_size(byte_data):
+    '''
+    :param byte_data: Bytes representing NetPacket
+    :returns: Size of the packet's header in bytes
+    '''
+    if is_extended(byte_data):
+        return g_EXT_HEADER_SZ_BYTES
+
+    if is_compact(byte_data):
+        return g_COMPACT_HEADER_SZ_BYTES
+
+    return g_HEADER_SZ_BYTES
+
+
 def is_valid_pkt(byte_data):
     '''
     Validates whether or not bytes represent a netpacket
@@ -89,13 +284,14 @@ def is_valid_pkt(byte_data):
     :returns: True if valid, False otherwise
     '''
     valid = False
+    header_sz = header_size(byte_data)
 
-    if len(byte_data) < (g_HEADER_SZ_BYTES + msgprotocol.g_HEADER_SZ_BYTES):
-        # Pkt does not contains network header and message header
+    if len(byte_data) < (header_sz + msgprotocol.g_BINARY_HEADER_SZ_BYTES):
+        # Pkt does not contains network header and shortest message header
         valid = False
     else:
         # Check for valid message payload
-        msg_payload = byte_data[g_HEADER_SZ_BYTES:]
+        msg_payload = byte_data[header_sz:]
 
         valid = msgprotocol.is_valid_msg(msg_payload)
 
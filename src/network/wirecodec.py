@@ -0,0 +1,468 @@
+'''
+Module providing a codec for messages and the packets carrying them.
+
+Codec produces and accepts exactly the wire format defined by 'msgprotocol'
+and 'netprotocol', only faster: the byte encoding and timestamp format are
+bound once when the codec is created, headers are packed with precompiled
+structs straight into the packet's buffer and every frame waiting in a
+receive buffer has its header read in a single pass.
+'''
+import msg
+import msgprotocol
+import netid
+import netprotocol
+import struct
+import sys
+import timeutils
+
+# Kinds of payload carried by messages
+_g_NETID_PAYLOAD = 0
+_g_TEXT_PAYLOAD = 1
+_g_BINARY_PAYLOAD = 2
+
+
+class FrameRecord(object):
+    '''Structure representing a frame found in a buffer by 'decode_many' '''
+    __slots__ = ('frame', 'header_sz', 'msg_type')
+
+    def __init__(self, frame, header_sz, msg_type):
+        '''
+        :param frame: Memoryview of the whole frame
+        :param header_sz: Size of the frame's packet header in bytes
+        :param msg_type: MsgType of the frame's message, None if the frame
+                         does not carry a supported message
+        '''
+        self.frame = frame
+        self.header_sz = header_sz
+        self.msg_type = msg_type
+
+    def __repr__(self):
+        return '<%s len:%d type:%s>' \
+            % (self.__class__.__name__, len(self.frame), self.msg_type)
+
+
+class WireCodec(object):
+    '''
+    Serializes messages and packets for a byte encoding and decodes them
+    through views. Codecs hold no state besides their settings and may be
+    shared between threads. Messages with either timestamp format are
+    decoded.
+    '''
+    _MSG_HEADER = struct.Struct(msgprotocol.g_MSG_HEADER_FMT)
+    _BINARY_MSG_HEADER = struct.Struct(msgprotocol.g_BINARY_MSG_HEADER_FMT)
+    _PKT_HEADER = struct.Struct(netprotocol.g_MSG_HEADER_FMT)
+    _EXT_PKT_HEADER = struct.Struct(netprotocol.g_EXT_HEADER_FMT)
+    _COMPACT_PKT_HEADER = struct.Struct(netprotocol.g_COMPACT_HEADER_FMT)
+    # Length prefix of a packet and the length field following the prefix
+    # of extended and compact packets
+    _PKT_LEN_PREF = struct.Struct('!H')
+    _EXT_PKT_LEN = struct.Struct('!I')
+
+    def __init__(self, encoding, binary_timestamps=False):
+        '''
+        :param encoding: Byte encoding of text and names
+        :param binary_timestamps: True to serialize timestamps as epoch
+                                  nanoseconds, False as ISO strings
+        '''
+        self.encoding = encoding
+        self.binary_timestamps = binary_timestamps
+
+        if binary_timestamps:
+            self._msg_header = WireCodec._BINARY_MSG_HEADER
+        else:
+            self._msg_header = WireCodec._MSG_HEADER
+
+        # Supported message types by their raw values {int: MsgType}
+        self._msg_types = {}
+        # Kind of payload each supported message type carries
+        self._payload_kinds = {}
+
+        for msg_types, kind in ((msg.CONNECTION_MSG_TYPES,
+                                 _g_NETID_PAYLOAD),
+                                (msg.COMMUNICATION_MSG_TYPES,
+                                 _g_TEXT_PAYLOAD),
+                                (msg.BINARY_MSG_TYPES,
+                                 _g_BINARY_PAYLOAD)):
+            for msg_type in msg_types:
+                self._msg_types[msg_type.value] = msg_type
+                self._payload_kinds[msg_type] = kind
+
+    def __repr__(self):
+        return '<%s encoding:%s binary timestamps:%s>' \
+            % (self.__class__.__name__, self.encoding, self.binary_timestamps)
+
+    def encode_payload(self, msg_type, payload):
+        '''
+        :param msg_type: MsgType of the message
+        :param payload: Message's payload object
+        :returns: Encoded payload
+        :raises ValueError: If the MsgType is not supported
+        '''
+        kind = self.__payload_kind(msg_type)
+
+        if kind == _g_NETID_PAYLOAD:
+            return payload.guid.to_bytes(netid.NetID.GUID_SZ_BYTES,
+                                         byteorder=sys.byteorder) \
+                + payload.name.encode(self.encoding)
+
+        if kind == _g_TEXT_PAYLOAD and isinstance(payload, str):
+            return payload.encode(self.encoding)
+
+        # Bytes-like payload needs no encoding
+        return payload
+
+    def decode_payload(self, msg_type, raw_payload):
+        '''
+        :param msg_type: MsgType of the message
+        :param raw_payload: Bytes-like encoded payload
+        :returns: Payload decoded to the correct object, binary payloads are
+                  returned as they are
+        :raises ValueError: If the MsgType is not supported
+        '''
+        kind = self.__payload_kind(msg_type)
+
+        if kind == _g_NETID_PAYLOAD:
+            if len(raw_payload) < netid.NetID.GUID_SZ_BYTES:
+                raise ValueError('NetID too short')
+
+            guid = int.from_bytes(raw_payload[:netid.NetID.GUID_SZ_BYTES],
+                                  byteorder=sys.byteorder)
+            name = str(raw_payload[netid.NetID.GUID_SZ_BYTES:],
+                       self.encoding)
+
+            return netid.intern(guid, name)
+
+        if kind == _g_TEXT_PAYLOAD:
+            return str(raw_payload, self.encoding)
+
+        return raw_payload
+
+    def encode_packet(self, src_guid, dst_guid, message):
+        '''
+        Serializes a message and the packet carrying it into one buffer
+
+        :param src_guid: GUID of source Endpoint
+        :param dst_guid: GUID of destination Endpoint
+        :param message: Msg to send
+        :returns: Serialized NetPacket as a bytearray
+        '''
+        payload = self.encode_payload(message.msg_type, message.payload)
+        msg_sz = self._msg_header.size + len(payload)
+
+        buf, header_sz = self.__pack_pkt_header(src_guid, dst_guid, msg_sz)
+        self.__pack_msg(buf, header_sz, message, payload)
+
+        return buf
+
+    def compact_header(self, msg_sz):
+        '''
+        :param msg_sz: Size of a packet's message in bytes
+        :returns: Compact header of the packet, leaving out its GUIDs
+        '''
+        return WireCodec._COMPACT_PKT_HEADER.pack(
+            netprotocol.g_COMPACT_LEN_MARKER,
+            WireCodec._COMPACT_PKT_HEADER.size + msg_sz)
+
+    def view_packet(self, byte_data, src_guid=None, dst_guid=None):
+        '''
+        :param byte_data: Bytes-like object holding a serialized NetPacket
+        :param src_guid: GUID of the Endpoint which sent a compact packet,
+                         if known
+        :param dst_guid: GUID of the Endpoint a compact packet was sent to,
+                         if known
+        :returns: netprotocol.PacketView decoding with the codec
+        :raises ValueError: If the bytes do not represent a valid NetPacket
+        '''
+        return netprotocol.PacketView(byte_data, self, src_guid, dst_guid)
+
+    def view_frame(self, record, src_guid=None, dst_guid=None):
+        '''
+        :param record: FrameRecord found by 'decode_many'
+        :param src_guid: GUID of the Endpoint which sent a compact packet,
+                         if known
+        :param dst_guid: GUID of the Endpoint a compact packet was sent to,
+                         if known
+        :returns: netprotocol.PacketView of the frame decoding with the
+                  codec, reusing the header already read
+        :raises ValueError: If the frame is not a valid NetPacket
+        '''
+        return netprotocol.PacketView(record.frame, self, src_guid, dst_guid,
+                                      record.header_sz)
+
+    def view_msg(self, byte_data):
+        '''
+        :param byte_data: Bytes-like object holding a serialized message
+        :returns: msgprotocol.MsgView decoding with the codec
+        :raises ValueError: If the bytes do not represent a valid message
+        '''
+        return msgprotocol.MsgView(byte_data, self)
+
+    def decode_many(self, buffer, max_frame_sz=None):
+        '''
+        Finds every complete frame in a buffer and reads their headers in a
+        single pass. Scanning stops after a frame which is followed by raw
+        data instead of further frames.
+
+        :param buffer: Bytes-like object starting at a frame boundary
+        :param max_frame_sz: Longest frame accepted in bytes, None for no
+                             limit
+        :returns: Tuple of (list of FrameRecords in stream order, bytes
+                  taken up by the frames). Frames are views of the buffer.
+        :raises ValueError: If the first frame's length is invalid. An
+                            invalid length following complete frames ends
+                            the scan and is raised by the next call.
+        '''
+        view = memoryview(buffer)
+        buf_len = len(view)
+        records = []
+        offset = 0
+
+        # Bound once for the whole scan
+        unpack_len_pref = WireCodec._PKT_LEN_PREF.unpack_from
+        unpack_ext_len = WireCodec._EXT_PKT_LEN.unpack_from
+        msg_types = self._msg_types
+        len_pref_sz = netprotocol.g_LEN_PREF_SZ_BYTES
+        ext_len_end = len_pref_sz + netprotocol.g_EXT_LEN_SZ_BYTES
+        type_field_offset = msgprotocol.g_LEN_PREF_SZ_BYTES
+        type_mask = ~msgprotocol.g_BINARY_TIMESTAMP_FLAG
+
+        while buf_len - offset >= len_pref_sz:
+            frame_len, = unpack_len_pref(view, offset)
+
+            if frame_len == netprotocol.g_EXT_LEN_MARKER:
+                header_sz = netprotocol.g_EXT_HEADER_SZ_BYTES
+            elif frame_len == netprotocol.g_COMPACT_LEN_MARKER:
+                header_sz = netprotocol.g_COMPACT_HEADER_SZ_BYTES
+            else:
+                header_sz = netprotocol.g_HEADER_SZ_BYTES
+
+            if header_sz != netprotocol.g_HEADER_SZ_BYTES:
+                # Real length follows the prefix
+                if buf_len - offset < ext_len_end:
+                    break
+
+                frame_len, = unpack_ext_len(view, offset + len_pref_sz)
+
+            if frame_len < header_sz \
+                    or (max_frame_sz is not None and frame_len > max_frame_sz):
+                if records:
+                    break
+
+                raise ValueError(f'Invalid frame length {frame_len}')
+
+            frame_end = offset + frame_len
+
+            if frame_end > buf_len:
+                # Remainder of the frame has not arrived yet
+                break
+
+            type_offset = offset + header_sz + type_field_offset
+            msg_type = None
+
+            if type_offset < frame_end:
+                msg_type = msg_types.get(view[type_offset] & type_mask)
+
+            records.append(FrameRecord(view[offset:frame_end],
+                                       header_sz,
+                                       msg_type))
+            offset = frame_end
+
+            if msg_type in msg.RAW_DATA_MSG_TYPES:
+                break
+
+        return records, offset
+
+    def msg_type(self, raw_msg_type):
+        '''
+        :param raw_msg_type: Message type field as int, without the binary
+                             timestamp flag
+        :returns: Supported MsgType
+        :raises ValueError: If the message type is not supported
+        '''
+        try:
+            return self._msg_types[raw_msg_type]
+        except KeyError:
+            raise ValueError(f'{raw_msg_type} is not a supported MsgType')
+
+    def __payload_kind(self, msg_type):
+        '''
+        :param msg_type: MsgType of a message
+        :returns: Kind of payload the message carries
+        :raises ValueError: If the MsgType is not supported
+        '''
+        try:
+            return self._payload_kinds[msg_type]
+        except KeyError:
+            raise ValueError(f'{str(msg_type)} is not a supported MsgType')
+
+    def __pack_msg(self, buf, offset, message, payload):
+        '''
+        Packs a message into a buffer sized to end with it
+
+        :param buf: Bytearray to pack into
+        :param offset: Offset of the message within the buffer
+        :param message: Msg being serialized
+        :param payload: Message's encoded payload
+        '''
+        msg_sz = len(buf) - offset
+
+        if msg_sz > msgprotocol.g_MAX_SHORT_MSG_SZ_BYTES:
+            msg_sz = msgprotocol.g_UNKNOWN_LEN
+
+        if self.binary_timestamps:
+            WireCodec._BINARY_MSG_HEADER.pack_into(
+                buf, offset,
+                msg_sz,
+                message.msg_type.value | msgprotocol.g_BINARY_TIMESTAMP_FLAG,
+                timeutils.to_ns(message.timestamp))
+        else:
+            WireCodec._MSG_HEADER.pack_into(
+                buf, offset,
+                msg_sz,
+                message.msg_type.value,
+                timeutils.to_iso(message.timestamp).encode(self.encoding))
+
+        buf[offset + self._msg_header.size:] = payload
+
+    def __pack_pkt_header(self, src_guid, dst_guid, msg_sz):
+        '''
+        Allocates a packet's buffer and packs its header
+
+        :param src_guid: GUID of source Endpoint
+        :param dst_guid: GUID of destination Endpoint
+        :param msg_sz: Size of the packet's message in bytes
+        :returns: Tuple of (bytearray of the packet, header size)
+        '''
+        src_bytes = src_guid.to_bytes(netid.NetID.GUID_SZ_BYTES,
+                                      byteorder=sys.byteorder)
+        dst_bytes = dst_guid.to_bytes(netid.NetID.GUID_SZ_BYTES,
+                                      byteorder=sys.byteorder)
+        pkt_sz = WireCodec._PKT_HEADER.size + msg_sz
+
+        if pkt_sz <= netprotocol.g_MAX_SHORT_PKT_SZ_BYTES:
+            buf = bytearray(pkt_sz)
+            WireCodec._PKT_HEADER.pack_into(buf, 0,
+                                            pkt_sz,
+                                            src_bytes,
+                                            dst_bytes)
+
+            return buf, WireCodec._PKT_HEADER.size
+
+        # Length does not fit in the prefix, use an extended length field
+        pkt_sz = WireCodec._EXT_PKT_HEADER.size + msg_sz
+        buf = bytearray(pkt_sz)
+        WireCodec._EXT_PKT_HEADER.pack_into(buf, 0,
+                                            netprotocol.g_EXT_LEN_MARKER,
+                                            pkt_sz,
+                                            src_bytes,
+                                            dst_bytes)
+
+        return buf, WireCodec._EXT_PKT_HEADER.size
+
+
+# Unit Testing
+def test():
+    import netpacket
+
+    src_guid = 0x0123456789abcdef0123456789abcdef
+    dst_guid = 0xfedcba9876543210fedcba9876543210
+    timestamp = '2020-01-01T12:30:45'
+    codec = WireCodec('utf-8')
+    binary_codec = WireCodec('utf-8', binary_timestamps=True)
+
+    # NetID is interned, so the one decoded is the same object
+    messages = [
+        msg.Msg(msg.MsgType.ENDPOINT_CONNECTION_START,
+                netid.intern(src_guid, 'endpoint ñame'), timestamp),
+        msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, 'hello', timestamp),
+        msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION, '', timestamp),
+        msg.Msg(msg.MsgType.ENDPOINT_PING, b'\x00\xff', timestamp),
+        msg.Msg(msg.MsgType.ENDPOINT_TEXT_COMMUNICATION,
+                'x' * (2 ** 17), timestamp)]
+
+    for message in messages:
+        # Codec produces exactly the wire format of the protocol modules
+        encoded_pkt = codec.encode_packet(src_guid, dst_guid, message)
+        expected = netprotocol.serialize(netpacket.NetPacket(
+            src_guid, dst_guid, msgprotocol.serialize(message)))
+
+        if encoded_pkt != expected:
+            raise ValueError('Codec differs from protocol during testing')
+
+        for test_codec, expected_timestamp in (
+                (codec, timestamp),
+                (binary_codec, timeutils.to_ns(timestamp))):
+            encoded_pkt = test_codec.encode_packet(src_guid, dst_guid,
+                                                   message)
+            view = codec.view_packet(encoded_pkt)
+
+            if (view.src, view.dst) != (src_guid, dst_guid) \
+                    or view.msg.msg_type != message.msg_type \
+                    or view.msg.timestamp != expected_timestamp \
+                    or view.msg.payload != message.payload:
+                raise ValueError('Packet changed in round trip during '
+                                 'testing')
+
+            # Compact packets carry the same message without GUIDs
+            encoded_msg = memoryview(encoded_pkt)[
+                netprotocol.header_size(encoded_pkt):]
+            compact_pkt = codec.compact_header(len(encoded_msg)) \
+                + encoded_msg
+            view = codec.view_packet(compact_pkt, src_guid, dst_guid)
+
+            if not view.compact or (view.src, view.dst) \
+                    != (src_guid, dst_guid) \
+                    or view.msg.payload != message.payload:
+                raise ValueError('Compact packet changed in round trip '
+                                 'during testing')
+
+    # Frames are found in one pass, a partial frame is left for later and
+    # raw file data ends the scan
+    encoded_pkts = [codec.encode_packet(src_guid, dst_guid, message)
+                    for message in messages]
+    stream = b''.join(encoded_pkts)
+    records, num_bytes = codec.decode_many(stream + encoded_pkts[0][:5])
+
+    if [bytes(record.frame) for record in records] != encoded_pkts \
+            or num_bytes != len(stream) \
+            or [record.msg_type for record in records] \
+            != [message.msg_type for message in messages]:
+        raise ValueError('Frames not found during testing')
+
+    data_msg = msg.Msg(msg.MsgType.ENDPOINT_FILE_DATA, bytes(16))
+    data_pkt = codec.encode_packet(src_guid, dst_guid, data_msg)
+    records, num_bytes = codec.decode_many(data_pkt + b'raw data'
+                                           + encoded_pkts[1])
+
+    if len(records) != 1 or num_bytes != len(data_pkt):
+        raise ValueError('Raw data scanned as frames during testing')
+
+    view = codec.view_frame(records[0])
+
+    if view.msg.msg_type != data_msg.msg_type \
+            or view.msg.payload != data_msg.payload:
+        raise ValueError('Unable to view frame during testing')
+
+    # Invalid lengths are only raised once no complete frame precedes them
+    for bad_stream, max_frame_sz in ((b'\x00\x05', None),
+                                     (encoded_pkts[-1], 1024)):
+        records, _ = codec.decode_many(encoded_pkts[1] + bad_stream,
+                                       max_frame_sz)
+
+        if len(records) != 1:
+            raise ValueError('Frame before invalid length lost during '
+                             'testing')
+
+        try:
+            codec.decode_many(bad_stream, max_frame_sz)
+        except ValueError:
+            continue
+
+        raise ValueError('Invalid frame length accepted during testing')
+
+    try:
+        codec.msg_type(255)
+    except ValueError:
+        return
+
+    raise ValueError('Unsupported MsgType accepted during testing')
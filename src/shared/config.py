@@ -17,6 +17,22 @@ class ConfigEnum(enum.Enum):
     ENDPOINT_NAME = enum.auto()
     BROADCAST_PORT = enum.auto()
     NEW_USER = enum.auto()
+    MAX_PENDING_CONNECTIONS = enum.auto()
+    CONNECTION_TIMEOUT = enum.auto()
+    CONNECTION_RETRIES = enum.auto()
+    OUTBOUND_QUEUE_MAX_MSGS = enum.auto()
+    OUTBOUND_QUEUE_MAX_BYTES = enum.auto()
+    OUTBOUND_QUEUE_POLICY = enum.auto()
+    HEARTBEAT_INTERVAL = enum.auto()
+    HEARTBEAT_TIMEOUT = enum.auto()
+    HANDSHAKE_TIMEOUT = enum.auto()
+    MAX_OPEN_CONNECTIONS = enum.auto()
+    IDLE_TIMEOUT = enum.auto()
+    DOWNLOAD_DIR = enum.auto()
+    MAX_INCOMING_FILE_SIZE = enum.auto()
+    FILE_STREAMS = enum.auto()
+    COMPRESSION = enum.auto()
+    COMPRESSION_DICT = enum.auto()
 
 
 # Dictionary for conversion between enum and JSON field name
@@ -26,7 +42,23 @@ KEY_MAP = {
     ConfigEnum.ENDPOINT_GUID: 'endpoint_guid',
     ConfigEnum.ENDPOINT_NAME: 'endpoint_name',
     ConfigEnum.BROADCAST_PORT: 'udp_broadcast_port',
-    ConfigEnum.NEW_USER: 'new_user'
+    ConfigEnum.NEW_USER: 'new_user',
+    ConfigEnum.MAX_PENDING_CONNECTIONS: 'max_pending_connections',
+    ConfigEnum.CONNECTION_TIMEOUT: 'connection_timeout_sec',
+    ConfigEnum.CONNECTION_RETRIES: 'connection_retries',
+    ConfigEnum.OUTBOUND_QUEUE_MAX_MSGS: 'outbound_queue_max_msgs',
+    ConfigEnum.OUTBOUND_QUEUE_MAX_BYTES: 'outbound_queue_max_bytes',
+    ConfigEnum.OUTBOUND_QUEUE_POLICY: 'outbound_queue_policy',
+    ConfigEnum.HEARTBEAT_INTERVAL: 'heartbeat_interval_sec',
+    ConfigEnum.HEARTBEAT_TIMEOUT: 'heartbeat_timeout_sec',
+    ConfigEnum.HANDSHAKE_TIMEOUT: 'handshake_timeout_sec',
+    ConfigEnum.MAX_OPEN_CONNECTIONS: 'max_open_connections',
+    ConfigEnum.IDLE_TIMEOUT: 'idle_timeout_sec',
+    ConfigEnum.DOWNLOAD_DIR: 'download_directory',
+    ConfigEnum.MAX_INCOMING_FILE_SIZE: 'max_incoming_file_bytes',
+    ConfigEnum.FILE_STREAMS: 'file_transfer_streams',
+    ConfigEnum.COMPRESSION: 'compression_enabled',
+    ConfigEnum.COMPRESSION_DICT: 'compression_dictionary'
 }
 
 
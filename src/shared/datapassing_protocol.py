@@ -11,6 +11,10 @@ class DPMsgType(enum.Enum):
     DPMSG_TYPE_DISCONNECT = enum.auto()
     DPMSG_TYPE_TEXT_MSG = enum.auto()
     DPMSG_TYPE_BACKEND_ERR = enum.auto()
+    DPMSG_TYPE_BACKPRESSURE = enum.auto()
+    DPMSG_TYPE_FILE = enum.auto()
+    DPMSG_TYPE_FILE_PROGRESS = enum.auto()
+    DPMSG_TYPE_FILE_OFFER = enum.auto()
 
 
 @enum.unique
@@ -22,6 +26,8 @@ class DPMsgDst(enum.Enum):
 
 class DPMsg(object):
     '''Base data passing message class'''
+    __slots__ = ('msg_type', 'destination')
+
     def __init__(self, mtype, mdst):
         '''
         :param mtype: Type of message
@@ -33,11 +39,14 @@ class DPMsg(object):
 
 class DPTextMsg(DPMsg):
     '''Data passing message containing text to send or receive'''
+    __slots__ = ('destination_id', 'timestamp', 'data')
+
     def __init__(self, mdst, dst_id, timestamp, data):
         '''
         :param mdst: Layer that message should be passed to
         :param dst_id: Endpoint's unique ID to send this message to
-        :param timestamp: ISO timestamp for this message
+        :param timestamp: ISO timestamp string or epoch nanoseconds for
+                          this message
         '''
         super().__init__(DPMsgType.DPMSG_TYPE_TEXT_MSG, mdst)
         self.destination_id = dst_id
@@ -45,8 +54,50 @@ class DPTextMsg(DPMsg):
         self.data = data
 
 
+class DPFileMsg(DPMsg):
+    '''Data passing message naming a file to send or one received'''
+    __slots__ = ('destination_id', 'timestamp', 'path')
+
+    def __init__(self, mdst, dst_id, timestamp, path):
+        '''
+        :param mdst: Layer that message should be passed to
+        :param dst_id: Endpoint's unique ID to send the file to, or which
+                       sent it
+        :param timestamp: ISO timestamp string or epoch nanoseconds for
+                          this message
+        :param path: Path of the file to send or where it was saved
+        '''
+        super().__init__(DPMsgType.DPMSG_TYPE_FILE, mdst)
+        self.destination_id = dst_id
+        self.timestamp = timestamp
+        self.path = path
+
+
+class DPFileOfferMsg(DPMsg):
+    '''Data passing message asking whether to accept an offered file'''
+    __slots__ = ('endpoint_id', 'file_id', 'name', 'size', 'accepted')
+
+    def __init__(self, mdst, ep_id, file_id, name, size, accepted=False):
+        '''
+        :param mdst: Layer that message should be passed to
+        :param ep_id: Unique ID of Endpoint offering the file
+        :param file_id: Endpoint's ID for the file's content
+        :param name: Name of the file
+        :param size: Size of the file in bytes
+        :param accepted: True if the user accepted the file
+        '''
+        super().__init__(DPMsgType.DPMSG_TYPE_FILE_OFFER, mdst)
+        self.endpoint_id = ep_id
+        self.file_id = file_id
+        self.name = name
+        self.size = size
+        self.accepted = accepted
+
+
 class DPConnectionMsg(DPMsg):
     '''Data passing message indicating a new Endpoint connected'''
+    __slots__ = ('endpoint_id', 'endpoint_name')
+
     def __init__(self, ep_id, ep_name):
         '''
         :param ep_id: Unique ID of Endpoint that connected
@@ -59,6 +110,8 @@ class DPConnectionMsg(DPMsg):
 
 class DPDisconnectMsg(DPMsg):
     '''Data passing message indicating an Endpoint disconnected'''
+    __slots__ = ('endpoint_id',)
+
     def __init__(self, ep_id):
         '''
         :param ep_id: Unique ID of Endpoint that disconnected
@@ -70,6 +123,8 @@ class DPDisconnectMsg(DPMsg):
 
 class DPBackendErrMsg(DPMsg):
     '''Data passing message indicating backend encountered error'''
+    __slots__ = ('msg',)
+
     def __init__(self, err_msg):
         '''
         :param err_msg: String message associated with error
@@ -77,3 +132,40 @@ class DPBackendErrMsg(DPMsg):
         super().__init__(DPMsgType.DPMSG_TYPE_BACKEND_ERR,
                          DPMsgDst.DPMSG_DST_UI)
         self.msg = err_msg
+
+
+class DPBackpressureMsg(DPMsg):
+    '''Data passing message indicating an Endpoint is slow to receive'''
+    __slots__ = ('endpoint_id', 'congested')
+
+    def __init__(self, ep_id, congested):
+        '''
+        :param ep_id: Unique ID of Endpoint messages are queued for
+        :param congested: True if Endpoint is not keeping up with messages
+                          sent to it, False once it has caught up
+        '''
+        super().__init__(DPMsgType.DPMSG_TYPE_BACKPRESSURE,
+                         DPMsgDst.DPMSG_DST_UI)
+        self.endpoint_id = ep_id
+        self.congested = congested
+
+
+class DPFileProgressMsg(DPMsg):
+    '''Data passing message reporting progress of a file transfer'''
+    __slots__ = ('endpoint_id', 'name', 'progress', 'size', 'throughput')
+
+    def __init__(self, ep_id, name, progress, size, throughput):
+        '''
+        :param ep_id: Unique ID of Endpoint the file is transferred with
+        :param name: Name of the file
+        :param progress: Bytes of the file transferred so far
+        :param size: Size of the file in bytes
+        :param throughput: Bytes transferred per second since last report
+        '''
+        super().__init__(DPMsgType.DPMSG_TYPE_FILE_PROGRESS,
+                         DPMsgDst.DPMSG_DST_UI)
+        self.endpoint_id = ep_id
+        self.name = name
+        self.progress = progress
+        self.size = size
+        self.throughput = throughput
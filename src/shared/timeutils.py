@@ -2,9 +2,17 @@
 Module providing methods for getting and formatting datetimes
 '''
 import datetime as dt
+import time
 
 ERROR_DATETIME = 'xx-xx-xxxx xx:xx'
 
+_g_NS_PER_SEC = 10 ** 9
+
+# Second last converted to ISO format and its ISO timestamp. Timestamps of
+# messages arriving together mostly share a second, so they are only
+# formatted once.
+_g_last_iso = (None, None)
+
 
 def convert_military_time(time):
     '''
@@ -25,17 +33,85 @@ def get_iso_timestamp():
     return dt.datetime.now().isoformat(timespec='seconds')
 
 
-def format_timestamp(iso_timestamp, military=True):
+def get_ns_timestamp():
+    '''
+    Get the current time in nanoseconds since the epoch. Unlike ISO
+    timestamps these order messages sent within the same second.
+
+    :return: Current time as epoch nanoseconds
+    '''
+    return time.time_ns()
+
+
+def ns_to_iso(ns_timestamp):
+    '''
+    Converts a nanosecond timestamp to ISO format
+
+    :param ns_timestamp: Time as epoch nanoseconds
+    :return: Local time in ISO format (precision = seconds)
+    '''
+    global _g_last_iso
+
+    sec = ns_timestamp // _g_NS_PER_SEC
+    last_sec, iso_timestamp = _g_last_iso
+
+    if sec != last_sec:
+        iso_timestamp \
+            = dt.datetime.fromtimestamp(sec).isoformat(timespec='seconds')
+        _g_last_iso = (sec, iso_timestamp)
+
+    return iso_timestamp
+
+
+def iso_to_ns(iso_timestamp):
+    '''
+    Converts an ISO timestamp to nanoseconds
+
+    :param iso_timestamp: Local time in ISO format
+    :return: Time as epoch nanoseconds
+    :raises ValueError: If the timestamp is not in ISO format
+    '''
+    sec = dt.datetime.fromisoformat(iso_timestamp).timestamp()
+
+    return int(sec) * _g_NS_PER_SEC
+
+
+def to_iso(timestamp):
+    '''
+    :param timestamp: ISO timestamp as string or epoch nanoseconds
+    :return: Timestamp in ISO format
+    '''
+    if isinstance(timestamp, int):
+        return ns_to_iso(timestamp)
+
+    return timestamp
+
+
+def to_ns(timestamp):
+    '''
+    :param timestamp: ISO timestamp as string or epoch nanoseconds
+    :return: Timestamp as epoch nanoseconds
+    :raises ValueError: If a string timestamp is not in ISO format
+    '''
+    if isinstance(timestamp, int):
+        return timestamp
+
+    return iso_to_ns(timestamp)
+
+
+def format_timestamp(timestamp, military=True):
     '''
-    Formats ISO timestamp into string for displaying
+    Formats timestamp into string for displaying
 
-    :param timestamp: ISO timestamp as string
+    :param timestamp: ISO timestamp as string or epoch nanoseconds
     :param military: True for 24-hour time, false for 12-hour time
     :return: Properly formatted timestamp as string
     '''
     formatted_timestamp = ERROR_DATETIME
 
     try:
+        iso_timestamp = to_iso(timestamp)
+
         # Separate ISO date and time
         sep_index = iso_timestamp.index('T')
         date = iso_timestamp[:sep_index]
@@ -47,8 +123,8 @@ def format_timestamp(iso_timestamp, military=True):
 
         formatted_timestamp = date + ' ' + time
 
-    except ValueError:
-        # Something wrong with ISO date/time format
+    except (ValueError, OverflowError, OSError):
+        # Something wrong with ISO date/time format or time out of range
         pass
 
     return formatted_timestamp
@@ -152,6 +152,29 @@ class EndpointUI(ttk.Frame):
                                                    qdata.timestamp,
                                                    qdata.data)
 
+            elif qdata.msg_type == dproto.DPMsgType.DPMSG_TYPE_FILE:
+                # Report file to the Sidebar and ConversationFrame
+                self.side_panel.report_message(qdata.destination_id)
+                self.convo_mgr.report_file_message(qdata.destination_id,
+                                                   qdata.timestamp,
+                                                   qdata.path)
+
+            elif qdata.msg_type \
+                    == dproto.DPMsgType.DPMSG_TYPE_FILE_PROGRESS:
+                # Let ConversationFrame show how far the transfer has come
+                self.convo_mgr.report_file_progress(qdata.endpoint_id,
+                                                    qdata.name,
+                                                    qdata.progress,
+                                                    qdata.size,
+                                                    qdata.throughput)
+
+            elif qdata.msg_type == dproto.DPMsgType.DPMSG_TYPE_FILE_OFFER:
+                # Let ConversationFrame ask whether to accept the file
+                self.convo_mgr.report_file_offer(qdata.endpoint_id,
+                                                 qdata.file_id,
+                                                 qdata.name,
+                                                 qdata.size)
+
             elif qdata.msg_type == dproto.DPMsgType.DPMSG_TYPE_CONNECTION:
                 # Report connection to Sidebar and ConversationFrame
                 self.side_panel.report_connection(qdata.endpoint_id,
@@ -161,7 +184,12 @@ class EndpointUI(ttk.Frame):
                 # Report disconnection to Sidebar and ConversationFrame
                 self.side_panel.remove_connection(qdata.endpoint_id)
 
-            elif qdata.msg_type == dproto.DPMSG_TYPE_BACKEND_ERR:
+            elif qdata.msg_type == dproto.DPMsgType.DPMSG_TYPE_BACKPRESSURE:
+                # Let ConversationFrame throttle sending to slow Endpoint
+                self.convo_mgr.report_congestion(qdata.endpoint_id,
+                                                 qdata.congested)
+
+            elif qdata.msg_type == dproto.DPMsgType.DPMSG_TYPE_BACKEND_ERR:
                 # Display error reported by backend
                 if not qdata.msg:
                     err_msg = 'No error description given'
@@ -9,7 +9,9 @@ import datapassing_protocol as dproto
 import datapassing
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
 from tkinter import messagebox
+import os
 import logging
 
 _g_logger = logging.getLogger(__name__)
@@ -44,6 +46,12 @@ class ConversationFrame(ttk.Frame):
         #       relevant to the messages/conversation is tracked elsewhere
         self.conversations = {}
 
+        # IDs of conversations whose Endpoint is not keeping up with sends
+        self.congested_conversations = set()
+
+        # Progress of file transfers w/ mapping -> {ident: {name: text}}
+        self.file_transfers = {}
+
         hint_text = 'Select connection to view/send messages'
         self.no_conversation_label = ttk.Label(self,
                                                text=hint_text,
@@ -53,6 +61,7 @@ class ConversationFrame(ttk.Frame):
         self.bottom_frame = ttk.Frame(self, style='EntryArea.TFrame')
         self.bottom_frame.columnconfigure(0, weight=1)
         self.bottom_frame.columnconfigure(1, weight=0)
+        self.bottom_frame.columnconfigure(2, weight=0)
         self.bottom_frame.rowconfigure(0, weight=0)
         self.bottom_frame.grid(column=0, row=1, sticky=tk.EW)
 
@@ -76,6 +85,23 @@ class ConversationFrame(ttk.Frame):
                            pady=ConversationFrame._SEND_BTN_Y_PAD,
                            sticky=tk.W)
 
+        # File button for picking a file to send
+        self.file_btn = ttk.Button(self.bottom_frame, text='File...',
+                                   command=self.__send_file)
+
+        self.file_btn.grid(column=2, row=0,
+                           padx=ConversationFrame._SEND_BTN_X_PAD,
+                           pady=ConversationFrame._SEND_BTN_Y_PAD,
+                           sticky=tk.W)
+
+        # Notice shown while the active conversation's Endpoint is slow
+        self.congestion_label = ttk.Label(self.bottom_frame,
+                                          style='MsgTimestamp.TLabel')
+
+        # Progress of the active conversation's file transfers
+        self.file_progress_label = ttk.Label(self.bottom_frame,
+                                             style='MsgTimestamp.TLabel')
+
         # Implement load previous conversations?
         if len(self.conversations) == 0:
             self.__set_conversation_area_inactive()
@@ -121,10 +147,15 @@ class ConversationFrame(ttk.Frame):
         conversation.set_active()
         self.active_conversation_id = ident
 
+        self.__update_congestion_notice()
+        self.__update_file_progress_notice()
+
     def remove_conversation(self, ident):
         '''
         :param ident: ID of conversations to delete
         '''
+        self.congested_conversations.discard(ident)
+        self.file_transfers.pop(ident, None)
         self.conversations[ident].set_inactive()
 
         # Remove MessageFrame from UI if it is active
@@ -150,7 +181,7 @@ class ConversationFrame(ttk.Frame):
         Function for passing received message up through UI
 
         :param ident: GUID of the message sender
-        :param timestamp: ISO formatted timestamp
+        :param timestamp: ISO timestamp string or epoch nanoseconds
         :param text: Message data
         '''
         try:
@@ -160,6 +191,109 @@ class ConversationFrame(ttk.Frame):
             err_msg = 'Message reported for conversation that does not exist'
             _g_logger.error(err_msg)
 
+    def report_file_message(self, ident, timestamp, path):
+        '''
+        Function for passing received file up through UI
+
+        :param ident: GUID of the file sender
+        :param timestamp: ISO timestamp string or epoch nanoseconds
+        :param path: Path the file was saved to
+        '''
+        self.report_text_message(ident, timestamp, f'Sent a file: {path}')
+
+    def report_congestion(self, ident, congested):
+        '''
+        Function for throttling sending to an Endpoint which is slow to
+        receive messages
+
+        :param ident: GUID of the Endpoint
+        :param congested: True if Endpoint is slow, False once caught up
+        '''
+        if congested:
+            self.congested_conversations.add(ident)
+        else:
+            self.congested_conversations.discard(ident)
+
+        if ident == self.active_conversation_id:
+            self.__update_congestion_notice()
+
+    def report_file_progress(self, ident, name, progress, size, throughput):
+        '''
+        Function for showing how far a file transfer has come
+
+        :param ident: GUID of the Endpoint the file is transferred with
+        :param name: Name of the file
+        :param progress: Bytes of the file transferred so far
+        :param size: Size of the file in bytes
+        :param throughput: Bytes transferred per second recently
+        '''
+        transfers = self.file_transfers.setdefault(ident, {})
+
+        if progress >= size:
+            # Transfer finished
+            transfers.pop(name, None)
+        else:
+            transfers[name] = f'{name}: {100 * progress // size}% ' \
+                              f'({throughput / 1e6:.1f} MB/s)'
+
+        if ident == self.active_conversation_id:
+            self.__update_file_progress_notice()
+
+    def report_file_offer(self, ident, file_id, name, size):
+        '''
+        Function for asking the user whether to accept a file an Endpoint
+        offered, passing the answer to the backend
+
+        :param ident: GUID of the Endpoint offering the file
+        :param file_id: Endpoint's ID for the file's content
+        :param name: Name of the file
+        :param size: Size of the file in bytes
+        '''
+        try:
+            sender = self.conversations[ident].correspondent_name
+        except KeyError:
+            sender = 'An Endpoint'
+
+        accepted = messagebox.askyesno(
+            'File Offered',
+            f'{sender} wants to send you \'{name}\' '
+            f'({size / 1e6:.1f} MB). Accept it?',
+            parent=self)
+
+        dp_msg = dproto.DPFileOfferMsg(dproto.DPMsgDst.DPMSG_DST_BACKEND,
+                                       ident, file_id, name, size, accepted)
+        datapassing.pass_msg(dp_msg)
+
+    def __update_file_progress_notice(self):
+        '''Shows the active conversation's running file transfers'''
+        transfers = self.file_transfers.get(self.active_conversation_id)
+
+        if transfers:
+            self.file_progress_label.configure(
+                text='\n'.join(transfers.values()))
+            self.file_progress_label.grid(column=0, row=2, columnspan=3,
+                                          padx=ConversationFrame._ENTRY_X_PAD,
+                                          sticky=tk.W)
+        else:
+            self.file_progress_label.grid_forget()
+
+    def __update_congestion_notice(self):
+        '''Pauses sending while the active conversation is congested'''
+        if self.active_conversation_id in self.congested_conversations:
+            name = self.conversations[self.active_conversation_id] \
+                .correspondent_name
+
+            self.congestion_label.configure(
+                text=f'{name} is slow to respond, sending paused')
+            self.congestion_label.grid(column=0, row=1, columnspan=3,
+                                       padx=ConversationFrame._ENTRY_X_PAD,
+                                       sticky=tk.W)
+            self.send_btn.state(['disabled'])
+
+        else:
+            self.congestion_label.grid_forget()
+            self.send_btn.state(['!disabled'])
+
     def __set_conversation_area_inactive(self):
         self.bottom_frame.grid_remove()
         self.no_conversation_label.grid(column=0, row=0)
@@ -185,8 +319,13 @@ class ConversationFrame(ttk.Frame):
             messagebox.showerror('Error', message_str)
             return
 
+        if self.active_conversation_id in self.congested_conversations:
+            # Hold message in the entry until the Endpoint catches up
+            _g_logger.info('Sending paused for congested conversation')
+            return
+
         # Construct message to send
-        ts = timeutils.get_iso_timestamp()
+        ts = timeutils.get_ns_timestamp()
 
         dp_msg = dproto.DPTextMsg(dproto.DPMsgDst.DPMSG_DST_BACKEND,
                                   self.active_conversation_id,
@@ -211,3 +350,34 @@ class ConversationFrame(ttk.Frame):
 
         # Keep focus in the message entry
         self.entry_area.focus()
+
+    def __send_file(self):
+        '''Callback that sends a file in the active conversation'''
+        if not self.active_conversation_id:
+            # No conversation is active
+            message_str = 'Must select conversation to send file'
+            _g_logger.error(message_str)
+            messagebox.showerror('Error', message_str)
+            return
+
+        path = filedialog.askopenfilename(parent=self, title='Send File')
+
+        if not path:
+            # Selection cancelled
+            return
+
+        # Construct message to send
+        ts = timeutils.get_ns_timestamp()
+
+        dp_msg = dproto.DPFileMsg(dproto.DPMsgDst.DPMSG_DST_BACKEND,
+                                  self.active_conversation_id,
+                                  ts,
+                                  path)
+
+        # Pass file to the backend and display
+        datapassing.pass_msg(dp_msg)
+
+        host_id = c.Config.get(c.ConfigEnum.ENDPOINT_GUID)
+        active_frame = self.conversations[self.active_conversation_id]
+        active_frame.add_text_message(host_id, ts,
+                                      f'Sent a file: {os.path.basename(path)}')
@@ -38,7 +38,7 @@ class MessageFrame(ScrollableFrame):
         Function for displaying text message
 
         :param ident: GUID of the message sender
-        :param timestamp: ISO formatted timestamp
+        :param timestamp: ISO timestamp string or epoch nanoseconds
         :param text: Message data
         '''
         if not text:
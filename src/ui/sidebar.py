@@ -39,6 +39,9 @@ class SideBar(ttk.Frame):
 
         self.listbox.bind('<<ListboxSelect>>', self.__on_connection_select)
 
+        # Index of connection widgets in listbox {ident: ConnectionWidget}
+        self.connection_widgets = {}
+
     def report_connection(self, ident, conn_name):
         '''
         Append connection to end of list
@@ -47,14 +50,7 @@ class SideBar(ttk.Frame):
         :param conn: Friendly name to append
         '''
         # Check if connection already exists
-        connection_exists = False
-
-        for widget in self.listbox.get(0, tk.END):
-            if widget.guid == ident:
-                connection_exists = True
-                break
-
-        if connection_exists:
+        if ident in self.connection_widgets:
             # Do not duplicate connection
             _g_logger.debug('Reported connection already exists')
             return
@@ -68,6 +64,7 @@ class SideBar(ttk.Frame):
                                      conn_name)
         widget.grid(padx=(0, 0), pady=(0, 0), sticky=tk.EW)
 
+        self.connection_widgets[ident] = widget
         self.listbox.insert(tk.END, widget)
         self.update_idletasks()
 
@@ -78,24 +75,16 @@ class SideBar(ttk.Frame):
         :param ident: ID of connection to remove
         '''
         # Get the widget associated with the ID
-        index = -1
-        counter = 0
+        widget = self.connection_widgets.pop(ident, None)
 
-        for widget in self.listbox.get(0, tk.END):
-            if widget.guid == ident:
-                index = counter
-                break
-
-            counter += 1
-
-        if index == -1:
+        if widget is None:
             # ID not found
             err_msg = 'Tried to delete connection that does not exist'
             _g_logger.error(err_msg)
             return
 
         # Remove connection from sidebar
-        self.listbox.delete(index)
+        self.listbox.delete(self.listbox.widgets.index(widget))
 
         # Remove conversation from ConversationFrame
         self.remove_callback(ident)
@@ -103,11 +92,11 @@ class SideBar(ttk.Frame):
     def report_message(self, ident):
         '''Notifies connection widget that a message was recieved'''
         # Get the widget associated with the ID
-        for widget in self.listbox.get(0, tk.END):
-            if widget.guid == ident:
-                # Let connection widget know connection recieved message
-                widget.notify()
-                break
+        widget = self.connection_widgets.get(ident)
+
+        if widget is not None:
+            # Let connection widget know connection recieved message
+            widget.notify()
 
     # CALLBACKS
     def __on_connection_select(self, event):